@@ -1,19 +1,42 @@
 # app.py
 
-from dash import Dash  # Dashフレームワークをインポート。Webアプリケーションの作成に使用される
-import webbrowser       # デフォルトのWebブラウザを操作するためのモジュール
-from threading import Timer  # スレッドを使用して時間ベースの操作を可能にするモジュール
+import os               # 環境変数（本番モードの設定など）を読むためのモジュール
 import logging          # ログを出力するためのモジュール。デバッグや問題のトラッキングに役立つ
 import socket           # ネットワーク操作用モジュール。IPアドレスやポートの管理に利用可能
 
+# 本番モード（APP_ENV=production）: ブラウザを開かず、デバッグモードも使わない
+# 開発用の print 出力と DEBUG ログも既定で止める（APP_VERBOSE=1 で有効）
+# 重いモジュール（pandas・geopandas・plotly.express など）は各処理が初めて使うときに読み込むので、
+# 起動してすぐに画面や /ready の要求に応答できる（benchmarks/check_import_time.py で読み込み時間を確認）
+PRODUCTION = os.environ.get('APP_ENV', 'development') == 'production'
+if PRODUCTION:
+    os.environ.setdefault('APP_VERBOSE', '0')
+
+from dash import Dash  # Dashフレームワークをインポート。Webアプリケーションの作成に使用される
+from instrumentation import log_level, register_metrics_route
+from response_cache import register_response_cache
+from tiles import register_tile_routes
+
 # loggingモジュールを使ってログの出力形式とレベル設定
-# logging.DEBUGでデバッグ用の詳細なログを出力
+# 開発時（既定）はlogging.DEBUGでデバッグ用の詳細なログを出力し、APP_VERBOSE=0ではINFO以上だけにする
 # format='%(levelname)s:%(message)s'でログのフォーマット指定
-logging.basicConfig(level=logging.DEBUG, format='%(levelname)s:%(message)s')
+logging.basicConfig(level=log_level(), format='%(levelname)s:%(message)s')
 
 # Dashアプリ全体を管理する土台を作成
 app = Dash(__name__)
 
+# gunicorn などのWSGIサーバーから読み込むFlaskサーバー（例: gunicorn -c gunicorn.conf.py app:server）
+server = app.server
+
+# 各段階の処理時間と応答サイズを /metrics で公開（Prometheus 形式）
+register_metrics_route(server)
+
+# 地図の応答を (市区町村の組, 変数, データの版数) ごとにキャッシュし、コールバックの応答を圧縮する
+register_response_cache(server)
+
+# 生成済みの町丁目のベクトルタイル（python tiles.py build）を /tiles/ 以下で配信
+register_tile_routes(server)
+
 # 他のファイルからlayoutとcallbacksをインポート
 from layout import layout
 from callbacks import register_callbacks
@@ -24,6 +47,17 @@ app.layout = layout
 # コールバック関数の登録
 register_callbacks(app)
 
+# 既定の市区町村をバックグラウンドで読み込み、完了するまで /ready は 503 を返す
+# （WARMUP_CITIES=all で全市区町村、none で無効）
+from layout import default_cities, city_list
+from warmup import setup_warmup
+setup_warmup(app, default_cities, city_list)
+
+# データディレクトリを監視し、変更された市区町村だけをバックグラウンドで読み込み直して差し替える
+# （DATA_WATCH_INTERVAL 秒ごと、0 で無効）
+from data_watcher import start_data_watcher
+start_data_watcher()
+
 # defでget_local_ipという関数を作成
 # hostnameにsocketモジュールでgethostname()関数を使いコンピュータ名を格納
 # returnでsocketモジュールgethostbyname()を使い格納したhostnameのIPアドレスを返す
@@ -34,13 +68,16 @@ def get_local_ip():
 # サーバー起動設定
 # このファイルが直接実行されたときだけ処理を実行するという条件。他ファイルからのインポート無効
 if __name__ == '__main__':
-    # ポート番号を設定
-    port = 8041
+    # ポート番号を設定（環境変数 PORT で変更可能）
+    port = int(os.environ.get('PORT', '8041'))
     # さっき作成した関数を使いIPアドレスを格納
     local_ip = get_local_ip()
-    # Timerモジュールで1秒後に実行。webbrowserモジュールでwebブラウザで指定したURLを開く
-    # fで文字列の中に変数を{}で埋め込めるように。.start()でタイマー開始
-    Timer(1, lambda: webbrowser.open(f'http://{local_ip}:{port}')).start()
+    if not PRODUCTION:
+        # 開発時だけ、Timerモジュールで1秒後にwebbrowserモジュールでwebブラウザで指定したURLを開く
+        # fで文字列の中に変数を{}で埋め込めるように。.start()でタイマー開始
+        import webbrowser
+        from threading import Timer
+        Timer(1, lambda: webbrowser.open(f'http://{local_ip}:{port}')).start()
     # try～exceptでエラーが発生するかもしれないコードを実行する形にし、エラー時クラッシュせずにエラー文表示
     try:
         # IPアドレスを含むアドレスの表示
@@ -48,8 +85,8 @@ if __name__ == '__main__':
         # app.run_serverはDashアプリ起動メソッド
         # host='0.0.0.0'で同じネットワーク内デバイスからもアクセス可能に
         # さっき入力したポート番号で実行
-        # デバッグモードONにする。その際のサーバーのリロード機能を無効にして二重起動を防ぐ場合はuse_reloader=False
-        app.run_server(host='0.0.0.0', port=port, debug=True, use_reloader=False)
+        # 開発時はデバッグモードONにする（本番モードではOFF）。サーバーのリロード機能を無効にして二重起動を防ぐためuse_reloader=False
+        app.run_server(host='0.0.0.0', port=port, debug=not PRODUCTION, use_reloader=False)
     # OSErrorが発生した時にその情報をeに格納
     except OSError as e:
         # ログにエラーの詳細を記録（例: "サーバー起動エラー: [Errno 98] Address already in use"）
@@ -0,0 +1,56 @@
+# background.py
+#
+# 地図のコールバックをバックグラウンドで実行するための Dash のマネージャー（BACKGROUND_CALLBACKS=1 で有効）
+# 市区町村の読み込みに時間がかかっても、サーバーのスレッドを塞がず、読み込みの進み具合を表示できる
+# diskcache（pip install "dash[diskcache]"）が必要。入っていない場合は通常のコールバックで動かす
+# 選択を変えて同じコールバックが呼ばれ直すと、Dash が実行中の古いジョブを止める
+# ジョブは fork された別プロセスで動くので、市区町村の読み込みはサーバーのプロセスで先に始め、
+# ジョブはその完了を（ファイルロックで）待ってから結果を読む（parallel_loader.prefetch_municipalities）
+
+import os
+import logging
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKGROUND_CALLBACKS = os.environ.get('BACKGROUND_CALLBACKS', '0').lower() in ('1', 'true', 'yes', 'on')
+BACKGROUND_CACHE_DIR = os.environ.get('BACKGROUND_CACHE_DIR', os.path.join(BASE_DIR, ".background_cache"))
+
+_manager = None
+
+
+def get_background_manager():
+    # バックグラウンド実行が無効・diskcache が無い場合は None
+    global _manager
+    if not BACKGROUND_CALLBACKS:
+        return None
+    if _manager is None:
+        try:
+            import diskcache
+            from dash import DiskcacheManager
+        except ImportError:
+            logging.warning("diskcache is not installed. Background callbacks are disabled.")
+            return None
+        _manager = DiskcacheManager(diskcache.Cache(BACKGROUND_CACHE_DIR))
+    return _manager
+
+
+def register_load_prefetch(server):
+    # 地図のジョブを始めるリクエスト（結果の問い合わせではないもの）で、選択された市区町村の読み込みを
+    # サーバーのプロセスで始める。応答キャッシュ（response_cache.py）が応答した場合はここまで来ない
+    from flask import request
+    from parallel_loader import enable_shared_loads, prefetch_municipalities
+    from response_cache import UPDATE_PATH, map_inputs
+
+    enable_shared_loads(BACKGROUND_CACHE_DIR)
+
+    @server.before_request
+    def prefetch_map_cities():
+        if request.path != UPDATE_PATH or request.method != 'POST' or request.args.get('cacheKey'):
+            return None
+        parsed = map_inputs(request.get_json(silent=True))
+        if parsed is not None:
+            try:
+                prefetch_municipalities(sorted(parsed[0]))
+            except (FileNotFoundError, KeyError):
+                # 存在しない市区町村などはジョブの中で通常どおりエラーとして扱う
+                pass
+        return None
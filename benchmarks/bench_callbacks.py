@@ -0,0 +1,150 @@
+# benchmarks/bench_callbacks.py
+#
+# Dash のコールバック（地図・色の更新・棒グラフ）を /_dash-update-component に送って計測する
+# 応答時間・ピークメモリ・応答サイズ（圧縮後）と、instrumentation.span で計測した段階ごとの時間を表示する
+# ピークメモリの計測（tracemalloc）は処理時間を数倍に延ばすので、時間だけを見る場合は --no-memory を付ける
+# 使い方: python benchmarks/bench_callbacks.py [--cities 東大阪市 大東市] [--repeat 5] [--no-memory]
+#         python benchmarks/bench_callbacks.py --region /tmp/region --cities 合成市01 合成市02
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import warnings
+import tracemalloc
+import gzip
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_loader_stages import use_region
+
+# ピークメモリを計測するかどうか（--no-memory で無効）
+TRACE_MEMORY = True
+
+# リクエストに付ける Accept-Encoding（--encoding で変更、'' で圧縮なし）
+ACCEPT_ENCODING = 'gzip, br'
+
+
+def make_client():
+    from dash import Dash
+    from layout import layout
+    from callbacks import register_callbacks
+    from instrumentation import register_metrics_route
+    from response_cache import register_response_cache
+
+    app = Dash(__name__)
+    app.layout = layout
+    register_callbacks(app)
+    register_metrics_route(app.server)
+    register_response_cache(app.server)
+    return app.server.test_client()
+
+
+def post(client, output, outputs, inputs, state=None, changed=None):
+    body = {'output': output, 'outputs': outputs, 'inputs': inputs,
+            'changedPropIds': changed or [], 'state': state or []}
+    if TRACE_MEMORY:
+        tracemalloc.start()
+    start = time.perf_counter()
+    response = client.post('/_dash-update-component', json=body, headers={'Accept-Encoding': ACCEPT_ENCODING})
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if TRACE_MEMORY:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    if response.status_code not in (200, 204):
+        raise RuntimeError(f"Callback failed with status {response.status_code}")
+    return response, elapsed, peak
+
+
+def map_request(client, cities, var, state=None, changed='city_selection.value'):
+    outputs = [{'id': 'mapPlot', 'property': 'figure'}, {'id': 'map_state', 'property': 'data'}]
+    inputs = [{'id': 'city_selection', 'property': 'value', 'value': cities},
+              {'id': 'variable', 'property': 'value', 'value': var}]
+    return post(client, '..mapPlot.figure...map_state.data..', outputs, inputs,
+                [{'id': 'map_state', 'property': 'data', 'value': state}], [changed])
+
+
+def bar_request(client, city_town_key, cities):
+    inputs = [{'id': 'mapPlot', 'property': 'clickData', 'value': {'points': [{'location': city_town_key}]}},
+              {'id': 'city_selection', 'property': 'value', 'value': cities}]
+    return post(client, 'barPlot.figure', {'id': 'barPlot', 'property': 'figure'}, inputs,
+                changed=['mapPlot.clickData'])
+
+
+def decode(response):
+    # 圧縮された応答の本体を戻す（br は brotli がある場合のみ）
+    data = response.get_data()
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    if encoding == 'br':
+        import brotli
+        return brotli.decompress(data)
+    return data
+
+
+def report(name, results):
+    times = [elapsed for _, elapsed, _ in results]
+    peak = max(peak for _, _, peak in results)
+    size = results[-1][0].calculate_content_length() or 0
+    print(f"{name:14s} {len(results):4d} {statistics.median(times) * 1000:9.1f} {max(times) * 1000:9.1f} "
+          f"{peak / 1e6:8.1f} {size / 1e3:9.1f}")
+
+
+def main(argv=None):
+    global TRACE_MEMORY, ACCEPT_ENCODING
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', nargs='*', default=['東大阪市', '大東市'])
+    parser.add_argument('--region', help="synthetic_region.py で書き出した合成データのディレクトリ")
+    parser.add_argument('--var', default='age_20_39')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no-memory', action='store_true', help="ピークメモリを計測しない")
+    parser.add_argument('--encoding', default='gzip, br', help="Accept-Encoding（'' で圧縮なし）")
+    args = parser.parse_args(argv)
+    TRACE_MEMORY = not args.no_memory
+    ACCEPT_ENCODING = args.encoding
+    warnings.filterwarnings('ignore')
+    if args.region:
+        use_region(args.region)
+    os.environ['APP_VERBOSE'] = '0'
+
+    from data_loader import load_municipality_data
+    from instrumentation import get_metrics
+    from response_cache import get_figure_cache
+
+    client = make_client()
+    metrics = get_metrics()
+    metrics.reset()
+    keys = [load_municipality_data(city)['city_town_key'].iloc[0] for city in args.cities]
+    metrics.reset()
+
+    print(f"{'callback':14s} {'runs':>4s} {'median ms':>9s} {'max ms':>9s} {'peak MB':>8s} {'resp KB':>9s}")
+    cold = map_request(client, args.cities, args.var)
+    report('map (first)', [cold])
+    rebuilt = []
+    for _ in range(args.repeat):
+        # 応答キャッシュを空にして図を作り直す
+        get_figure_cache().clear()
+        rebuilt.append(map_request(client, args.cities, args.var))
+    report('map (rebuilt)', rebuilt)
+    report('map (cached)', [map_request(client, args.cities, args.var) for _ in range(args.repeat)])
+
+    state = json.loads(decode(cold[0]))['response']['map_state']['data']
+    patches = [map_request(client, args.cities, var, state, changed='variable.value')
+               for var in ['age_10_14', args.var] * args.repeat]
+    report('map (colors)', patches)
+    report('bar', [bar_request(client, keys[i % len(keys)], args.cities) for i in range(args.repeat * 4)])
+
+    print()
+    print(f"{'stage':28s} {'count':>6s} {'mean ms':>8s}")
+    for stage, (count, total_time) in sorted(metrics.snapshot().items()):
+        print(f"{stage:28s} {count:6d} {total_time / count * 1000:8.1f}")
+    metrics_response = client.get('/metrics')
+    print(f"/metrics: {metrics_response.status_code}, {len(metrics_response.data)} bytes")
+
+
+if __name__ == '__main__':
+    main()
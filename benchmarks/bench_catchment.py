@@ -0,0 +1,62 @@
+# benchmarks/bench_catchment.py
+#
+# 商圏人口の一括推計（catchment.radius_catchments）の処理時間
+# 一部の候補地は、全町丁目との交差を1件ずつ計算した結果と照合する
+# 使い方: python benchmarks/bench_catchment.py [--cities 東大阪市 大東市] [--sites 5000] [--radius 1000]
+
+import os
+import sys
+import time
+import argparse
+import warnings
+import numpy as np
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catchment import QUAD_SEGMENTS, get_engine, radius_catchments
+
+
+def naive_catchment(engine, circle):
+    share = np.minimum(shapely.area(shapely.intersection(circle, engine.geometries)) / engine.areas, 1.0)
+    return share @ engine.values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', nargs='*', default=['東大阪市', '大東市', '門真市'])
+    parser.add_argument('--sites', type=int, default=5000)
+    parser.add_argument('--radius', type=float, default=1000.0)
+    parser.add_argument('--check', type=int, default=100, help="素朴な実装と照合する候補地の数")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    warnings.filterwarnings('ignore')
+
+    start = time.perf_counter()
+    engine = get_engine(args.cities)
+    print(f"engine for {args.cities}: {len(engine.keys)} towns in {time.perf_counter() - start:.2f} s")
+
+    # 候補地は町丁目の代表点からランダムに選ぶ
+    rng = np.random.default_rng(args.seed)
+    centers = shapely.point_on_surface(engine.geometries[rng.integers(0, len(engine.keys), args.sites)])
+    lonlat = shapely.get_coordinates(
+        shapely.transform(centers, lambda xy: np.column_stack(
+            engine._to_projected.transform(xy[:, 0], xy[:, 1], direction='INVERSE')))
+    )
+
+    start = time.perf_counter()
+    result = radius_catchments(args.cities, lonlat[:, 1], lonlat[:, 0], args.radius)
+    elapsed = time.perf_counter() - start
+    print(f"{args.sites} sites (radius {args.radius:.0f} m) in {elapsed:.2f} s: {args.sites / elapsed:,.0f} sites/s")
+
+    circles = shapely.buffer(engine.project_points(lonlat[:args.check, 1], lonlat[:args.check, 0]),
+                             args.radius, quad_segs=QUAD_SEGMENTS)
+    expected = np.array([naive_catchment(engine, circle) for circle in circles])
+    equal = np.allclose(expected, result[engine.columns].to_numpy()[:args.check], rtol=1e-9, atol=1e-6)
+    print(f"matches per-site intersection on {len(circles)} sites: {equal}")
+    if not equal:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# benchmarks/bench_dissolve.py
+#
+# 重複町名のポリゴン結合: 旧来の groupby.apply + unary_union と dissolve_duplicate_towns の比較
+# 使い方: python benchmarks/bench_dissolve.py [--cities 高槻市 東大阪市] [--split 4] [--repeat 3]
+
+import os
+import sys
+import time
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely.ops import unary_union
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_loader import find_shapefile, read_shapefile
+from dissolve import dissolve_duplicate_towns
+
+
+# 以前 data_loader 内にあった実装（比較用にそのまま残す）
+def legacy_dissolve(map_data_town):
+    duplicated_names = map_data_town[map_data_town['S_NAME'].duplicated(keep=False)]['S_NAME'].unique()
+    if len(duplicated_names) == 0:
+        return map_data_town
+    filtered_shape_data = map_data_town[map_data_town['S_NAME'].isin(duplicated_names)]
+    if 'AREA' not in filtered_shape_data.columns:
+        filtered_shape_data['AREA'] = filtered_shape_data.geometry.area
+
+    def aggregate_data(group):
+        max_area_row = group.loc[group['AREA'].idxmax()]
+        merged_geometry = unary_union(group.geometry)
+        aggregated_data = max_area_row.copy()
+        aggregated_data.geometry = merged_geometry
+        aggregated_data['KIGO_E'] = 'E1'
+        return aggregated_data
+
+    merged_geometries = filtered_shape_data.groupby('S_NAME').apply(aggregate_data)
+    merged_shape_data = gpd.GeoDataFrame(merged_geometries, geometry='geometry', crs=map_data_town.crs)
+    map_data_town = map_data_town[~map_data_town['S_NAME'].isin(duplicated_names)]
+    return pd.concat([map_data_town, merged_shape_data], ignore_index=True)
+
+
+def split_polygons(gdf, parts):
+    # 各ポリゴンを縦に parts 分割して、分割された町丁目が多い市区町村を模擬する
+    rows = []
+    for _, row in gdf.iterrows():
+        minx, miny, maxx, maxy = row.geometry.bounds
+        step = (maxx - minx) / parts
+        for i in range(parts):
+            piece = row.geometry.intersection(shapely.box(minx + i * step, miny, minx + (i + 1) * step, maxy))
+            if piece.is_empty:
+                continue
+            new_row = row.copy()
+            new_row['geometry'] = piece
+            new_row['AREA'] = piece.area
+            rows.append(new_row)
+    return gpd.GeoDataFrame(rows, geometry='geometry', crs=gdf.crs).reset_index(drop=True)
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', nargs='*', default=['高槻市', '東大阪市', '門真市'])
+    parser.add_argument('--split', type=int, default=4, help="合成データで各ポリゴンを何分割するか")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+    warnings.filterwarnings('ignore')
+
+    for city in args.cities:
+        source = read_shapefile(find_shapefile(city)).to_crs(epsg=4326)
+        for label, gdf in [('original', source), (f'split x{args.split}', split_polygons(source, args.split))]:
+            expected, legacy_time = timed(lambda: legacy_dissolve(gdf), args.repeat)
+            (actual, _), new_time = timed(lambda: dissolve_duplicate_towns(gdf), args.repeat)
+
+            # 行の並び・属性・ジオメトリが旧実装と一致すること
+            same_rows = expected['S_NAME'].tolist() == actual['S_NAME'].tolist()
+            same_keys = expected['KEY_CODE'].tolist() == actual['KEY_CODE'].tolist()
+            same_geoms = bool(np.all(shapely.equals(np.asarray(expected.geometry.values, dtype=object),
+                                                     np.asarray(actual.geometry.values, dtype=object))))
+            print(f"{city} {label:10s} rows {len(gdf):5d} -> {len(actual):4d}  "
+                  f"legacy {legacy_time * 1000:8.1f} ms  new {new_time * 1000:7.1f} ms  "
+                  f"speedup {legacy_time / new_time:5.1f}x  equal {same_rows and same_keys and same_geoms}")
+            if not (same_rows and same_keys and same_geoms):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
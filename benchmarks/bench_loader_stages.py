@@ -0,0 +1,73 @@
+# benchmarks/bench_loader_stages.py
+#
+# 市区町村データの加工（data_loader.build_municipality_data）の段階ごとの処理時間とピークメモリ
+# 段階は instrumentation.span で計測したもの（CSV読み込み・シェイプファイル読み込み・座標変換・結合など）
+# 使い方: python benchmarks/bench_loader_stages.py [--cities 高槻市 東大阪市] [--repeat 3]
+#         python benchmarks/bench_loader_stages.py --region /tmp/region   （synthetic_region.py の合成データ）
+
+import os
+import sys
+import time
+import argparse
+import warnings
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def use_region(region_dir):
+    # 合成データを読むように、data_loader などを読み込む前に環境変数を設定する
+    from synthetic_region import CSV_NAME
+    region_dir = os.path.abspath(region_dir)
+    os.environ['MUNICIPALITY_DATA_DIR'] = region_dir
+    os.environ['CENSUS_FILES'] = os.path.join(region_dir, CSV_NAME)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', nargs='*', help="省略時は全市区町村")
+    parser.add_argument('--region', help="synthetic_region.py で書き出した合成データのディレクトリ")
+    parser.add_argument('--repeat', type=int, default=1, help="市区町村ごとの繰り返し回数")
+    args = parser.parse_args(argv)
+    warnings.filterwarnings('ignore')
+    if args.region:
+        use_region(args.region)
+    os.environ['APP_VERBOSE'] = '0'
+
+    from bundle import list_municipalities
+    from census_store import get_census_store
+    from data_loader import build_municipality_data
+    from instrumentation import get_metrics
+
+    cities = args.cities or list_municipalities()
+    metrics = get_metrics()
+    metrics.reset()
+
+    print(f"{'municipality':16s} {'rows':>6s} {'wall s':>7s} {'peak MB':>8s}")
+    total_start = time.perf_counter()
+    for city in cities:
+        for _ in range(args.repeat):
+            # 国勢調査の市区町村ごとのキャッシュを空にして、CSVの読み込みから計測する
+            get_census_store().invalidate()
+            tracemalloc.start()
+            start = time.perf_counter()
+            frame = build_municipality_data(city)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        print(f"{city:16s} {len(frame):6d} {elapsed:7.3f} {peak / 1e6:8.1f}")
+    total = time.perf_counter() - total_start
+
+    # tracemalloc を有効にした状態の時間なので、段階どうしの比較に使う
+    stages = metrics.snapshot()
+    print()
+    print(f"{'stage':24s} {'count':>6s} {'total s':>8s} {'mean ms':>8s} {'share':>6s}")
+    measured = sum(total_time for _, total_time in stages.values())
+    for stage, (count, total_time) in sorted(stages.items(), key=lambda item: -item[1][1]):
+        print(f"{stage:24s} {count:6d} {total_time:8.3f} {total_time / count * 1000:8.1f} "
+              f"{total_time / measured * 100:5.1f}%")
+    print(f"total {total:.2f} s for {len(cities)} municipalities x {args.repeat}")
+
+
+if __name__ == '__main__':
+    main()
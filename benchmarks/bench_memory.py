@@ -0,0 +1,46 @@
+# benchmarks/bench_memory.py
+#
+# 市区町村ごとのメモリ量（読み込んだ GeoDataFrame と、キャッシュ内の圧縮した表現）
+# 使い方: python benchmarks/bench_memory.py [--cities 高槻市 東大阪市] [--workers 4]
+
+import os
+import sys
+import argparse
+import warnings
+import contextlib
+import io
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bundle import list_municipalities
+from data_loader import load_municipality_data, get_memory_report
+from slim import memory_report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', nargs='*', help="省略時は全市区町村")
+    parser.add_argument('--workers', type=int, default=4, help="見積もりに使うワーカー数")
+    args = parser.parse_args(argv)
+    warnings.filterwarnings('ignore')
+
+    cities = args.cities or list_municipalities()
+    frames = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for city in cities:
+            frames[city] = load_municipality_data(city)
+    cached = get_memory_report()
+
+    print(f"{'municipality':16s} {'rows':>5s} {'attrs MB':>9s} {'geom MB':>8s} {'frame MB':>9s} {'cached MB':>10s}")
+    total = 0
+    for city, frame in frames.items():
+        report = memory_report(frame)
+        total += cached.get(city, 0)
+        print(f"{city:16s} {report['rows']:5d} {report['attribute_bytes'] / 1e6:9.2f} "
+              f"{report['geometry_bytes'] / 1e6:8.2f} {report['total_bytes'] / 1e6:9.2f} "
+              f"{cached.get(city, 0) / 1e6:10.2f}")
+    print(f"cache total {total / 1e6:.2f} MB per worker, {total * args.workers / 1e6:.2f} MB for {args.workers} workers")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# benchmarks/bench_normalize.py
+#
+# 名前の正規化: 旧来の1行ずつの preprocess_name と normalize_names の結果比較と速度計測
+# 使い方: python benchmarks/bench_normalize.py [--repeat 5]
+
+import os
+import sys
+import time
+import argparse
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from census_store import DEFAULT_POP_FILE
+from name_normalizer import normalize_names, preprocess_name
+
+
+# 以前 data_loader 内にあった実装（tests/test_name_normalizer.py の比較対象としてそのまま残す）
+def legacy_preprocess_name(name):
+    def zenkaku_to_hankaku(text):
+        if isinstance(text, str):
+            return text.translate(str.maketrans('０１２３４５６７８９', '0123456789'))
+        return text
+
+    kanji_numbers = {
+        '0': '零', '1': '一', '2': '二', '3': '三', '4': '四',
+        '5': '五', '6': '六', '7': '七', '8': '八', '9': '九',
+        '10': '十', '11': '十一', '12': '十二', '13': '十三', '14': '十四',
+        '15': '十五', '16': '十六', '17': '十七', '18': '十八', '19': '十九',
+        '20': '二十'
+    }
+
+    def arabic_to_kanji_converter(text):
+        if isinstance(text, str):
+            for num, kanji in sorted(kanji_numbers.items(), key=lambda x: -len(x[0])):
+                text = text.replace(num + '丁目', kanji + '丁目')
+            return text
+        return text
+
+    if pd.isnull(name):
+        return ''
+    name = str(name)
+    name = name.strip()
+    name = name.replace('　', '')
+    name = name.replace(' ', '')
+    name = zenkaku_to_hankaku(name)
+    name = arabic_to_kanji_converter(name)
+    return name.lower()
+
+
+def sample_names():
+    raw = pd.read_csv(DEFAULT_POP_FILE, encoding='shift_jis', skiprows=1, dtype=str)
+    names = pd.concat([raw['Unnamed: 2'], raw['Unnamed: 3']], ignore_index=True)
+    # 表記ゆれのパターンを追加（全角数字・スペース・欠損値）
+    extra = pd.Series(['本町１丁目', ' 北条 ２丁目 ', '南町　１５丁目', None, '東町20丁目', 'ABC町3丁目'])
+    return pd.concat([names, extra], ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    names = sample_names()
+
+    # 20丁目以下の範囲では旧実装と完全に一致すること
+    expected = names.apply(legacy_preprocess_name)
+    actual = normalize_names(names)
+    mismatches = (expected != actual).sum()
+    scalar_mismatches = (names.apply(preprocess_name) != actual).sum()
+    print(f"names: {len(names)}, mismatches vs legacy: {mismatches}, scalar vs vectorized: {scalar_mismatches}")
+    if mismatches or scalar_mismatches:
+        print(pd.DataFrame({'name': names, 'legacy': expected, 'new': actual})[expected != actual].head(20))
+        sys.exit(1)
+
+    # 21丁目以上は旧実装では正しく変換されなかったもの
+    print(normalize_names(pd.Series(['本町21丁目', '本町１００丁目'])).tolist())
+
+    for label, func in [('legacy apply', lambda: names.apply(legacy_preprocess_name)),
+                        ('normalize_names', lambda: normalize_names(names))]:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        print(f"{label:16s} best {min(timings) * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
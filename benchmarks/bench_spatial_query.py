@@ -0,0 +1,77 @@
+# benchmarks/bench_spatial_query.py
+#
+# 点 → 町丁目の一括判定（spatial_query.locate_points）のスループット
+# 読み込んだ全市区町村の範囲に一様乱数で点を置き、1秒あたりの判定数を測る（目標: 10万点/秒）
+# 一部の点は町丁目ごとに contains で1点ずつ判定した結果と照合する
+# 使い方: python benchmarks/bench_spatial_query.py [--cities 高槻市 東大阪市] [--points 200000] [--repeat 3]
+
+import os
+import sys
+import time
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bundle import list_municipalities
+from parallel_loader import load_municipalities
+from spatial_query import ensure_indexed, locate_points
+
+TARGET_POINTS_PER_SECOND = 100_000
+
+
+def naive_locate(frame, lat, lon):
+    # 1点ずつ全ポリゴンを調べる素朴な実装（照合用）
+    result = []
+    for y, x in zip(lat, lon):
+        point = shapely.Point(x, y)
+        found = frame[frame.geometry.intersects(point)]
+        result.append(found['city_town_key'].iloc[0] if len(found) else None)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', nargs='*', help="省略時は全市区町村")
+    parser.add_argument('--points', type=int, default=200_000)
+    parser.add_argument('--check', type=int, default=500, help="素朴な実装と照合する点の数")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    warnings.filterwarnings('ignore')
+
+    cities = args.cities or list_municipalities()
+    start = time.perf_counter()
+    ensure_indexed(cities)
+    print(f"indexed {len(cities)} municipalities in {time.perf_counter() - start:.2f} s")
+
+    frame = pd.concat(load_municipalities(cities).values(), ignore_index=True)
+    minx, miny, maxx, maxy = frame.total_bounds
+    rng = np.random.default_rng(args.seed)
+    lat = rng.uniform(miny, maxy, args.points)
+    lon = rng.uniform(minx, maxx, args.points)
+
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        keys = locate_points(lat, lon, cities)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    rate = args.points / best
+    matched = sum(key is not None for key in keys)
+    print(f"{args.points} points ({matched} inside a town) in {best * 1000:.1f} ms: "
+          f"{rate:,.0f} points/s (target {TARGET_POINTS_PER_SECOND:,})")
+
+    sample = slice(0, args.check)
+    expected = naive_locate(frame, lat[sample], lon[sample])
+    equal = list(keys[sample]) == expected
+    print(f"matches per-point lookup on {len(expected)} points: {equal}")
+    if not equal or rate < TARGET_POINTS_PER_SECOND:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
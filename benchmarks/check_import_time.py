@@ -0,0 +1,130 @@
+# benchmarks/check_import_time.py
+#
+# 本番モード（APP_ENV=production）で app.py を読み込む時間を `python -X importtime` で計測し、予算と比べる
+# pandas・geopandas・pyproj・shapely・plotly.express が起動時に読み込まれていないことも確認する
+# （これらは各処理が初めて使うときに読み込む。起動時に読み込まれると、ポッドを増やしたときに応答できるまでが遅くなる）
+# 使い方: python benchmarks/check_import_time.py [--budget-ms 1200] [--repeat 3]
+# 予算を超えた・起動時に読み込んではいけないモジュールが読み込まれた場合は終了コード 1 を返す
+# CI では同じ判定を tests/test_import_time.py で行う（こちらは遅いモジュールの内訳と最初の応答までの時間も表示する）
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 起動時に読み込まないモジュール
+DEFERRED_MODULES = ['pandas', 'geopandas', 'pyproj', 'shapely', 'plotly.express', 'pyarrow']
+
+# 変更前（起動時に全て読み込んでいたとき）は約 1450 ms
+IMPORT_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_MS', '1200'))
+
+# 起動してから最初の要求（画面のレイアウト）に応答するまでを計測するスクリプト
+FIRST_REQUEST_SCRIPT = """
+import time
+started = time.perf_counter()
+import app
+client = app.server.test_client()
+for path in ('/', '/_dash-layout', '/_dash-dependencies'):
+    assert client.get(path).status_code == 200, path
+print(f"{(time.perf_counter() - started) * 1000:.1f}")
+"""
+
+
+def production_env():
+    env = dict(os.environ)
+    # ウォームアップと監視のスレッドは読み込みと並行して動き、計測結果に混ざるので止める
+    env.update(APP_ENV='production', WARMUP_CITIES='none', DATA_WATCH_INTERVAL='0')
+    return env
+
+
+def parse_importtime(stderr):
+    # (自身の時間 [us], 累積 [us], 深さ, モジュール名) のリスト
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        # モジュール名の前の空白は、2つで1段深い（そのモジュールを読み込んだモジュールの中で読み込まれた）
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+def app_children(rows):
+    # importtime は読み込みが終わった順に出力するので、app の直前の深さ0の行より後ろが app の中身
+    end = next(i for i, (_, _, depth, name) in enumerate(rows) if name == 'app' and depth == 0)
+    start = max((i for i in range(end) if rows[i][2] == 0), default=-1) + 1
+    return [row for row in rows[start:end] if row[2] == 1]
+
+
+def measure_import():
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT_DIR,
+                            env=production_env(), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"app.py could not be imported:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def measure_first_request():
+    result = subprocess.run([sys.executable, '-c', FIRST_REQUEST_SCRIPT], cwd=ROOT_DIR, env=production_env(),
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"First request failed:\n{result.stderr[-2000:]}")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def app_import_ms(rows):
+    return next(cumulative for _, cumulative, depth, name in rows if name == 'app' and depth == 0) / 1000
+
+
+def measure_median_import(repeat):
+    # 読み込み時間の中央値 [ms]、各回の時間、中央値の回の importtime の行
+    runs = [measure_import() for _ in range(repeat)]
+    totals = [app_import_ms(rows) for rows in runs]
+    total_ms = statistics.median(totals)
+    return total_ms, totals, runs[totals.index(sorted(totals)[len(totals) // 2])]
+
+
+def deferred_imports(rows):
+    # 起動時に読み込まれてしまった、読み込みを遅らせるはずのモジュール
+    imported = {name for _, _, _, name in rows}
+    return [module for module in DEFERRED_MODULES if module in imported]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS, help="app.py の読み込み時間の上限 [ms]")
+    parser.add_argument('--repeat', type=int, default=3, help="計測の回数（中央値で判定する）")
+    parser.add_argument('--top', type=int, default=10, help="表示する遅いモジュールの数")
+    args = parser.parse_args(argv)
+
+    total_ms, totals, rows = measure_median_import(args.repeat)
+
+    print(f"import app (APP_ENV=production): median {total_ms:.1f} ms "
+          f"(runs: {', '.join(f'{t:.1f}' for t in totals)}), budget {args.budget_ms:.0f} ms")
+    print("\nSlowest imports under app (cumulative):")
+    children = sorted(app_children(rows), key=lambda row: -row[1])[:args.top]
+    for _, cumulative, _, name in children:
+        print(f"  {name:<32} {cumulative / 1000:>8.1f} ms")
+
+    first_request_ms = measure_first_request()
+    print(f"\nImport + first requests (/, /_dash-layout, /_dash-dependencies): {first_request_ms:.1f} ms")
+
+    failures = []
+    if total_ms > args.budget_ms:
+        failures.append(f"import time {total_ms:.1f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+    for module in deferred_imports(rows):
+        failures.append(f"{module} is imported at startup")
+    if failures:
+        print("\nFAILED:\n  " + "\n  ".join(failures))
+        return 1
+    print("\nOK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
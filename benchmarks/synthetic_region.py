@@ -0,0 +1,180 @@
+# benchmarks/synthetic_region.py
+#
+# ベンチマーク用の合成データ（都道府県規模）を書き出す
+# 市区町村ごとのシェイプファイル（EPSG:2448、実データと同じDBFの列）と、
+# e-Stat と同じ2行見出し・Shift_JIS の国勢調査CSV（tblT001082C99.csv）を作る
+# 使い方: python benchmarks/synthetic_region.py /tmp/region [--cities 40] [--towns 300] [--vertices 40]
+# 読み込み: MUNICIPALITY_DATA_DIR=/tmp/region CENSUS_FILES=/tmp/region/tblT001082C99.csv python app.py
+
+import os
+import sys
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PREF_CODE = 99
+PREF_NAME = '合成県'
+CSV_NAME = f'tblT001082C{PREF_CODE}.csv'
+
+# 町丁目1つの大きさ [m]（大阪府の町丁目のおおよその大きさ）と、市区町村を並べる原点（EPSG:2448）
+CELL_SIZE = 400.0
+ORIGIN = (-60000.0, -180000.0)
+
+# CSVの年齢階級（見出しの表記）
+AGE_BANDS = ['０〜４', '５〜９', '１０〜１４', '１５〜１９', '２０〜２４', '２５〜２９', '３０〜３４', '３５〜３９',
+             '４０〜４４', '４５〜４９', '５０〜５４', '５５〜５９', '６０〜６４', '６５〜６９', '７０〜７４']
+
+# シェイプファイルのDBFの列（実データの列順）
+DBF_COLUMNS = ['KEY_CODE', 'PREF', 'CITY', 'S_AREA', 'PREF_NAME', 'CITY_NAME', 'S_NAME', 'KIGO_E', 'HCODE',
+               'AREA', 'PERIMETER', 'H27KAxx_', 'H27KAxx_ID', 'KEN', 'KEN_NAME', 'SITYO_NAME', 'GST_NAME',
+               'CSS_NAME', 'KIHON1', 'DUMMY1', 'KIHON2', 'KEYCODE1', 'KEYCODE2', 'AREA_MAX_F', 'KIGO_D',
+               'N_KEN', 'N_CITY', 'KIGO_I', 'MOJI', 'KBSUM', 'JINKO', 'SETAI', 'X_CODE', 'Y_CODE', 'KCODE1']
+
+
+def header_lines():
+    # 1行目は列コード、2行目は見出し（総数・男・女 × 総数、年齢階級、15歳未満などの集計）
+    labels = []
+    for prefix, total in (('総数', '総数、年齢「不詳」含む'), ('男', '男の総数、年齢「不詳」含む'),
+                          ('女', '女の総数、年齢「不詳」含む')):
+        labels.append(total)
+        labels.extend(f'{prefix}{band}歳' for band in AGE_BANDS)
+        labels.extend([f'{prefix}１５歳未満', f'{prefix}１５〜６４歳', f'{prefix}６５歳以上', f'{prefix}７５歳以上'])
+    codes = ['KEY_CODE', 'HYOSYO', 'CITYNAME', 'NAME', 'HTKSYORI', 'HTKSAKI', 'GASSAN']
+    codes += [f'T001082{i:03d}' for i in range(1, len(labels) + 1)]
+    return ','.join(codes), ',' * 7 + ','.join(labels)
+
+
+def count_block(male, female):
+    # 男・女の年齢階級（16区分、最後が75歳以上）から CSV の60列を作る
+    values = []
+    for bands in (male + female, male, female):
+        values.append(bands.sum(axis=1))
+        values.extend(bands[:, i] for i in range(15))
+        values.extend([bands[:, :3].sum(axis=1), bands[:, 3:13].sum(axis=1),
+                       bands[:, 13:].sum(axis=1), bands[:, 15]])
+    return np.column_stack(values)
+
+
+def town_polygons(city_index, towns, vertices, rng):
+    # 市区町村を格子状に並べ、町丁目は格子の正方形の辺に頂点を足してゆがめたポリゴンにする
+    # 頂点は隣り合う町丁目と共有する（境界の共有を前提にした簡略化がそのまま動くように）
+    columns = int(np.ceil(np.sqrt(towns)))
+    rows = int(np.ceil(towns / columns))
+    steps = max(vertices // 4, 1)
+    step = CELL_SIZE / steps
+    city_columns = 8
+    city_x = ORIGIN[0] + (city_index % city_columns) * (columns + 1) * CELL_SIZE
+    city_y = ORIGIN[1] + (city_index // city_columns) * (columns + 1) * CELL_SIZE
+    xs = city_x + np.arange(columns * steps + 1) * step
+    ys = city_y + np.arange(rows * steps + 1) * step
+    lattice_x, lattice_y = np.meshgrid(xs, ys, indexing='ij')
+    lattice_x = lattice_x + rng.uniform(-0.3, 0.3, lattice_x.shape) * step
+    lattice_y = lattice_y + rng.uniform(-0.3, 0.3, lattice_y.shape) * step
+
+    polygons = []
+    for index in range(towns):
+        i0, j0 = (index % columns) * steps, (index // columns) * steps
+        i1, j1 = i0 + steps, j0 + steps
+        ring_i = np.concatenate([np.arange(i0, i1), np.full(steps, i1), np.arange(i1, i0, -1), np.full(steps, i0)])
+        ring_j = np.concatenate([np.full(steps, j0), np.arange(j0, j1), np.full(steps, j1), np.arange(j1, j0, -1)])
+        polygons.append(shapely.Polygon(np.column_stack([lattice_x[ring_i, ring_j], lattice_y[ring_i, ring_j]])))
+    return np.array(polygons, dtype=object)
+
+
+def generate_region(output_dir, cities=40, towns=300, vertices=40, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    code_line, label_line = header_lines()
+    csv_lines = [code_line, label_line]
+
+    for city_index in range(cities):
+        city_code = 101 + city_index
+        city_name = f'合成市{city_index + 1:02d}'
+        town_numbers = np.arange(1, towns + 1)
+        town_names = [f'合成町{number:04d}' for number in town_numbers]
+        key_codes = [f'{PREF_CODE:02d}{city_code:03d}{number:04d}' for number in town_numbers]
+
+        # 年齢階級別人口（町丁目ごとに規模をばらつかせる）
+        scale = rng.lognormal(4.5, 0.8, (towns, 1))
+        male = rng.poisson(scale * rng.dirichlet(np.ones(16) * 4, towns) * 8).astype(np.int64)
+        female = rng.poisson(scale * rng.dirichlet(np.ones(16) * 4, towns) * 8).astype(np.int64)
+        counts = count_block(male, female)
+
+        # 市区町村の合計行（HYOSYO 1）と町丁目の行（HYOSYO 3）
+        csv_lines.append(f'{PREF_CODE:02d}{city_code:03d},1,{city_name},,0,,,'
+                         + ','.join(str(v) for v in counts.sum(axis=0)))
+        for key_code, town_name, row in zip(key_codes, town_names, counts):
+            csv_lines.append(f'{key_code},3,{city_name},{town_name},0,,,' + ','.join(str(v) for v in row))
+
+        polygons = town_polygons(city_index, towns, vertices, rng)
+        centroids = gpd.GeoSeries(shapely.centroid(polygons), crs='EPSG:2448').to_crs(epsg=4326)
+        frame = pd.DataFrame({
+            'KEY_CODE': key_codes,
+            'PREF': f'{PREF_CODE:02d}',
+            'CITY': f'{city_code:03d}',
+            'S_AREA': [f'{number:04d}00' for number in town_numbers],
+            'PREF_NAME': PREF_NAME,
+            'CITY_NAME': city_name,
+            'S_NAME': town_names,
+            'KIGO_E': None,
+            'HCODE': 8101,
+            'AREA': shapely.area(polygons),
+            'PERIMETER': shapely.length(polygons),
+            'H27KAxx_': town_numbers + city_index * towns,
+            'H27KAxx_ID': town_numbers + city_index * towns - 1,
+            'KEN': f'{PREF_CODE:02d}',
+            'KEN_NAME': PREF_NAME,
+            'SITYO_NAME': None,
+            'GST_NAME': city_name,
+            'CSS_NAME': None,
+            'KIHON1': [f'{number:04d}' for number in town_numbers],
+            'DUMMY1': '-',
+            'KIHON2': '00',
+            'KEYCODE1': [f'{city_code:03d}{number:04d}00' for number in town_numbers],
+            'KEYCODE2': [f'{city_code:03d}{number:04d}' for number in town_numbers],
+            'AREA_MAX_F': 'M',
+            'KIGO_D': None,
+            'N_KEN': None,
+            'N_CITY': None,
+            'KIGO_I': None,
+            'MOJI': town_names,
+            'KBSUM': 1,
+            'JINKO': counts[:, 0],
+            'SETAI': (counts[:, 0] * 0.45).astype(np.int64),
+            'X_CODE': centroids.x.round(5).to_numpy(),
+            'Y_CODE': centroids.y.round(5).to_numpy(),
+            'KCODE1': [f'{number:04d}-00' for number in town_numbers],
+        }, columns=DBF_COLUMNS)
+        gdf = gpd.GeoDataFrame(frame, geometry=polygons, crs='EPSG:2448')
+        city_dir = os.path.join(output_dir, city_name)
+        os.makedirs(city_dir, exist_ok=True)
+        gdf.to_file(os.path.join(city_dir, f'{city_name}.shp'), encoding='utf-8')
+
+    csv_path = os.path.join(output_dir, CSV_NAME)
+    with open(csv_path, 'w', encoding='shift_jis', newline='') as f:
+        f.write('\r\n'.join(csv_lines) + '\r\n')
+    return csv_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成データを書き出します。")
+    parser.add_argument('output', help="出力先ディレクトリ")
+    parser.add_argument('--cities', type=int, default=40, help="市区町村の数")
+    parser.add_argument('--towns', type=int, default=300, help="市区町村あたりの町丁目の数")
+    parser.add_argument('--vertices', type=int, default=40, help="町丁目ポリゴンあたりのおおよその頂点数")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    warnings.filterwarnings('ignore')
+
+    csv_path = generate_region(args.output, args.cities, args.towns, args.vertices, args.seed)
+    print(f"{args.cities} municipalities x {args.towns} towns written to {args.output}")
+    print(f"MUNICIPALITY_DATA_DIR={os.path.abspath(args.output)} CENSUS_FILES={os.path.abspath(csv_path)}")
+
+
+if __name__ == '__main__':
+    main()
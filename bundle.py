@@ -0,0 +1,190 @@
+# bundle.py
+#
+# 事前に加工済みの市区町村データをGeoParquet（ジオメトリはWKB）として書き出すオフラインビルド
+# 使い方: python bundle.py build [--cities 大東市 東大阪市] [--output bundle]
+
+import os
+import json
+import hashlib
+import logging
+import argparse
+from datetime import datetime, timezone
+from instrumentation import echo
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get('MUNICIPALITY_DATA_DIR', os.path.join(BASE_DIR, "data"))
+BUNDLE_DIR = os.environ.get('DATA_BUNDLE_DIR', os.path.join(BASE_DIR, "bundle"))
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# GeoParquet に残らない frame.attrs のうち、マニフェストに入れて読み込み時に戻すもの
+BUNDLED_ATTRS = ('census_match', 'extent')
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_files(municipality_name):
+    # 市区町村データの元になるファイル（シェイプファイル一式と国勢調査CSV）
+    from data_loader import find_shapefile, census_files_for, SHAPEFILE_PARTS
+
+    stem = os.path.splitext(find_shapefile(municipality_name))[0]
+    paths = [stem + ext for ext in SHAPEFILE_PARTS] + census_files_for(municipality_name)
+    return [path for path in paths if os.path.exists(path)]
+
+
+def describe_sources(municipality_name):
+    sources = {}
+    for path in source_files(municipality_name):
+        stat = os.stat(path)
+        sources[os.path.relpath(path, BASE_DIR)] = {
+            'sha256': file_sha256(path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+        }
+    return sources
+
+
+def list_municipalities(data_dir=DATA_DIR):
+    return sorted(name for name in os.listdir(data_dir)
+                  if os.path.isdir(os.path.join(data_dir, name)) and not name.startswith('.'))
+
+
+def bundle_file_name(municipality_name):
+    return f"{municipality_name}.parquet"
+
+
+def read_manifest(bundle_dir=BUNDLE_DIR):
+    manifest_path = os.path.join(bundle_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(manifest, bundle_dir=BUNDLE_DIR):
+    # 書き込み途中のマニフェストを読まれないように一時ファイル経由で置き換える
+    manifest_path = os.path.join(bundle_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def current_manifest(bundle_dir=BUNDLE_DIR):
+    # 今の加工処理で作ったマニフェスト（無い・加工処理が古い場合は空のもの）
+    from data_loader import PIPELINE_VERSION
+
+    manifest = read_manifest(bundle_dir)
+    if manifest is None or manifest.get('pipeline_version') != PIPELINE_VERSION:
+        manifest = {'version': MANIFEST_VERSION, 'pipeline_version': PIPELINE_VERSION, 'cities': {}}
+    return manifest
+
+
+def write_bundle_entry(municipality_name, map_data_town, sources, bundle_dir=BUNDLE_DIR):
+    # 1市区町村分を書き出し、マニフェストに載せるエントリを返す
+    file_name = bundle_file_name(municipality_name)
+    tmp_path = os.path.join(bundle_dir, file_name + f'.tmp{os.getpid()}')
+    map_data_town.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, os.path.join(bundle_dir, file_name))
+    attrs = {key: map_data_town.attrs[key] for key in BUNDLED_ATTRS if key in map_data_town.attrs}
+    return {
+        'file': file_name,
+        'rows': int(len(map_data_town)),
+        'sources': sources,
+        # numpy の数値が混ざっていてもマニフェストに書けるように JSON の型に揃える
+        'attrs': json.loads(json.dumps(attrs, default=float)),
+    }
+
+
+def build_bundle(cities=None, bundle_dir=BUNDLE_DIR, data_dir=DATA_DIR):
+    from data_loader import build_municipality_data
+
+    os.makedirs(bundle_dir, exist_ok=True)
+    manifest = current_manifest(bundle_dir)
+    cities = cities or list_municipalities(data_dir)
+
+    for city in cities:
+        logging.info(f"Building bundle for {city}")
+        print(f"Building bundle for {city}")
+        # シグネチャは加工前に計算し、加工中にファイルが変わった場合は次回のロードで古いと判定させる
+        sources = describe_sources(city)
+        map_data_town = build_municipality_data(city)
+        manifest['cities'][city] = write_bundle_entry(city, map_data_town, sources, bundle_dir)
+
+    manifest['created'] = datetime.now(timezone.utc).isoformat()
+    write_manifest(manifest, bundle_dir)
+    print(f"Bundle written to {bundle_dir} ({len(cities)} municipalities)")
+    return manifest
+
+
+def is_entry_fresh(municipality_name, entry):
+    for rel_path, recorded in entry['sources'].items():
+        path = os.path.join(BASE_DIR, rel_path)
+        if not os.path.exists(path):
+            return False
+        stat = os.stat(path)
+        if stat.st_size != recorded['size']:
+            return False
+        # mtimeだけが変わった場合は内容のハッシュで判定する
+        if stat.st_mtime_ns != recorded['mtime_ns'] and file_sha256(path) != recorded['sha256']:
+            return False
+    current = {os.path.relpath(path, BASE_DIR) for path in source_files(municipality_name)}
+    return current == set(entry['sources'])
+
+
+def load_bundled_municipality(municipality_name, bundle_dir=BUNDLE_DIR):
+    # バンドルが存在し元ファイルと一致する場合のみ読み込む。それ以外は None を返す
+    from data_loader import PIPELINE_VERSION
+
+    manifest = read_manifest(bundle_dir)
+    if manifest is None:
+        logging.debug("Data bundle not found.")
+        return None
+    if manifest.get('pipeline_version') != PIPELINE_VERSION:
+        logging.warning("Data bundle was built by a different loader version. Falling back to raw files.")
+        return None
+
+    entry = manifest['cities'].get(municipality_name)
+    bundle_path = os.path.join(bundle_dir, entry['file']) if entry else None
+    if entry is None or not os.path.exists(bundle_path):
+        logging.info(f"{municipality_name} is not in the data bundle.")
+        return None
+
+    if not is_entry_fresh(municipality_name, entry):
+        logging.warning(f"Data bundle for {municipality_name} is stale. Falling back to raw files.")
+        echo(f"Data bundle for {municipality_name} is stale. Falling back to raw files.")
+        return None
+
+    try:
+        import geopandas as gpd
+        map_data_town = gpd.read_parquet(bundle_path)
+    except ImportError as e:
+        logging.warning(f"Cannot read data bundle ({e}). Falling back to raw files.")
+        return None
+    map_data_town.attrs.update(entry.get('attrs', {}))
+    return map_data_town
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="市区町村データのバンドルを作成します。")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="data/ 以下の市区町村をバンドルに書き出す")
+    build_parser.add_argument('--cities', nargs='*', help="対象の市区町村（省略時は全て）")
+    build_parser.add_argument('--output', default=BUNDLE_DIR, help="出力先ディレクトリ")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(message)s')
+    if args.command == 'build':
+        build_bundle(cities=args.cities, bundle_dir=args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,151 +1,244 @@
 # callbacks.py
 
-import pandas as pd
-import plotly.express as px
+# 起動を速くするため、pandas・geopandas・plotly.express や市区町村データの読み込み処理は
+# 各コールバックが初めて呼ばれたときに読み込む（モジュールの読み込み時には読み込まない）
+
 import plotly.graph_objects as go
-from dash.dependencies import Output, Input
+from dash import Patch, callback_context, no_update, html
+from dash.dependencies import Output, Input, State
 from layout import variable_options
-from data_loader import load_municipality_data
+from response_cache import mark_figure_cacheable
+from background import get_background_manager, register_load_prefetch
+from data_watcher import current_cities
+from instrumentation import echo, span, mark_callback_done
 import logging
-import geopandas as gpd
-from shapely.geometry import Point
-import numpy as np
+
+# 商圏の集計で表示する列（列名: 表示名）
+CATCHMENT_SUMMARY = {
+    'age_10_14': '10-14歳',
+    'age_20_39': '20-39歳',
+    'male_age_20_39': '男20-39歳',
+    'female_age_20_39': '女20-39歳',
+}
+
+def hover_template(display_label):
+    return "<b>%{location}</b><br>" + display_label + ": %{z}<extra></extra>"
+
+
+def variable_label(selected_var):
+    return [k for k, v in variable_options.items() if v == selected_var][0]
+
+
+def clicked_town(clickData):
+    # クリックした町丁目の結合キー（コロプレスは location、タイル表示の代表点は customdata に入る）
+    point = clickData['points'][0]
+    return point.get('location') or point.get('customdata')
+
+
+def build_color_patch(selected_cities, selected_var):
+    # 地図のジオメトリはブラウザ側に残したまま、色の値・ホバー表示・カラーバーの見出しだけを更新する
+    from parallel_loader import load_municipalities
+    from variables import get_registry, variable_values
+
+    if selected_var not in get_registry():
+        return None
+    frames = load_municipalities(selected_cities)
+    display_label = variable_label(selected_var)
+
+    patch = Patch()
+    patch['data'][0]['z'] = variable_values(frames, selected_var)
+    patch['data'][0]['hovertemplate'] = hover_template(display_label)
+    patch['layout']['coloraxis']['colorbar']['title']['text'] = display_label
+    return patch
+
+
+def build_map_figure(frames, selected_var):
+    # frames: 市区町村名 -> GeoDataFrame（地図に描く順）。町丁目の塗り分け地図を作る（データが使えなければ None）
+    # 地図のコールバックと、サーバーを起動しない一括書き出し（export.py）の両方から使う
+    import numpy as np
+    import pandas as pd
+    import geopandas as gpd
+    import plotly.express as px
+    from data_loader import get_data_version
+    from geometry_pyramid import get_simplified_geometry
+    from extent_index import get_extent, viewport
+    from variables import variable_values
+
+    selected_cities = list(frames)
+    data_list = list(frames.values())
+
+    # 全ての市のデータを結合（表示する変数だけを計算して列に加える）
+    data = pd.concat(data_list, ignore_index=True)
+    data[selected_var] = variable_values(frames, selected_var)
+    
+    # 選択された変数に対応するラベルを取得
+    display_label = variable_label(selected_var)
+    
+    if 'city_town_key' not in data.columns:
+        logging.error("Column 'city_town_key' not found in data.")
+        echo("Column 'city_town_key' not found in data.")
+        return None
+    
+    if data.geometry.isnull().all():
+        logging.error("Geometry data is missing.")
+        echo("Geometry data is missing.")
+        return None
+    
+    # CRSの確認と変換
+    if data.crs != "EPSG:4326":
+        data = data.to_crs(epsg=4326)
+        logging.info("Coordinate reference system transformed to EPSG:4326.")
+        echo("Coordinate reference system transformed to EPSG:4326.")
+    
+    with span('update_map.center_zoom'):
+        # 市区町村ごとの範囲（外接矩形・重心・面積）を組み合わせて中心とズームを決める
+        extents = [get_extent(city, get_data_version([city]), data_city)
+                   for city, data_city in zip(selected_cities, data_list)]
+        center, zoom = viewport(extents)
+        logging.debug(f"Map center calculated at: {center}, zoom: {zoom}")
+        echo(f"Map center calculated at: {center}, zoom: {zoom}")
+    
+    with span('update_map.figure'):
+        # ズームに応じて簡略化したジオメトリに差し替える（市区町村ごとに事前計算・キャッシュ済み）
+        simplified = np.concatenate([
+            get_simplified_geometry(city, get_data_version([city]), data_city.to_crs(epsg=4326).geometry, zoom)
+            for city, data_city in zip(selected_cities, data_list)
+        ])
+        map_data = data.set_geometry(gpd.GeoSeries(simplified, index=data.index, crs="EPSG:4326"))
+        # GeoJSONのプロパティには結合キーだけを含める（全列を載せると送信量が大きく増える）
+        geojson = map_data[['city_town_key', 'geometry']].__geo_interface__
+
+        # 地図の作成
+        fig = px.choropleth_mapbox(
+            map_data,
+            geojson=geojson,
+            locations='city_town_key',
+            color=selected_var,
+            featureidkey='properties.city_town_key',
+            mapbox_style="open-street-map",
+            center=center,
+            zoom=zoom,
+            opacity=0.5,
+            labels={selected_var: display_label}
+        )
+    
+        fig.update_traces(hovertemplate=hover_template(display_label))
+        fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+    return fig
+
 
 def register_callbacks(app):
-    @app.callback(
-        Output('mapPlot', 'figure'),
-        [Input('city_selection', 'value'), Input('variable', 'value')]
-    )
-    def update_map(selected_cities, selected_var):
+    map_outputs = [Output('mapPlot', 'figure'), Output('map_state', 'data')]
+    map_inputs = [Input('city_selection', 'value'), Input('variable', 'value')]
+    map_states = [State('map_state', 'data')]
+
+    def update_map(selected_cities, selected_var, map_state, set_progress=None):
+        from data_loader import get_data_version
+        from parallel_loader import load_municipalities
+        from town_index import register_municipality
+        from extent_index import viewport
+        from tiles import get_tile_store, use_tiles, build_tile_figure, build_tile_patch
+
         logging.debug(f"update_map callback triggered with cities: {selected_cities}, selected_var: {selected_var}")
-        print(f"update_map callback triggered with cities: {selected_cities}, selected_var: {selected_var}")
+        echo(f"update_map callback triggered with cities: {selected_cities}, selected_var: {selected_var}")
         
         if not selected_cities or not selected_var:
             logging.info("City or variable not selected. Returning empty figure.")
-            print("City or variable not selected. Returning empty figure.")
-            return go.Figure()
+            echo("City or variable not selected. Returning empty figure.")
+            return go.Figure(), None
         
         try:
             # 選択された市が文字列の場合、リストに変換
             if isinstance(selected_cities, str):
                 selected_cities = [selected_cities]
+            # 選択の順序によらず同じ図になるよう並べる（応答キャッシュのキー・色の差分の順序と一致させる）
+            selected_cities = sorted(selected_cities)
+
+            data_version = get_data_version(selected_cities)
+
+            # 変数だけが変わり、描画済みの地図と市区町村・データが同じなら色の値だけを送る
+            if (callback_context.triggered_id == 'variable' and map_state
+                    and map_state.get('cities') == selected_cities
+                    and map_state.get('version') == data_version):
+                if map_state.get('mode') == 'tiles':
+                    store = get_tile_store()
+                    patch = (build_tile_patch(store, selected_var, variable_label(selected_var), selected_cities)
+                             if store else None)
+                else:
+                    patch = build_color_patch(selected_cities, selected_var)
+                if patch is not None:
+                    logging.info("Map colors updated without resending geometry.")
+                    echo("Map colors updated without resending geometry.")
+                    mark_callback_done('update_map.patch')
+                    return patch, no_update
             
-            data_list = []
-            for city in selected_cities:
-                data_city = load_municipality_data(city)
-                data_list.append(data_city)
-            
-            # 全ての市のデータを結合
-            data = pd.concat(data_list, ignore_index=True)
-            
-            # 選択された変数に対応するラベルを取得
-            display_label = [k for k, v in variable_options.items() if v == selected_var][0]
-            
-            if 'city_town_key' not in data.columns:
-                logging.error("Column 'city_town_key' not found in data.")
-                print("Column 'city_town_key' not found in data.")
-                return go.Figure()
-            
-            if data.geometry.isnull().all():
-                logging.error("Geometry data is missing.")
-                print("Geometry data is missing.")
-                return go.Figure()
-            
-            # CRSの確認と変換
-            if data.crs != "EPSG:4326":
-                data = data.to_crs(epsg=4326)
-                logging.info("Coordinate reference system transformed to EPSG:4326.")
-                print("Coordinate reference system transformed to EPSG:4326.")
-            
-            # 選択された市のキーを作成（市名をソートして結合）
-            sorted_cities = sorted(selected_cities)
-            city_key = '・'.join(sorted_cities)
-            print(f"Generated city_key: {city_key}")
-            
-            # 事前定義されたズームと中心位置の設定
-            zoom_and_center_settings = {
-                '大阪市鶴見区': {'zoom': 13.1, 'center_offset': {'lat': -0.00002, 'lon': -0.0004}},
-                '大東市': {'zoom': 13.1, 'center_offset': {'lat': 0.001, 'lon': 0.006}},
-                '大東市・東大阪市': {'zoom': 11.9, 'center_offset': {'lat': 0.004, 'lon': 0.006}},
-                '門真市': {'zoom': 13.0, 'center_offset': {'lat': -0.002, 'lon': -0.0007}},
-                '東大阪市': {'zoom': 12.4, 'center_offset': {'lat': -0.002, 'lon': 0.015}},
-                '大阪市鶴見区・大東市・東大阪市・門真市': {'zoom': 10.8, 'center_offset': {'lat': 0.000, 'lon': 0.003}},
-                # 必要に応じて他の組み合わせを追加
-            }
-            
-            # 地図の中心とズームレベルの設定
-            if city_key in zoom_and_center_settings:
-                settings = zoom_and_center_settings[city_key]
-                zoom = settings['zoom']
-                center_offset = settings['center_offset']
-                
-                # 中心点の計算
-                projected_data = data.to_crs(epsg=3857)  # Web Mercatorに変換
-                centroid = projected_data.unary_union.centroid
-                centroid = gpd.GeoSeries([centroid], crs="EPSG:3857").to_crs(epsg=4326).iloc[0]
-                center = {
-                    "lat": centroid.y + center_offset['lat'],
-                    "lon": centroid.x + center_offset['lon']
-                }
-                print(f"Using predefined settings for {city_key}: zoom={zoom}, center={center}")
-            else:
-                # 動的に中心点とズームレベルを計算
-                projected_data = data.to_crs(epsg=3857)  # Web Mercatorに変換
-                centroid = projected_data.unary_union.centroid  # 全体の中心を計算
-                centroid = gpd.GeoSeries([centroid], crs="EPSG:3857").to_crs(epsg=4326).iloc[0]
-                center = {"lat": centroid.y, "lon": centroid.x}
-                logging.debug(f"Map center calculated at: {center}")
-                print(f"Map center calculated at: {center}")
-
-                # ズームレベルの計算（データの範囲に基づく）
-                bounds = projected_data.total_bounds  # [minx, miny, maxx, maxy]
-                map_width = bounds[2] - bounds[0]
-                map_height = bounds[3] - bounds[1]
-                max_dimension = max(map_width, map_height)
-                zoom = 21.3 - np.log(max_dimension)
-                zoom = max(min(zoom, 15), 5)  # ズームレベルを5から15の範囲に制限
-                logging.debug(f"Calculated zoom level: {zoom}")
-                print(f"Calculated zoom level: {zoom}")
-            
-            # 地図の作成
-            fig = px.choropleth_mapbox(
-                data,
-                geojson=data.__geo_interface__,
-                locations='city_town_key',
-                color=selected_var,
-                featureidkey='properties.city_town_key',
-                mapbox_style="open-street-map",
-                center=center,
-                zoom=zoom,
-                opacity=0.5,
-                labels={selected_var: display_label}
-            )
-            
-            fig.update_traces(hovertemplate="<b>%{location}</b><br>" + display_label + ": %{z}<extra></extra>")
-            fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+            # 町丁目が多い広域の地図は、生成済みのベクトルタイルで描く（GeoJSON を送らない）
+            store = use_tiles(selected_cities)
+            if store is not None:
+                with span('update_map.tiles'):
+                    center, zoom = viewport(store.extents(selected_cities))
+                    fig = build_tile_figure(store, selected_var, variable_label(selected_var), selected_cities,
+                                            center, zoom)
+                logging.info("Map updated from vector tiles.")
+                echo("Map updated from vector tiles.")
+                mark_callback_done('update_map')
+                return fig, {'cities': selected_cities, 'version': data_version, 'mode': 'tiles'}
+
+            with span('update_map.load'):
+                # キャッシュに無い市区町村はプロセスプールで同時に読み込む（バックグラウンド実行時は進み具合を表示）
+                progress = (lambda done, total: set_progress((done, total))) if set_progress else None
+                frames = load_municipalities(selected_cities, progress=progress)
+                for city, data_city in frames.items():
+                    # 棒グラフ用の町丁目索引にも登録しておく（クリック時に読み込み直さないため）
+                    register_municipality(city, data_city)
+
+            fig = build_map_figure(frames, selected_var)
+            if fig is None:
+                return go.Figure(), None
             logging.info("Map updated successfully.")
-            print("Map updated successfully.")
-            return fig
+            echo("Map updated successfully.")
+            mark_callback_done('update_map')
+            mark_figure_cacheable(selected_cities, selected_var, data_version)
+            return fig, {'cities': selected_cities, 'version': data_version}
         except FileNotFoundError as e:
             logging.error(e)
-            print(e)
-            return go.Figure()
+            echo(e)
+            return go.Figure(), None
         except Exception as e:
             logging.exception("予期しないエラーが発生しました。")
-            print("予期しないエラーが発生しました。")
-            return go.Figure()
+            echo("予期しないエラーが発生しました。")
+            return go.Figure(), None
+
+    # 読み込みに時間がかかる地図のコールバックは、有効ならバックグラウンドのジョブで実行する
+    manager = get_background_manager()
+    if manager is None:
+        app.callback(map_outputs, map_inputs, map_states)(update_map)
+    else:
+        # 読み込みはサーバーのプロセスで行い、ジョブと棒グラフ・商圏のコールバックで共有する
+        register_load_prefetch(app.server)
+        @app.callback(
+            map_outputs, map_inputs, map_states,
+            background=True,
+            manager=manager,
+            progress=[Output('map_progress', 'value'), Output('map_progress', 'max')],
+            running=[(Output('map_progress', 'style'), {'display': 'block', 'width': '100%'}, {'display': 'none'})]
+        )
+        def update_map_background(set_progress, selected_cities, selected_var, map_state):
+            return update_map(selected_cities, selected_var, map_state, set_progress)
     
     @app.callback(
         Output('barPlot', 'figure'),
         [Input('mapPlot', 'clickData'), Input('city_selection', 'value')]
     )
     def update_bar(clickData, selected_cities):
+        from town_index import AGE_BAND_LABELS, lookup_town
+
         logging.debug("update_bar callback triggered.")
-        print("update_bar callback triggered.")
+        echo("update_bar callback triggered.")
         
         if not clickData or not selected_cities:
             logging.info("Insufficient data for bar plot. Returning empty figure.")
-            print("Insufficient data for bar plot. Returning empty figure.")
+            echo("Insufficient data for bar plot. Returning empty figure.")
             return {
                 "data": [],
                 "layout": go.Layout(
@@ -166,62 +259,36 @@ def register_callbacks(app):
             }
         
         try:
-            city_town_key = clickData['points'][0]['location']
+            city_town_key = clicked_town(clickData)
             logging.info(f"Clicked city_town_key: {city_town_key}")
-            print(f"Clicked city_town_key: {city_town_key}")
+            echo(f"Clicked city_town_key: {city_town_key}")
             
             if isinstance(selected_cities, str):
                 selected_cities = [selected_cities]
-            
-            data_list = []
-            for city in selected_cities:
-                data_city = load_municipality_data(city)
-                data_list.append(data_city)
-            
-            data = pd.concat(data_list, ignore_index=True)
-        
-            selected_town_data = data[data['city_town_key'] == city_town_key]
+
+            # 町丁目の索引から年齢階級別人口の行を直接引く
+            with span('update_bar.lookup'):
+                population_values = lookup_town(city_town_key, selected_cities)
             logging.info(f"Updating bar plot for city_town_key: {city_town_key}")
-            print(f"Updating bar plot for city_town_key: {city_town_key}")
+            echo(f"Updating bar plot for city_town_key: {city_town_key}")
         
-            if selected_town_data.empty:
+            if population_values is None:
                 logging.warning(f"No data found for city_town_key: {city_town_key}")
-                print(f"No data found for city_town_key: {city_town_key}")
+                echo(f"No data found for city_town_key: {city_town_key}")
                 return go.Figure()
         
-            age_groups = [
-                'age_0_4', 'age_5_9', 'age_10_14', 'age_15_19',
-                'age_20_24', 'age_25_29', 'age_30_34', 'age_35_39',
-                'age_40_44', 'age_45_49', 'age_50_54', 'age_55_59',
-                'age_60_64', 'age_65_69', 'age_70_74', 'age_over_75'
-            ]
-            age_labels = [
-                '0-4', '5-9', '10-14', '15-19',
-                '20-24', '25-29', '30-34', '35-39',
-                '40-44', '45-49', '50-54', '55-59',
-                '60-64', '65-69', '70-74', '75以上'
-            ]
-        
-            population_values = []
-            actual_age_labels = []
-            for ag, label in zip(age_groups, age_labels):
-                if ag in selected_town_data.columns:
-                    population = selected_town_data[ag].iloc[0]
-                    population_values.append(population if not pd.isnull(population) else 0)
-                    actual_age_labels.append(label)
-                else:
-                    population_values.append(0)
-                    actual_age_labels.append(label)
-        
-            df = pd.DataFrame({'AgeGroup': actual_age_labels, 'Population': population_values})
-            
             if '_' in city_town_key:
                 city_name, town_name = city_town_key.split('_', 1)
             else:
                 city_name = ''
                 town_name = city_town_key
         
-            fig = px.bar(df, x='AgeGroup', y='Population')
+            # px.bar はDataFrameの検証に時間がかかるため、棒グラフのトレースを直接作る
+            fig = go.Figure(go.Bar(
+                x=AGE_BAND_LABELS,
+                y=population_values,
+                hovertemplate="AgeGroup=%{x}<br>Population=%{y}<extra></extra>"
+            ))
             fig.update_layout(
                 title={
                     'text': f'{city_name}<br>{town_name}の年齢別人口',
@@ -235,10 +302,66 @@ def register_callbacks(app):
                 xaxis_tickangle=45
             )
             logging.info("Bar plot updated successfully.")
-            print("Bar plot updated successfully.")
+            echo("Bar plot updated successfully.")
+            mark_callback_done('update_bar')
             return fig
         
         except Exception as e:
             logging.exception("バープロットの更新中にエラーが発生しました。")
-            print("バープロットの更新中にエラーが発生しました。")
+            echo("バープロットの更新中にエラーが発生しました。")
             return go.Figure()
+
+
+    @app.callback(
+        Output('catchment_output', 'children'),
+        [Input('mapPlot', 'clickData'), Input('catchment_radius', 'value'), Input('city_selection', 'value')]
+    )
+    def update_catchment(clickData, radius_m, selected_cities):
+        from catchment import radius_catchments, town_center
+
+        if not clickData or not selected_cities or not radius_m:
+            return "地図をクリックすると商圏内の推計人口を表示します"
+
+        try:
+            if isinstance(selected_cities, str):
+                selected_cities = [selected_cities]
+            city_town_key = clicked_town(clickData)
+
+            # コロプレスのクリックは座標を返さないため、クリックした町丁目の代表点を中心にする
+            center = town_center(selected_cities, city_town_key)
+            if center is None:
+                logging.warning(f"No town found for catchment center: {city_town_key}")
+                return "商圏の中心が見つかりません"
+            with span('update_catchment.compute'):
+                totals = radius_catchments(selected_cities, center[0], center[1], float(radius_m)).iloc[0]
+            logging.info(f"Catchment updated for {city_town_key} (radius {radius_m} m)")
+
+            rows = [html.Tr([html.Th('年齢層'), html.Th('推計人口')])]
+            for column, label in CATCHMENT_SUMMARY.items():
+                if column in totals.index:
+                    rows.append(html.Tr([html.Td(label), html.Td(f"{totals[column]:,.0f}")]))
+            mark_callback_done('update_catchment')
+            return [html.H4(f"{city_town_key} から半径 {float(radius_m):,.0f}m"), html.Table(rows)]
+        except Exception:
+            logging.exception("商圏人口の計算中にエラーが発生しました。")
+            echo("商圏人口の計算中にエラーが発生しました。")
+            return "商圏人口を計算できませんでした"
+
+    @app.callback(
+        [Output('city_selection', 'options'), Output('city_selection', 'value')],
+        Input('data_watch', 'n_intervals'),
+        [State('city_selection', 'options'), State('city_selection', 'value')],
+        prevent_initial_call=True
+    )
+    def refresh_city_options(_, options, selected_cities):
+        # データディレクトリで追加・削除された市区町村を選択肢に反映する（変化が無ければ何も送らない）
+        cities = current_cities()
+        city_options = [{'label': city, 'value': city} for city in cities]
+        if city_options == options:
+            return no_update, no_update
+        logging.info(f"City options refreshed: {cities}")
+        if isinstance(selected_cities, str):
+            selected_cities = [selected_cities]
+        # 削除された市区町村は選択からも外す
+        remaining = [city for city in (selected_cities or []) if city in cities]
+        return city_options, remaining if remaining != (selected_cities or []) else no_update
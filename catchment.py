@@ -0,0 +1,133 @@
+# catchment.py
+#
+# 候補地（点＋半径、または任意のポリゴン）の商圏内の年齢階級別人口を推計する
+# 一部だけが商圏に含まれる町丁目は、重なった面積の割合で人口を按分する（面積按分）
+# 面積は投影座標系（UTM）で計算し、STRtree で候補地と町丁目の組をまとめて求める
+
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+from pyproj import Transformer
+from data_loader import get_data_version
+from parallel_loader import load_municipalities
+from town_index import AGE_BAND_COLUMNS
+from variables import get_registry
+
+# 既定で集計する列（年齢階級と、候補地選びでよく見る 20-39歳）
+CATCHMENT_COLUMNS = AGE_BAND_COLUMNS + ['age_20_39', 'male_age_20_39', 'female_age_20_39']
+
+# 一度に処理する候補地の数（交差ポリゴンの配列が大きくなりすぎないように区切る）
+BATCH_SIZE = 2000
+
+# 円を近似する多角形の細かさ（四半円あたりの頂点数）
+QUAD_SEGMENTS = 16
+
+MAX_CACHED_ENGINES = 8
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+class CatchmentEngine:
+    def __init__(self, frame, columns=None):
+        registry = get_registry()
+        columns = [c for c in (columns or CATCHMENT_COLUMNS) if c in registry]
+        frame = frame[frame.geometry.notna() & ~frame.geometry.is_empty]
+        self.columns = columns
+        self.crs = frame.estimate_utm_crs() if frame.crs is not None and frame.crs.is_geographic else frame.crs
+        projected = frame.geometry.to_crs(self.crs) if frame.crs != self.crs else frame.geometry
+        self.geometries = np.asarray(projected.values, dtype=object)
+        shapely.prepare(self.geometries)
+        self.areas = shapely.area(self.geometries)
+        self.keys = frame['city_town_key'].to_numpy(dtype=object)
+        self.values = np.nan_to_num(registry.evaluate(frame, columns))
+        self.tree = shapely.STRtree(self.geometries)
+        self._to_projected = Transformer.from_crs("EPSG:4326", self.crs, always_xy=True)
+
+    def project_points(self, lat, lon):
+        x, y = self._to_projected.transform(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+        return shapely.points(x, y)
+
+    def query_polygons(self, polygons):
+        # polygons は投影座標系のジオメトリの配列。戻り値は (候補地数, 列数) の推計人口
+        polygons = np.asarray(polygons, dtype=object)
+        totals = np.zeros((len(polygons), len(self.columns)))
+        for start in range(0, len(polygons), BATCH_SIZE):
+            batch = polygons[start:start + BATCH_SIZE]
+            sites, towns = self.tree.query(batch, predicate='intersects')
+            if len(sites) == 0:
+                continue
+            # 商圏に丸ごと含まれる町丁目は交差の計算を省いて全数を加える
+            inside_sites, inside_towns = self.tree.query(batch, predicate='contains')
+            inside = np.isin(sites * len(self.geometries) + towns,
+                             inside_sites * len(self.geometries) + inside_towns)
+            share = np.ones(len(towns))
+            partial = ~inside
+            overlap = shapely.area(shapely.intersection(batch[sites[partial]], self.geometries[towns[partial]]))
+            partial_areas = self.areas[towns[partial]]
+            share[partial] = np.divide(overlap, partial_areas, out=np.zeros(len(overlap)), where=partial_areas > 0)
+            np.add.at(totals, start + sites, self.values[towns] * np.minimum(share, 1.0)[:, None])
+        return totals
+
+    def to_frame(self, totals, index=None):
+        return pd.DataFrame(totals, columns=self.columns, index=index)
+
+
+def get_engine(municipality_names):
+    # 市区町村の組み合わせとデータの版数ごとにエンジンをキャッシュする
+    key = tuple((name, get_data_version([name])) for name in municipality_names)
+    with _lock:
+        engine = _cache.get(key)
+        if engine is not None:
+            _cache.move_to_end(key)
+            return engine
+    logging.debug(f"Building catchment engine for {list(municipality_names)}")
+    frame = pd.concat(load_municipalities(municipality_names).values(), ignore_index=True)
+    engine = CatchmentEngine(gpd.GeoDataFrame(frame, geometry='geometry'))
+    with _lock:
+        _cache[key] = engine
+        while len(_cache) > MAX_CACHED_ENGINES:
+            _cache.popitem(last=False)
+    return engine
+
+
+def radius_catchments(municipality_names, lat, lon, radius_m):
+    # 緯度経度の点と半径[m]（スカラーまたは点ごとの配列）の円ごとの推計人口
+    engine = get_engine(municipality_names)
+    lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+    lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+    radius = np.broadcast_to(np.asarray(radius_m, dtype=np.float64), lat.shape)
+    circles = shapely.buffer(engine.project_points(lat, lon), radius, quad_segs=QUAD_SEGMENTS)
+    result = engine.to_frame(engine.query_polygons(circles))
+    result.insert(0, 'radius_m', radius)
+    result.insert(0, 'lon', lon)
+    result.insert(0, 'lat', lat)
+    return result
+
+
+def polygon_catchments(municipality_names, polygons, crs="EPSG:4326"):
+    # 任意のポリゴン（GeoSeries、または crs 座標のジオメトリの配列）ごとの推計人口
+    engine = get_engine(municipality_names)
+    if not isinstance(polygons, gpd.GeoSeries):
+        polygons = gpd.GeoSeries(polygons, crs=crs)
+    projected = polygons.to_crs(engine.crs)
+    return engine.to_frame(engine.query_polygons(projected.values), index=polygons.index)
+
+
+def town_center(municipality_names, city_town_key):
+    # 町丁目の代表点（ポリゴン内部に必ず入る点）の緯度経度。無ければ None
+    engine = get_engine(municipality_names)
+    rows = np.flatnonzero(engine.keys == city_town_key)
+    if len(rows) == 0:
+        return None
+    point = gpd.GeoSeries([shapely.point_on_surface(engine.geometries[rows[0]])], crs=engine.crs).to_crs(epsg=4326)
+    return point.iloc[0].y, point.iloc[0].x
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,115 @@
+# census_index.py
+#
+# 国勢調査CSVの市区町村ごとのバイト範囲の索引（サイドカーファイル）
+# 1つの市区町村を読むときは、ファイル全体ではなくその範囲だけをシークして読み込む
+
+import os
+import json
+import threading
+import logging
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.offsets.json'
+
+# 索引の保存先（未設定ならCSVと同じディレクトリ。書き込めない場合はメモリ上だけに保持）
+INDEX_DIR = os.environ.get('CENSUS_INDEX_DIR')
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def index_path_for(csv_path):
+    directory = INDEX_DIR or os.path.dirname(csv_path)
+    return os.path.join(directory, os.path.basename(csv_path) + INDEX_SUFFIX)
+
+
+def city_field(line, encoding):
+    # 3列目（CITYNAME）だけを取り出す。Shift_JIS の2バイト目に ',' や '\n' は現れないのでバイト列のまま分割できる
+    fields = line.split(b',', 3)
+    if len(fields) < 3:
+        return None
+    return fields[2].strip().strip(b'"').decode(encoding)
+
+
+def build_offset_index(csv_path, encoding='shift_jis', header_lines=2):
+    # 市区町村名 -> [開始バイト, 終了バイト, 行数] の範囲のリスト
+    cities = {}
+    with open(csv_path, 'rb') as f:
+        header = [f.readline() for _ in range(header_lines)]
+        header_end = sum(len(line) for line in header)
+        offset = header_end
+        current = None
+        for line in f:
+            end = offset + len(line)
+            name = city_field(line, encoding)
+            if name and current is not None and current[0] == name and current[1][1] == offset:
+                current[1][1] = end
+                current[1][2] += 1
+            elif name:
+                current = (name, [offset, end, 1])
+                cities.setdefault(name, []).append(current[1])
+            offset = end
+    stat = os.stat(csv_path)
+    return {
+        'version': INDEX_VERSION,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'header_length': header_end,
+        'cities': cities,
+    }
+
+
+def _is_current(index, csv_path):
+    stat = os.stat(csv_path)
+    return (index is not None and index.get('version') == INDEX_VERSION
+            and index.get('mtime_ns') == stat.st_mtime_ns and index.get('size') == stat.st_size)
+
+
+def _read_sidecar(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_sidecar(path, index):
+    try:
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"Could not write census offset index {path}: {e}")
+
+
+def get_offset_index(csv_path):
+    # メモリ上 → サイドカーファイル → 作成 の順に、CSVの更新時刻と一致する索引を返す
+    with _lock:
+        index = _cache.get(csv_path)
+    if _is_current(index, csv_path):
+        return index
+
+    sidecar = index_path_for(csv_path)
+    index = _read_sidecar(sidecar)
+    if not _is_current(index, csv_path):
+        logging.info(f"Building census offset index for {csv_path}")
+        index = build_offset_index(csv_path)
+        _write_sidecar(sidecar, index)
+    with _lock:
+        _cache[csv_path] = index
+    return index
+
+
+def read_city_bytes(csv_path, municipality_name):
+    # 見出し2行と、その市区町村の行だけを連結したバイト列（見つからなければ None）
+    index = get_offset_index(csv_path)
+    ranges = index['cities'].get(municipality_name)
+    if not ranges:
+        return None
+    with open(csv_path, 'rb') as f:
+        parts = [f.read(index['header_length'])]
+        for start, end, _ in ranges:
+            f.seek(start)
+            parts.append(f.read(end - start))
+    return b''.join(parts)
@@ -0,0 +1,62 @@
+# census_join.py
+#
+# 境界データ（シェイプファイル）と国勢調査データの結合
+# KEY_CODE の整数結合を優先し、結合できなかった行だけ正規化した名前で結合する
+
+import logging
+import numpy as np
+import pandas as pd
+from name_normalizer import normalize_names
+from census_store import build_code_lookup
+
+
+def parse_key_codes(values):
+    # 文字列の KEY_CODE を整数に変換する（変換できないものは -1）
+    return pd.to_numeric(pd.Series(values), errors='coerce').fillna(-1).astype('int64').to_numpy()
+
+
+def join_census(map_data_town, population_data, code_lookup=None, shape_code_column='key_code'):
+    # map_data_town には正規化済みの city_town_key が必要
+    # code_lookup は KEY_CODE の配列を population_data の行ラベルに変換する関数（省略時はその場で作成）
+    map_data_town = map_data_town.reset_index(drop=True)
+    n_rows = len(map_data_town)
+
+    if code_lookup is None:
+        code_lookup = build_code_lookup(population_data)
+
+    # 1. KEY_CODE による整数結合（対象市区町村の行に限る）
+    labels = np.full(n_rows, -1, dtype='int64')
+    if shape_code_column in map_data_town.columns:
+        labels = np.asarray(code_lookup(parse_key_codes(map_data_town[shape_code_column])), dtype='int64')
+        labels[~np.isin(labels, population_data.index.to_numpy())] = -1
+    code_matched = labels >= 0
+
+    # 2. 残った行だけ名前（city_town_key）で結合する
+    unmatched = ~code_matched
+    if unmatched.any():
+        census_keys = (normalize_names(population_data['CITY_NAME']) + '_'
+                       + normalize_names(population_data['S_NAME']))
+        census_keys = census_keys[~census_keys.duplicated()]
+        name_index = pd.Index(census_keys.to_numpy())
+        positions = name_index.get_indexer(map_data_town.loc[unmatched, 'city_town_key'].to_numpy())
+        labels[unmatched] = np.where(positions >= 0, census_keys.index.to_numpy()[positions], -1)
+    name_matched = unmatched & (labels >= 0)
+
+    # 結合した行の人口データを付与（一致しない行は欠損値）
+    joined = population_data.drop(columns=['city_town_key'], errors='ignore').reindex(labels)
+    joined['CITY_NAME'] = normalize_names(joined['CITY_NAME']).where(joined['CITY_NAME'].notna())
+    joined['S_NAME'] = normalize_names(joined['S_NAME']).where(joined['S_NAME'].notna())
+    result = map_data_town.join(joined.reset_index(drop=True))
+
+    stats = {
+        'rows': int(n_rows),
+        'code_matched': int(code_matched.sum()),
+        'name_matched': int(name_matched.sum()),
+        'unmatched': int(n_rows - code_matched.sum() - name_matched.sum()),
+    }
+    stats['match_rate'] = (stats['code_matched'] + stats['name_matched']) / n_rows if n_rows else 1.0
+    logging.info(
+        f"Census join: {stats['code_matched']} by KEY_CODE, {stats['name_matched']} by name, "
+        f"{stats['unmatched']} unmatched (match rate {stats['match_rate']:.1%})"
+    )
+    return result, stats
@@ -0,0 +1,14 @@
+# census_labels.py
+#
+# 国勢調査CSVの人数の列の見出し（census_reader.py で読み込んだ後の列名）
+# 変数の定義（variables.py）など、CSV を読まない処理からも pandas を読み込まずに使えるよう分けている
+
+# 年齢階級（見出しから「総数」「歳」を除き、〜を～にそろえたもの）
+AGE_BAND_LABELS = [
+    '０～４', '５～９', '１０～１４', '１５～１９', '２０～２４', '２５～２９', '３０～３４', '３５～３９',
+    '４０～４４', '４５～４９', '５０～５４', '５５～５９', '６０～６４', '６５～６９', '７０～７４', '７５以上',
+]
+TOTAL_LABELS = ['、年齢「不詳」含む', '男の、年齢「不詳」含む', '女の、年齢「不詳」含む']
+
+# 人数の列として残す見出し（総数・男・女 × 年齢階級 と 各総数）
+COUNT_LABELS = TOTAL_LABELS + [prefix + label for prefix in ('', '男', '女') for label in AGE_BAND_LABELS]
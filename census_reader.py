@@ -0,0 +1,149 @@
+# census_reader.py
+#
+# e-Stat の国勢調査CSV（tblT001082Cxx.csv、Shift_JIS、1行目が列コード・2行目が見出し）を
+# 必要な列だけ・必要な行だけ、チャンク単位で読み込む
+
+import io
+import os
+import glob
+import logging
+import numpy as np
+import pandas as pd
+from census_index import get_offset_index, read_city_bytes
+from census_labels import COUNT_LABELS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 読み込む国勢調査CSV（カンマ区切りで複数指定可、glob可。例: data/tblT001082C*.csv）
+DEFAULT_CENSUS_FILES = os.path.join(BASE_DIR, "data", "tblT001082C27.csv")
+
+CSV_ENCODING = 'shift_jis'
+CHUNK_SIZE = 5000
+
+# キー列（読み込み後の列名）
+KEY_COLUMNS = {'KEY_CODE': 'KEY_CODE', 'HYOSYO': 'HYOSYO', 'CITYNAME': 'CITY_NAME', 'NAME': 'S_NAME'}
+
+COUNT_DTYPE = np.int32
+
+
+def configured_census_files(setting=None):
+    setting = setting or os.environ.get('CENSUS_FILES') or DEFAULT_CENSUS_FILES
+    paths = []
+    for pattern in setting.split(','):
+        pattern = pattern.strip()
+        if not pattern:
+            continue
+        if not os.path.isabs(pattern):
+            pattern = os.path.join(BASE_DIR, pattern)
+        matches = sorted(glob.glob(pattern))
+        # 存在しないファイルもそのまま残し、読み込み時に FileNotFoundError にする
+        paths.extend(matches or [pattern])
+    return paths
+
+
+def clean_label(label):
+    # 見出しから「総数」「歳」などの不要な文字とスペースを削除
+    return (str(label).replace('総数', '').replace('歳', '')
+            .replace('〜', '～').replace(' ', '').strip())
+
+
+def as_source(path, data=None):
+    # data（索引から読み出したバイト列）があればそれを、無ければファイルを読む
+    return io.BytesIO(data) if data is not None else path
+
+
+def read_header(path, data=None):
+    # 1行目（列コード）と2行目（見出し）から、残す列と読み込み後の列名を決める
+    header = pd.read_csv(as_source(path, data), encoding=CSV_ENCODING, nrows=1, dtype=str)
+    rename = {}
+    for code, label in zip(header.columns, header.iloc[0]):
+        if code in KEY_COLUMNS:
+            rename[code] = KEY_COLUMNS[code]
+        elif isinstance(label, str) and clean_label(label) in COUNT_LABELS:
+            rename[code] = clean_label(label)
+    missing = [column for column in KEY_COLUMNS if column not in rename]
+    if missing:
+        raise KeyError(f"必要な列が見つかりません: {missing}")
+    return rename
+
+
+def to_counts(frame, columns):
+    # '-'（該当なし）や 'X'（秘匿）を 0 として、整数型に変換
+    counts = frame[columns].apply(pd.to_numeric, errors='coerce').fillna(0)
+    return counts.astype(COUNT_DTYPE)
+
+
+def iter_census_chunks(path, city_names=None, key_codes=None, chunk_size=CHUNK_SIZE, stop_after_match=True,
+                       data=None):
+    # 必要な列だけをチャンク単位で読み込み、市区町村名（完全一致）・KEY_CODE で行を絞り込む
+    rename = read_header(path, data)
+    count_columns = [label for label in rename.values() if label in COUNT_LABELS]
+    city_names = set(city_names) if city_names is not None else None
+    key_codes = set(int(code) for code in key_codes) if key_codes is not None else None
+    matched_any = False
+
+    reader = pd.read_csv(
+        as_source(path, data), encoding=CSV_ENCODING, skiprows=[1], usecols=list(rename), dtype=str, chunksize=chunk_size
+    )
+    for chunk in reader:
+        chunk = chunk.rename(columns=rename)
+        codes = pd.to_numeric(chunk['KEY_CODE'], errors='coerce').fillna(-1).astype(np.int64)
+        mask = np.ones(len(chunk), dtype=bool)
+        if city_names is not None:
+            mask &= chunk['CITY_NAME'].isin(city_names).to_numpy()
+        if key_codes is not None:
+            mask &= codes.isin(key_codes).to_numpy()
+
+        if not mask.any():
+            # 行は市区町村ごとにまとまっているので、一致した後に一致しないチャンクが来たら打ち切る
+            if matched_any and stop_after_match and city_names is not None and key_codes is None:
+                break
+            continue
+        matched_any = True
+
+        chunk = chunk[mask]
+        result = pd.DataFrame({
+            'KEY_CODE': codes[mask].to_numpy(),
+            'HYOSYO': pd.to_numeric(chunk['HYOSYO'], errors='coerce').fillna(0).astype(np.int8).to_numpy(),
+            'CITY_NAME': chunk['CITY_NAME'].to_numpy(),
+            'S_NAME': chunk['S_NAME'].to_numpy(),
+        }, index=chunk.index)
+        yield pd.concat([result, to_counts(chunk, count_columns)], axis=1)
+
+
+def read_census_tables(paths, city_names=None, key_codes=None, chunk_size=CHUNK_SIZE):
+    # 複数の表を順に読み、条件に合う行だけを連結する（メモリ上に残るのは絞り込み後の行だけ）
+    frames = []
+    for path in paths:
+        if city_names is not None:
+            # 市区町村名で絞る場合は、索引で該当する範囲だけをシークして読む
+            for name in dict.fromkeys(city_names):
+                data = read_city_bytes(path, name)
+                if data is None:
+                    continue
+                logging.debug(f"Reading census rows of {name} from {path}")
+                frames.extend(iter_census_chunks(path, city_names=[name], key_codes=key_codes,
+                                                 chunk_size=chunk_size, data=data))
+            continue
+        logging.debug(f"Streaming census table: {path}")
+        frames.extend(iter_census_chunks(path, key_codes=key_codes, chunk_size=chunk_size))
+    if not frames:
+        return empty_census_frame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def empty_census_frame():
+    frame = pd.DataFrame({
+        'KEY_CODE': pd.Series(dtype=np.int64),
+        'HYOSYO': pd.Series(dtype=np.int8),
+        'CITY_NAME': pd.Series(dtype=object),
+        'S_NAME': pd.Series(dtype=object),
+    })
+    for label in COUNT_LABELS:
+        frame[label] = pd.Series(dtype=COUNT_DTYPE)
+    return frame
+
+
+def read_city_names(path):
+    # 表に含まれる市区町村名（ファイル内の出現順。索引から取り出すので全行を解析しない）
+    return list(get_offset_index(path)['cities'])
@@ -0,0 +1,127 @@
+# census_store.py
+
+import os
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from census_reader import DEFAULT_CENSUS_FILES, configured_census_files, read_census_tables, read_city_names
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# data直下の国勢調査CSVファイル
+DEFAULT_POP_FILE = DEFAULT_CENSUS_FILES
+
+# 国勢調査データの KEY_CODE 列
+CENSUS_KEY_COLUMN = 'KEY_CODE'
+
+
+class CensusStore:
+    # 国勢調査CSVから市区町村ごとに必要な列・行だけをストリーミングで読み込み、プロセス内で共有する
+    # 読み込み済みの市区町村は件数上限付きで保持し、CSVの更新時刻が変わったら自動的に読み直す
+    def __init__(self, pop_files=None, max_municipalities=64):
+        self.pop_files = pop_files or configured_census_files()
+        self.max_municipalities = max_municipalities
+        self._lock = threading.Lock()
+        self._mtimes = None
+        self._slices = OrderedDict()
+        self._city_files = None
+        self.load_count = 0
+
+    @property
+    def pop_file(self):
+        return self.pop_files[0]
+
+    def _current_mtimes(self):
+        return tuple(os.stat(path).st_mtime_ns for path in self.pop_files)
+
+    def _check_fresh(self):
+        # CSVの更新時刻が変わっていれば読み込み済みのデータを捨てる
+        mtimes = self._current_mtimes()
+        with self._lock:
+            if mtimes != self._mtimes:
+                if self._mtimes is not None:
+                    logging.info("Census CSV changed. Reloading census data.")
+                self._mtimes = mtimes
+                self._slices.clear()
+                self._city_files = None
+
+    def city_files(self):
+        # 市区町村名 -> その市区町村を含むCSVファイル
+        self._check_fresh()
+        with self._lock:
+            city_files = self._city_files
+        if city_files is None:
+            city_files = {}
+            for path in self.pop_files:
+                for name in read_city_names(path):
+                    city_files.setdefault(name, []).append(path)
+            with self._lock:
+                self._city_files = city_files
+        return city_files
+
+    def files_for(self, municipality_name):
+        return self.city_files().get(municipality_name, [])
+
+    def _read_municipality(self, municipality_name):
+        paths = self.files_for(municipality_name)
+        # 年齢階級の合計などの変数は variables.py で必要になった時点で計算する
+        return read_census_tables(paths, city_names=[municipality_name])
+
+    def get_slice(self, municipality_name):
+        self._check_fresh()
+        with self._lock:
+            entry = self._slices.get(municipality_name)
+            if entry is not None:
+                self._slices.move_to_end(municipality_name)
+                return entry
+        logging.info(f"Reading census rows for {municipality_name}")
+        population_data = self._read_municipality(municipality_name)
+        entry = (population_data, build_code_lookup(population_data))
+        with self._lock:
+            self._slices[municipality_name] = entry
+            self.load_count += 1
+            while len(self._slices) > self.max_municipalities:
+                self._slices.popitem(last=False)
+        return entry
+
+    def get_municipality(self, municipality_name):
+        # 呼び出し側が列を書き換えても共有データが壊れないようにコピーを返す
+        return self.get_slice(municipality_name)[0].copy()
+
+    def code_lookup(self, municipality_name):
+        # KEY_CODE から行ラベルを引く関数（市区町村ごとに一度だけ作成）
+        return self.get_slice(municipality_name)[1]
+
+    def invalidate(self):
+        with self._lock:
+            self._mtimes = None
+            self._slices.clear()
+            self._city_files = None
+
+
+def build_code_lookup(population_data):
+    # KEY_CODE（整数）の索引を作り、コード配列を行ラベル（見つからなければ -1）に変換する関数を返す
+    codes = population_data[CENSUS_KEY_COLUMN].to_numpy()
+    first = ~pd.Series(codes).duplicated().to_numpy()  # 重複したコードは最初の行を採用する
+    index = pd.Index(codes[first])
+    labels = population_data.index.to_numpy()[first]
+
+    def lookup(values):
+        positions = index.get_indexer(values)
+        return np.where(positions >= 0, labels[positions], -1)
+
+    return lookup
+
+
+# プロセス全体で共有する国勢調査ストア
+_default_store = CensusStore()
+
+
+def get_census_store():
+    return _default_store
+
+
+def get_population_data(municipality_name):
+    return _default_store.get_municipality(municipality_name)
@@ -1,221 +1,285 @@
 # data_loader.py
 
 import os
-import pandas as pd
+import hashlib
 import geopandas as gpd
 import logging
-from shapely.ops import unary_union
+from census_store import get_census_store, get_population_data
+from census_labels import TOTAL_LABELS
+from frame_cache import FrameCache
+from bundle import load_bundled_municipality
+from shared_store import attach_municipality
+from name_normalizer import normalize_names
+from census_join import join_census
+from dissolve import dissolve_duplicate_towns
+from slim import slim_frame, memory_report
+from extent_index import compute_extent
+from instrumentation import VERBOSE, echo, span
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 市区町村ごとのシェイプファイルを置くディレクトリ（ベンチマーク用の合成データなどに切り替え可能）
+DATA_DIR = os.environ.get('MUNICIPALITY_DATA_DIR', os.path.join(BASE_DIR, "data"))
+
+# シェイプファイルを構成するファイルの拡張子（キャッシュの無効化判定に使用）
+SHAPEFILE_PARTS = ('.shp', '.dbf', '.shx', '.prj')
+
+# 加工処理の出力が変わったら上げる（古いバンドルを無効にするため）
+PIPELINE_VERSION = 7
+
+# 読み込みモード: 'bundle' は事前ビルド済みのバンドルを優先し、無い・古い場合のみ元ファイルを加工する
+# 'raw' は常にシェイプファイルとCSVから加工する
+# 'shared' は shared_store.py で書き出したメモリマップ用ファイルをワーカー間で共有する（無い・古い場合は 'bundle' と同じ）
+LOADING_MODE = os.environ.get('DATA_LOADING_MODE', 'bundle')
+
+# 完成済みの市区町村データのLRUキャッシュ（件数・メモリ量の上限は環境変数で変更可能）
+_max_mb = os.environ.get('MUNICIPALITY_CACHE_MAX_MB')
+_frame_cache = FrameCache(
+    max_entries=int(os.environ.get('MUNICIPALITY_CACHE_SIZE', '16')),
+    max_bytes=int(float(_max_mb) * 1024 * 1024) if _max_mb else None,
+)
+
+
+# 市区町村ごとの国勢調査データとの結合率
+_match_stats = {}
+
+# データディレクトリの監視（data_watcher.py）が公開している市区町村ごとの元ファイルのシグネチャ
+# 元ファイルが変わっても、読み込み直したデータに差し替えるまでは古いシグネチャ（とキャッシュ済みのデータ）を使う
+_published_signatures = {}
+
+
+def configure_cache(max_entries=None, max_mb=None):
+    max_bytes = int(max_mb * 1024 * 1024) if max_mb is not None else None
+    _frame_cache.configure(max_entries=max_entries, max_bytes=max_bytes)
+
+
+def get_cache_stats():
+    return _frame_cache.stats()
+
+
+def get_memory_report():
+    # キャッシュ中の市区町村ごとのメモリ量（バイト）
+    return _frame_cache.memory_report()
+
+
+def _record_match_stats(municipality_name, map_data_town):
+    # どの読み込み方（加工・バンドル・共有データ・別プロセス）でも frame.attrs の結合結果を覚えておく
+    if map_data_town is not None and 'census_match' in map_data_town.attrs:
+        _match_stats[municipality_name] = map_data_town.attrs['census_match']
+
+
+def get_match_stats(municipality_name=None):
+    if municipality_name is not None:
+        return _match_stats.get(municipality_name)
+    return dict(_match_stats)
+
+
+def clear_cache(municipality_name=None):
+    _frame_cache.invalidate(municipality_name)
+
+
+def find_shapefile(municipality_name, data_dir=DATA_DIR):
+    # シェイプファイルが存在するサブディレクトリ
+    shape_dir = os.path.join(data_dir, municipality_name)
+    if not os.path.isdir(shape_dir):
+        logging.error(f"シェイプファイルのディレクトリが見つかりません: {shape_dir}")
+        echo(f"シェイプファイルのディレクトリが見つかりません: {shape_dir}")
+        raise FileNotFoundError(f"シェイプファイルのディレクトリが見つかりません: {shape_dir}")
+
+    # フォルダ内のシェイプファイルを自動的に検出
+    shapefiles = sorted(file for file in os.listdir(shape_dir) if file.endswith('.shp') and not file.startswith('~$'))
+    if not shapefiles:
+        logging.error(f"No shapefiles found in {shape_dir}")
+        echo(f"No shapefiles found in {shape_dir}")
+        raise FileNotFoundError(f"No shapefiles found in {shape_dir}")
+
+    shapefile_name = shapefiles[0]
+    if len(shapefiles) > 1:
+        # 複数のシェイプファイルが存在する場合
+        logging.warning(f"Multiple shapefiles found in {shape_dir}. Using the first one: {shapefile_name}")
+    return os.path.join(shape_dir, shapefile_name)
+
+
+def read_shapefile(shape_file_path):
+    # DBFの文字コードは市区町村によって UTF-8 と Shift_JIS が混在している
+    try:
+        return gpd.read_file(shape_file_path, encoding='utf-8')
+    except UnicodeDecodeError:
+        return gpd.read_file(shape_file_path, encoding='shift_jis')
+
+
+def census_files_for(municipality_name):
+    # その市区町村を含む国勢調査CSV（見つからない場合は設定された全ファイル）
+    store = get_census_store()
+    try:
+        return store.files_for(municipality_name) or list(store.pop_files)
+    except FileNotFoundError:
+        return list(store.pop_files)
+
+
+def read_source_signature(municipality_name):
+    # シェイプファイル一式と国勢調査CSVの (ファイル名, mtime, サイズ) の組
+    shape_file_path = find_shapefile(municipality_name)
+    stem = os.path.splitext(shape_file_path)[0]
+    paths = [stem + ext for ext in SHAPEFILE_PARTS] + census_files_for(municipality_name)
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((os.path.basename(path), stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((os.path.basename(path), None, None))
+    return (municipality_name, tuple(signature))
+
+
+def get_source_signature(municipality_name):
+    # データディレクトリを監視している場合は、差し替え済み（公開中）のシグネチャを返す
+    published = _published_signatures.get(municipality_name)
+    if published is not None:
+        return published
+    return read_source_signature(municipality_name)
+
+
+def publish_source_signature(municipality_name, signature, map_data_town=None):
+    # 読み込み直したデータをキャッシュに入れてから、公開するシグネチャを差し替える（None なら公開をやめる）
+    if map_data_town is not None:
+        _frame_cache.put(municipality_name, signature, map_data_town)
+        _record_match_stats(municipality_name, map_data_town)
+    if signature is None:
+        _published_signatures.pop(municipality_name, None)
+    else:
+        _published_signatures[municipality_name] = signature
+
+
+def get_published_signatures():
+    return dict(_published_signatures)
+
+
+def signature_version(signatures):
+    digest = hashlib.sha1(repr((PIPELINE_VERSION, list(signatures))).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def get_data_version(municipality_names):
+    # 選択された市区町村の元ファイルと加工処理のバージョンから作るデータの版数
+    # （クライアント側に残っている図形がまだ有効かどうかの判定に使う）
+    return signature_version(get_source_signature(name) for name in municipality_names)
+
+
+def get_cached_municipality_data(municipality_name, signature=None):
+    # キャッシュ（共有モードでは共有データ）にあればコピーを返し、無ければ None（読み込みはしない）
+    if LOADING_MODE == 'shared':
+        shared = attach_municipality(municipality_name)
+        if shared is not None:
+            _record_match_stats(municipality_name, shared)
+            return shared
+    if signature is None:
+        signature = get_source_signature(municipality_name)
+    return _frame_cache.get(municipality_name, signature)
+
+
+def store_municipality_data(municipality_name, signature, map_data_town):
+    # 別プロセスで読み込んだデータなどをキャッシュに登録する
+    _frame_cache.put(municipality_name, signature, map_data_town)
+    _record_match_stats(municipality_name, map_data_town)
+
+
+def read_municipality_data(municipality_name):
+    # キャッシュを通さずに読み込む（バンドルが有効ならバンドル、無ければ元ファイルを加工）
+    map_data_town = None
+    if LOADING_MODE in ('bundle', 'shared'):
+        with span('loader.bundle_read'):
+            map_data_town = load_bundled_municipality(municipality_name)
+    if map_data_town is None:
+        with span('loader.build'):
+            map_data_town = build_municipality_data(municipality_name)
+    return map_data_town
+
 
 def load_municipality_data(municipality_name):
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(BASE_DIR, "data")
+    # 元ファイルが変わっていなければキャッシュ済みのデータ（コピー）を返す
+    signature = get_source_signature(municipality_name)
+    cached = get_cached_municipality_data(municipality_name, signature)
+    if cached is None and get_source_signature(municipality_name) != signature:
+        # 調べている間にデータが差し替えられた場合は、差し替え後のデータを使う
+        signature = get_source_signature(municipality_name)
+        cached = get_cached_municipality_data(municipality_name, signature)
+    if cached is not None:
+        logging.debug(f"Cache hit for municipality: {municipality_name}")
+        return cached
+
+    map_data_town = read_municipality_data(municipality_name)
+    _frame_cache.put(municipality_name, signature, map_data_town)
+    _record_match_stats(municipality_name, map_data_town)
+    return map_data_town
+
+
+def build_municipality_data(municipality_name):
+    data_dir = DATA_DIR
     
     logging.debug(f"Loading data for municipality: {municipality_name}")
-    print(f"Loading data for municipality: {municipality_name}")
+    echo(f"Loading data for municipality: {municipality_name}")
     
-    # data直下のCSVファイルを指定
-    pop_file = os.path.join(data_dir, "tblT001082C27.csv")
+    # 国勢調査データはプロセス内で共有するストアから市区町村分だけ切り出す
+    pop_file = get_census_store().pop_file
     try:
-        # CSVファイルを読み込み（1行目を無視して2行目を列名として設定）
-        population_data = pd.read_csv(pop_file, encoding='shift_jis', skiprows=1, dtype=str)
-        print(f"Raw column names: {population_data.columns.tolist()}")
-
-        # 2行目の Unnamed: 2 と Unnamed: 3 を CITY_NAME, S_NAME に変更
-        population_data.rename(columns={'Unnamed: 2': 'CITY_NAME', 'Unnamed: 3': 'S_NAME'}, inplace=True)
-        print(f"Cleaned column names: {population_data.columns.tolist()}")
-
-        # 列名から「総数」「歳」などの不要な文字とスペースを削除
-        population_data.columns = (
-            population_data.columns
-            .str.replace(r'総数|歳', '', regex=True)  # 総数や歳を削除
-            .str.replace('〜', '～')  # 全角チルダを波ダッシュに統一
-            .str.replace(' ', '')      # 余分なスペースを削除
-            .str.strip()                # 前後の空白を削除
-        )
-
-        # 必要な列が揃っているか確認
-        required_columns = ['CITY_NAME', 'S_NAME']
-        missing_columns = [col for col in required_columns if col not in population_data.columns]
-        if missing_columns:
-            raise KeyError(f"必要な列が見つかりません: {missing_columns}")
-
-        # 特定の市区町村データをフィルタリング
-        population_data = population_data[population_data['CITY_NAME'].str.contains(municipality_name, na=False, case=False)]
-
-        # 数値データの前処理
-        numeric_cols = population_data.columns.drop(['CITY_NAME', 'S_NAME'])
-        # '-' や 'X' を NaN に置換し、数値型に変換
-        population_data[numeric_cols] = population_data[numeric_cols].replace({'-': None, 'X': None}).apply(pd.to_numeric, errors='coerce')
-        # NaN を 0 に置換
-        population_data[numeric_cols] = population_data[numeric_cols].fillna(0)
-        print("数値データの前処理を行いました。")
-
-        # 年齢別変数の生成（重要な値）
-        age_columns = {
-            'age_0_4': ['０～４'],
-            'age_5_9': ['５～９'],
-            'age_10_14': ['１０～１４'],
-            'age_15_19': ['１５～１９'],
-            'age_20_24': ['２０～２４'],
-            'age_25_29': ['２５～２９'],
-            'age_30_34': ['３０～３４'],
-            'age_35_39': ['３５～３９'],
-            'age_40_44': ['４０～４４'],
-            'age_45_49': ['４５～４９'],
-            'age_50_54': ['５０～５４'],
-            'age_55_59': ['５５～５９'],
-            'age_60_64': ['６０～６４'],
-            'age_65_69': ['６５～６９'],
-            'age_70_74': ['７０～７４'],
-            'age_over_75': ['７５以上'],
-            'male_age_under_10': ['男０～４', '男５～９'],
-            'male_age_10_14': ['男１０～１４'],
-            'male_age_10_19': ['男１０～１４', '男１５～１９'],
-            'male_age_20_29': ['男２０～２４', '男２５～２９'],
-            'male_age_20_39': ['男２０～２４', '男２５～２９', '男３０～３４', '男３５～３９'],
-            'male_age_30_39': ['男３０～３４', '男３５～３９'],
-            'male_age_40_49': ['男４０～４４', '男４５～４９'],
-            'male_age_50_59': ['男５０～５４', '男５５～５９'],
-            'male_age_60_69': ['男６０～６４', '男６５～６９'],
-            'male_age_70_74': ['男７０～７４'],
-            'male_age_over_75': ['男７５以上'],
-            'female_age_under_10': ['女０～４', '女５～９'],
-            'female_age_10_14': ['女１０～１４'],
-            'female_age_10_19': ['女１０～１４', '女１５～１９'],
-            'female_age_20_29': ['女２０～２４', '女２５～２９'],
-            'female_age_20_39': ['女２０～２４', '女２５～２９', '女３０～３４', '女３５～３９'],
-            'female_age_30_39': ['女３０～３４', '女３５～３９'],
-            'female_age_40_49': ['女４０～４４', '女４５～４９'],
-            'female_age_50_59': ['女５０～５４', '女５５～５９'],
-            'female_age_60_69': ['女６０～６４', '女６５～６９'],
-            'female_age_70_74': ['女７０～７４'],
-            'female_age_over_75': ['女７５以上'],
-            'age_under_10': ['０～４', '５～９'],
-            'age_10_19': ['１０～１４', '１５～１９'],
-            'age_20_29': ['２０～２４', '２５～２９'],
-            'age_20_39': ['２０～２４', '２５～２９', '３０～３４', '３５～３９'],
-            'age_30_39': ['３０～３４', '３５～３９'],
-            'age_40_49': ['４０～４４', '４５～４９'],
-            'age_50_59': ['５０～５４', '５５～５９'],
-            'age_60_69': ['６０～６４', '６５～６９'],
-        }
-
-        for new_col, cols in age_columns.items():
-            # 存在しない列を除外
-            existing_cols = [col for col in cols if col in population_data.columns]
-            if existing_cols:
-                population_data[new_col] = population_data[existing_cols].sum(axis=1)
-            else:
-                population_data[new_col] = 0  # 存在しない場合は0を代入
-        print("年齢別変数を生成しました。")
-
-        logging.debug(f"Final population_data columns: {population_data.columns.tolist()}")
-        print(f"Final population_data columns: {population_data.columns.tolist()}")
+        with span('loader.csv_parse'):
+            population_data = get_population_data(municipality_name)
+        echo(f"Population rows for {municipality_name}: {len(population_data)}")
 
     except FileNotFoundError:
         error_msg = f"Population data file not found: {pop_file}"
         logging.error(error_msg)
-        print(error_msg)
+        echo(error_msg)
         raise FileNotFoundError(error_msg)
     except KeyError as e:
         error_msg = f"人口データの読み込み中にエラーが発生しました: {e}"
         logging.error(error_msg)
-        print(error_msg)
+        echo(error_msg)
         raise e
     except Exception as e:
         error_msg = f"人口データの読み込み中にエラーが発生しました: {e}"
         logging.error(error_msg)
-        print(error_msg)
+        echo(error_msg)
         raise e
 
     # シェイプファイルの読み込み
     try:
-        # シェイプファイルが存在するサブディレクトリ
-        shape_dir = os.path.join(data_dir, municipality_name)
-        if not os.path.isdir(shape_dir):
-            logging.error(f"シェイプファイルのディレクトリが見つかりません: {shape_dir}")
-            print(f"シェイプファイルのディレクトリが見つかりません: {shape_dir}")
-            raise FileNotFoundError(f"シェイプファイルのディレクトリが見つかりません: {shape_dir}")
-
-        # フォルダ内のシェイプファイルを自動的に検出
-        shapefiles = [file for file in os.listdir(shape_dir) if file.endswith('.shp') and not file.startswith('~$')]
-        if not shapefiles:
-            logging.error(f"No shapefiles found in {shape_dir}")
-            print(f"No shapefiles found in {shape_dir}")
-            raise FileNotFoundError(f"No shapefiles found in {shape_dir}")
-
-        if len(shapefiles) == 1:
-            shapefile_name = shapefiles[0]
-            shape_file_path = os.path.join(shape_dir, shapefile_name)
-            logging.info(f"Found shapefile: {shapefile_name}")
-            print(f"Found shapefile: {shapefile_name}")
+        shape_file_path = find_shapefile(municipality_name, data_dir)
+        logging.info(f"Found shapefile: {os.path.basename(shape_file_path)}")
+        echo(f"Found shapefile: {os.path.basename(shape_file_path)}")
 
-        else:
-            # 複数のシェイプファイルが存在する場合
-            shapefile_name = shapefiles[0]
-            shape_file_path = os.path.join(shape_dir, shapefile_name)
-            logging.warning(f"Multiple shapefiles found in {shape_dir}. Using the first one: {shapefile_name}")
-            print(f"Multiple shapefiles found in {shape_dir}. Using the first one: {shapefile_name}")
-
-        try:
-            map_data_town = gpd.read_file(shape_file_path, encoding='utf-8')
-        except UnicodeDecodeError:
-            map_data_town = gpd.read_file(shape_file_path, encoding='shift_jis')
+        with span('loader.shapefile_read'):
+            map_data_town = read_shapefile(shape_file_path)
 
         # CRSをEPSG:4326に変換
         if map_data_town.crs != "EPSG:4326":
-            map_data_town = map_data_town.to_crs(epsg=4326)
+            with span('loader.reproject'):
+                map_data_town = map_data_town.to_crs(epsg=4326)
             logging.info("CRSをEPSG:4326に変換しました。")
-            print("CRSをEPSG:4326に変換しました。")
+            echo("CRSをEPSG:4326に変換しました。")
 
-        logging.debug(f"Shapefile data columns: {map_data_town.columns.tolist()}")
-        print(f"Shapefile data columns: {map_data_town.columns.tolist()}")
+        if VERBOSE:
+            logging.debug(f"Shapefile data columns: {map_data_town.columns.tolist()}")
+            echo(f"Shapefile data columns: {map_data_town.columns.tolist()}")
         
         # 'S_NAME'列が存在するか確認
         if 'S_NAME' not in map_data_town.columns:
             logging.error("'S_NAME'列がシェイプファイルに存在しません。")
-            print("'S_NAME'列がシェイプファイルに存在しません。")
+            echo("'S_NAME'列がシェイプファイルに存在しません。")
             raise KeyError("'S_NAME'列がシェイプファイルに存在しません。")
 
-        # 重複している地名を取得
-        duplicated_names = map_data_town[map_data_town['S_NAME'].duplicated(keep=False)]['S_NAME'].unique()
-        print(f"重複している地名: {duplicated_names}")
-
-        if len(duplicated_names) > 0:
-            # 重複地名のデータを抽出
-            filtered_shape_data = map_data_town[map_data_town['S_NAME'].isin(duplicated_names)]
-
-            # 'AREA'列が存在するか確認（存在しない場合は計算）
-            if 'AREA' not in filtered_shape_data.columns:
-                filtered_shape_data['AREA'] = filtered_shape_data.geometry.area
-
-            # 重複地名ごとにポリゴン結合と最大AREAのカラム情報を維持
-            def aggregate_data(group):
-                # 最大AREAを持つ行を基準にする
-                max_area_row = group.loc[group['AREA'].idxmax()]
-                # ポリゴンを結合
-                merged_geometry = unary_union(group.geometry)
-                # 最大AREA行のカラム情報をコピーし、ポリゴンを置き換える
-                aggregated_data = max_area_row.copy()
-                aggregated_data.geometry = merged_geometry
-                aggregated_data['KIGO_E'] = 'E1'  # 固定値
-                return aggregated_data
-
-            # S_NAME ごとにグループ化して処理
-            merged_geometries = filtered_shape_data.groupby('S_NAME').apply(aggregate_data)
-            merged_shape_data = gpd.GeoDataFrame(merged_geometries, geometry='geometry', crs=map_data_town.crs)
-
-            # 重複データを削除して結合後データだけを保持
-            map_data_town = map_data_town[~map_data_town['S_NAME'].isin(duplicated_names)]  # 重複地名を除外
-            map_data_town = pd.concat([map_data_town, merged_shape_data], ignore_index=True)  # 結合後のデータを追加
-            print("重複ポリゴンを結合しました。")
-
+        # 重複している地名のポリゴンを結合（最大AREAの行の属性を残す）
+        with span('loader.dissolve'):
+            map_data_town, duplicated_names = dissolve_duplicate_towns(map_data_town)
+        if duplicated_names:
+            echo(f"重複している地名: {duplicated_names}")
+            echo("重複ポリゴンを結合しました。")
         else:
-            print("重複する地名はありません。")
+            echo("重複する地名はありません。")
 
     except Exception as e:
         logging.error(f"シェイプファイルの読み込み中にエラーが発生しました: {e}")
-        print(f"シェイプファイルの読み込み中にエラーが発生しました: {e}")
+        echo(f"シェイプファイルの読み込み中にエラーが発生しました: {e}")
         raise e
 
     # マージ用の列を探す
@@ -228,82 +292,64 @@ def load_municipality_data(municipality_name):
 
     if not merge_left_on_city or not merge_left_on_town:
         logging.error(f"シェイプファイル内にマージ用の列が見つかりませんでした ({municipality_name})")
-        print(f"シェイプファイル内にマージ用の列が見つかりませんでした ({municipality_name})")
-        print(f"利用可能な列名: {map_data_town.columns.tolist()}")
+        echo(f"シェイプファイル内にマージ用の列が見つかりませんでした ({municipality_name})")
+        echo(f"利用可能な列名: {map_data_town.columns.tolist()}")
         raise KeyError("マージ用の列がシェイプファイルに存在しません。")
 
     try:
-        # 数字を統一するための関数を定義
-        def zenkaku_to_hankaku(text):
-            if isinstance(text, str):
-                return text.translate(str.maketrans('０１２３４５６７８９', '0123456789'))
-            return text
-
-        kanji_numbers = {
-            '0': '零', '1': '一', '2': '二', '3': '三', '4': '四',
-            '5': '五', '6': '六', '7': '七', '8': '八', '9': '九',
-            '10': '十', '11': '十一', '12': '十二', '13': '十三', '14': '十四',
-            '15': '十五', '16': '十六', '17': '十七', '18': '十八', '19': '十九',
-            '20': '二十'
-        }
-
-        def arabic_to_kanji_converter(text):
-            if isinstance(text, str):
-                for num, kanji in sorted(kanji_numbers.items(), key=lambda x: -len(x[0])):
-                    text = text.replace(num + '丁目', kanji + '丁目')
-                return text
-            return text
-
-        # 町名と市名の前処理（全角・半角、スペース、数字の統一）
-        def preprocess_name(name):
-            if pd.isnull(name):
-                return ''
-            name = str(name)
-            name = name.strip()
-            name = name.replace('　', '')  # 全角スペースを削除
-            name = name.replace(' ', '')   # 半角スペースを削除
-            name = zenkaku_to_hankaku(name)  # 全角数字を半角数字に変換
-            name = arabic_to_kanji_converter(name)  # 半角数字を漢数字に変換
-            return name.lower()
-
-        # シェイプファイルの市名と町名を前処理
-        map_data_town[merge_left_on_city] = map_data_town[merge_left_on_city].apply(preprocess_name)
-        map_data_town[merge_left_on_town] = map_data_town[merge_left_on_town].apply(preprocess_name)
-        map_data_town['city_town_key'] = map_data_town[merge_left_on_city] + '_' + map_data_town[merge_left_on_town]
-
-        # 人口データの市名と町名を前処理
-        population_data['CITY_NAME'] = population_data['CITY_NAME'].apply(preprocess_name)
-        population_data['S_NAME'] = population_data['S_NAME'].apply(preprocess_name)
-        population_data['city_town_key'] = population_data['CITY_NAME'] + '_' + population_data['S_NAME']
-
-        # マージ
-        map_data_town = map_data_town.merge(population_data, on='city_town_key', how='left')
-        logging.debug(f"After merge, map_data_town columns: {map_data_town.columns.tolist()}")
-        print(f"After merge, map_data_town columns: {map_data_town.columns.tolist()}")
+        # シェイプファイルの市名と町名を前処理（全角・半角、スペース、数字の統一）
+        with span('loader.normalize'):
+            map_data_town[merge_left_on_city] = normalize_names(map_data_town[merge_left_on_city])
+            map_data_town[merge_left_on_town] = normalize_names(map_data_town[merge_left_on_town])
+            map_data_town['city_town_key'] = map_data_town[merge_left_on_city] + '_' + map_data_town[merge_left_on_town]
+
+        # 人口データとの結合（KEY_CODE の整数結合を優先し、残りを名前で結合）
+        with span('loader.merge'):
+            map_data_town, match_stats = join_census(
+                map_data_town, population_data, code_lookup=get_census_store().code_lookup(municipality_name)
+            )
+        map_data_town.attrs['census_match'] = match_stats
+        _match_stats[municipality_name] = match_stats
+        if VERBOSE:
+            logging.debug(f"After merge, map_data_town columns: {map_data_town.columns.tolist()}")
+            echo(f"After merge, map_data_town columns: {map_data_town.columns.tolist()}")
     except Exception as e:
         logging.error(f"データのマージ中にエラーが発生しました: {e}")
-        print(f"データのマージ中にエラーが発生しました: {e}")
+        echo(f"データのマージ中にエラーが発生しました: {e}")
         raise e
 
-    # マージ後の欠損値確認
-    if 'age_20_39' in map_data_town.columns:
-        missing = map_data_town['age_20_39'].isnull().sum()
-        print(f"マージ後のage_20_39の欠損値数: {missing}")
+    # マージ後の欠損値確認（国勢調査の総数が無い町丁目は結合できていない）
+    total_column = TOTAL_LABELS[0]
+    if total_column in map_data_town.columns:
+        missing = map_data_town[total_column].isnull().sum()
+        echo(f"マージ後の人口総数の欠損値数: {missing}")
         if missing > 0:
-            logging.warning(f"マージ後に{missing}件のage_20_39の欠損値が発生しました。")
-            print(f"マージ後に{missing}件のage_20_39の欠損値が発生しました。")
+            logging.warning(f"マージ後に{missing}件の人口総数の欠損値が発生しました。")
+            echo(f"マージ後に{missing}件の人口総数の欠損値が発生しました。")
 
             # 一致していないcity_town_keyの確認（オプション）
-            unmatched = map_data_town[map_data_town['age_20_39'].isnull()]['city_town_key'].unique()
-            print("一致していない市区町村と町名の組み合わせ:", unmatched)
+            unmatched = map_data_town[map_data_town[total_column].isnull()]['city_town_key'].unique()
+            echo("一致していない市区町村と町名の組み合わせ:", unmatched)
             logging.debug(f"一致していない市区町村と町名の組み合わせ: {unmatched}")
     else:
-        print("age_20_39列が存在しません。")
+        echo("人口総数の列が存在しません。")
 
     logging.info("データのマージが完了しました。")
-    print("データのマージが完了しました。")
-
-    logging.debug(f"Final map_data_town columns: {map_data_town.columns.tolist()}")
-    print(f"Final map_data_town columns: {map_data_town.columns.tolist()}")
+    echo("データのマージが完了しました。")
+
+    # アプリが読まない列を落とし、人数・名前を小さい型にする
+    before = memory_report(map_data_town)
+    with span('loader.slim'):
+        map_data_town = slim_frame(map_data_town)
+    after = memory_report(map_data_town)
+    logging.info(f"Memory for {municipality_name}: {before['total_bytes'] / 1e6:.2f} MB -> "
+                 f"{after['total_bytes'] / 1e6:.2f} MB ({after['rows']} rows)")
+
+    # 地図の中心・ズーム用の範囲（外接矩形・重心・面積）
+    map_data_town.attrs['extent'] = compute_extent(map_data_town)
+
+    if VERBOSE:
+        logging.debug(f"Final map_data_town columns: {map_data_town.columns.tolist()}")
+        echo(f"Final map_data_town columns: {map_data_town.columns.tolist()}")
 
     return map_data_town
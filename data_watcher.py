@@ -0,0 +1,154 @@
+# data_watcher.py
+#
+# データディレクトリ（市区町村のフォルダと国勢調査CSV）の変更を監視し、サーバーを止めずに反映する
+# DATA_WATCH_INTERVAL 秒ごとに各市区町村の元ファイルのシグネチャ（mtime・サイズ）を調べ、
+# 変わった市区町村のうち読み込み済みのものだけをバックグラウンドで読み込み直す
+# 読み込み直している間は古いデータで応答し、新しいデータ（索引・簡略化ジオメトリ・範囲も作成済み）ができた時点で差し替える
+# 市区町村の追加・削除は、画面の市区町村の選択肢にコールバックで反映する（callbacks.refresh_city_options）
+
+import os
+import threading
+import logging
+import multiprocessing
+
+# 監視の間隔 [秒]（0 で無効）
+DATA_WATCH_INTERVAL = float(os.environ.get('DATA_WATCH_INTERVAL', '10'))
+
+_watcher = None
+
+
+class DataWatcher:
+    def __init__(self, interval=DATA_WATCH_INTERVAL):
+        self.interval = interval
+        self.cities = []
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # 前回の確認で変わっていたシグネチャ（コピー中のファイルを読まないよう、2回続けて同じなら反映する）
+        self._seen = {}
+
+    def snapshot(self):
+        from bundle import list_municipalities
+        from data_loader import read_source_signature
+
+        return {name: read_source_signature(name) for name in list_municipalities()}
+
+    def start(self):
+        from bundle import list_municipalities
+
+        self.cities = list_municipalities()
+        self._thread = threading.Thread(target=self.run, name='data-watcher', daemon=True)
+        self._thread.start()
+        logging.info(f"Watching data directory every {self.interval:g} s ({len(self.cities)} municipalities)")
+
+    def publish_initial(self):
+        # 起動時点のシグネチャを公開する（データの読み込み処理の読み込みで起動を遅くしないよう、監視のスレッドで行う）
+        from data_loader import publish_source_signature
+
+        signatures = self.snapshot()
+        for name, signature in signatures.items():
+            publish_source_signature(name, signature)
+        with self._lock:
+            self.cities = list(signatures)
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        try:
+            self.publish_initial()
+        except Exception:
+            logging.exception("データディレクトリの確認中にエラーが発生しました。")
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logging.exception("データディレクトリの確認中にエラーが発生しました。")
+
+    def check(self):
+        from data_loader import get_published_signatures, get_memory_report, publish_source_signature, clear_cache
+        from town_index import get_town_index
+
+        signatures = self.snapshot()
+        published = get_published_signatures()
+        removed = [name for name in published if name not in signatures]
+        changed = {name: signature for name, signature in signatures.items() if published.get(name) != signature}
+        settled = {name: signature for name, signature in changed.items() if self._seen.get(name) == signature}
+        self._seen = changed
+
+        for name in removed:
+            logging.info(f"Municipality removed: {name}")
+            publish_source_signature(name, None)
+            clear_cache(name)
+            get_town_index().remove(name)
+
+        # 読み込み済みの市区町村だけを読み込み直す（それ以外は次に選ばれたときに新しいデータを読む）
+        cached = set(get_memory_report())
+        for name, signature in settled.items():
+            if name in cached:
+                self.reload(name, signature)
+            else:
+                publish_source_signature(name, signature)
+
+        cities = [name for name in signatures if name in get_published_signatures()]
+        if cities != self.cities:
+            added = [name for name in cities if name not in self.cities]
+            if added:
+                logging.info(f"Municipalities added: {added}")
+            with self._lock:
+                self.cities = cities
+
+    def reload(self, name, signature):
+        # 古いデータで応答を続けながら読み込み、索引などを新しい版数で作ってから差し替える
+        from data_loader import read_municipality_data, publish_source_signature, signature_version
+        from parallel_loader import MAX_WORKERS, get_executor
+        from warmup import prepare_municipality
+
+        logging.info(f"Reloading changed municipality in the background: {name}")
+        try:
+            if MAX_WORKERS > 1:
+                frame = get_executor().submit(read_municipality_data, name).result()
+            else:
+                frame = read_municipality_data(name)
+            prepare_municipality(name, frame, signature_version([signature]))
+        except Exception:
+            # 失敗したら古いデータを使い続け、次の確認で改めて読み込む
+            logging.exception(f"市区町村データの読み込み直しに失敗しました: {name}")
+            self._seen.pop(name, None)
+            return
+        publish_source_signature(name, signature, frame)
+        self.reloads += 1
+        logging.info(f"Municipality data swapped: {name}")
+
+    def city_list(self):
+        with self._lock:
+            return list(self.cities)
+
+
+def get_data_watcher():
+    return _watcher
+
+
+def current_cities():
+    # 画面の選択肢にする市区町村（監視していなければデータディレクトリをその場で調べる）
+    if _watcher is not None:
+        return _watcher.city_list()
+    from bundle import list_municipalities
+    return list_municipalities()
+
+
+def start_data_watcher(interval=DATA_WATCH_INTERVAL):
+    global _watcher
+
+    # 読み込み用のワーカープロセス（spawn で app.py が再読み込みされる）では監視しない
+    if interval <= 0 or multiprocessing.parent_process() is not None or _watcher is not None:
+        return _watcher
+    # data_loader.LOADING_MODE と同じ設定（起動時に data_loader を読み込まないよう環境変数を直接見る）
+    if os.environ.get('DATA_LOADING_MODE', 'bundle') == 'shared':
+        # 共有モードのデータは起動時にマスタープロセスが書き出したものなので、差し替えには再起動が必要
+        logging.info("Data directory watching is disabled in shared loading mode.")
+        return None
+    _watcher = DataWatcher(interval)
+    _watcher.start()
+    return _watcher
@@ -0,0 +1,55 @@
+# dissolve.py
+#
+# 同じ町名（S_NAME）で複数に分かれているポリゴンを1つにまとめる
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+
+
+def projected_area(gdf):
+    # 面積は投影座標系（UTM）で計算する（緯度経度のままだと「平方度」になるため）
+    if gdf.crs is not None and gdf.crs.is_geographic:
+        return gdf.geometry.to_crs(gdf.estimate_utm_crs()).area
+    return gdf.geometry.area
+
+
+def group_union(geoms, codes, n_groups):
+    # グループごとのポリゴンを (グループ数, 最大件数) の配列に並べ、1回の union_all でまとめて結合する
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    starts = np.searchsorted(sorted_codes, np.arange(n_groups))
+    positions = np.arange(len(sorted_codes)) - starts[sorted_codes]
+    padded = np.full((n_groups, positions.max() + 1 if len(positions) else 1), None, dtype=object)
+    padded[sorted_codes, positions] = geoms[order]
+    return shapely.union_all(padded, axis=1)
+
+
+def dissolve_duplicate_towns(gdf, name_column='S_NAME', area_column='AREA'):
+    # 重複している町名ごとに、最大面積の行の属性を残してポリゴンを結合する
+    # 重複の無い行は元の順序のまま、結合した行は町名順に後ろへ並べる
+    duplicated = gdf[name_column].duplicated(keep=False).to_numpy()
+    if not duplicated.any():
+        return gdf, []
+
+    duplicates = gdf[duplicated]
+    if area_column in duplicates.columns:
+        area = duplicates[area_column]
+    else:
+        area = projected_area(duplicates)
+
+    # 町名ごとの最大面積の行（町名順）
+    max_area_labels = area.groupby(duplicates[name_column]).idxmax()
+    merged = gdf.loc[max_area_labels.to_numpy()].copy()
+
+    # 町名順のグループ番号を振ってジオメトリをまとめて結合
+    codes = pd.Index(max_area_labels.index).get_indexer(duplicates[name_column])
+    geoms = np.asarray(duplicates.geometry.values, dtype=object)
+    merged[merged.geometry.name] = gpd.GeoSeries(
+        group_union(geoms, codes, len(max_area_labels)), index=merged.index, crs=gdf.crs
+    )
+    merged['KIGO_E'] = 'E1'  # 固定値
+
+    result = pd.concat([gdf[~duplicated], merged], ignore_index=True)
+    return result, list(max_area_labels.index)
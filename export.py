@@ -0,0 +1,219 @@
+# export.py
+#
+# 市区町村 × 変数の塗り分け地図（HTML、kaleido があれば PNG）と町丁目ごとの集計 CSV を、
+# サーバーを起動せずに一括で書き出す
+# 使い方: python export.py [--cities 大東市 門真市] [--variables age_20_39 ...] [--format html png] [--output export]
+#
+# 市区町村ごとに1回だけ読み込み、その市区町村の全変数を続けて描く（市区町村単位でプロセスプールに分配する）
+# 出力は1ファイルずつ一時ファイルから差し替えるので、中断しても次回は書き出し済みのファイルを飛ばして再開できる
+# 元データが変わった市区町村（manifest.json の版数が違うもの）は書き出し直す
+
+import os
+import json
+import time
+import logging
+import argparse
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EXPORT_DIR = os.environ.get('EXPORT_DIR', os.path.join(BASE_DIR, "export"))
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+MANIFEST_NAME = "manifest.json"
+SUMMARY_NAME = "towns.csv"
+
+# HTML は出力先の直下に置いた plotly.js を参照する（ネットワーク無しで開ける）
+PLOTLY_JS_NAME = "plotly.min.js"
+
+# PNG の大きさ [px]
+IMAGE_WIDTH = 1200
+IMAGE_HEIGHT = 840
+
+
+def municipality_dir(output_dir, municipality_name):
+    return os.path.join(output_dir, municipality_name)
+
+
+def read_manifest(city_dir):
+    try:
+        with open(os.path.join(city_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_text(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def write_atomic(path, write):
+    # write(一時ファイルのパス) で書き出してから差し替える（途中で止まっても書きかけのファイルを残さない）
+    tmp_path = path + f'.tmp{os.getpid()}'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def prepare_municipality_dir(city_dir, data_version, force=False):
+    # 版数が変わった（または --force の）ときは以前の出力を消してから書き出し直す
+    os.makedirs(city_dir, exist_ok=True)
+    manifest = read_manifest(city_dir)
+    if force or manifest is None or manifest.get('data_version') != data_version:
+        for name in os.listdir(city_dir):
+            if name.endswith(('.html', '.png', '.csv')):
+                os.remove(os.path.join(city_dir, name))
+        manifest = {'data_version': data_version}
+        write_atomic(os.path.join(city_dir, MANIFEST_NAME), lambda path: write_text(path, json.dumps(manifest)))
+
+
+def write_summary(path, frame, variables):
+    # 町丁目ごとの全変数の値（Excel で開けるよう BOM 付き UTF-8）
+    import pandas as pd
+    from variables import evaluate
+
+    values = evaluate(frame, variables)
+    summary = pd.DataFrame(values, columns=variables)
+    summary.insert(0, 'city_town_key', frame['city_town_key'].astype(str).to_numpy())
+    write_atomic(path, lambda tmp_path: summary.to_csv(tmp_path, index=False, encoding='utf-8-sig'))
+
+
+def recolor_figure(fig, frames, variable):
+    # ジオメトリ（GeoJSON）は作り直さず、色の値・ホバー表示・カラーバーの見出しだけを差し替える
+    # （callbacks.build_color_patch がブラウザ上の地図に送る差分と同じ内容）
+    from callbacks import hover_template, variable_label
+    from variables import variable_values
+
+    display_label = variable_label(variable)
+    fig.update_traces(z=variable_values(frames, variable), hovertemplate=hover_template(display_label))
+    fig.update_layout(coloraxis_colorbar_title_text=display_label)
+    return fig
+
+
+def export_municipality(municipality_name, variables, output_dir, formats, force=False):
+    # プロセスプールのワーカーで実行する。市区町村を1回読み込み、全変数の地図と集計 CSV を書き出す
+    from data_loader import load_municipality_data, get_data_version
+    from callbacks import build_map_figure
+
+    started = time.perf_counter()
+    city_dir = municipality_dir(output_dir, municipality_name)
+    prepare_municipality_dir(city_dir, get_data_version([municipality_name]), force)
+
+    pending = [
+        (variable, fmt) for variable in variables for fmt in formats
+        if not os.path.exists(os.path.join(city_dir, f"{variable}.{fmt}"))
+    ]
+    summary_path = os.path.join(city_dir, SUMMARY_NAME)
+    if not pending and os.path.exists(summary_path):
+        return municipality_name, 0, time.perf_counter() - started
+
+    frames = {municipality_name: load_municipality_data(municipality_name)}
+    written = 0
+    if not os.path.exists(summary_path):
+        write_summary(summary_path, frames[municipality_name], variables)
+        written += 1
+
+    fig = None
+    for variable in dict.fromkeys(variable for variable, _ in pending):
+        if fig is None:
+            fig = build_map_figure(frames, variable)
+            if fig is None:
+                raise ValueError(f"地図を作成できません: {municipality_name}")
+        else:
+            recolor_figure(fig, frames, variable)
+        for fmt in (fmt for pending_variable, fmt in pending if pending_variable == variable):
+            path = os.path.join(city_dir, f"{variable}.{fmt}")
+            if fmt == 'html':
+                write_atomic(path, lambda tmp_path: fig.write_html(
+                    tmp_path, include_plotlyjs=f'../{PLOTLY_JS_NAME}', full_html=True))
+            else:
+                write_atomic(path, lambda tmp_path: fig.write_image(
+                    tmp_path, format='png', width=IMAGE_WIDTH, height=IMAGE_HEIGHT))
+            written += 1
+    return municipality_name, written, time.perf_counter() - started
+
+
+def write_plotly_js(output_dir):
+    path = os.path.join(output_dir, PLOTLY_JS_NAME)
+    if os.path.exists(path):
+        return
+    from plotly.offline import get_plotlyjs
+    write_atomic(path, lambda tmp_path: write_text(tmp_path, get_plotlyjs()))
+
+
+def export_all(cities=None, variables=None, output_dir=EXPORT_DIR, formats=('html',), workers=EXPORT_WORKERS,
+               force=False):
+    from bundle import list_municipalities
+    from layout import variable_options
+
+    cities = cities or list_municipalities()
+    variables = variables or list(dict.fromkeys(variable_options.values()))
+    formats = list(formats)
+    if 'png' in formats and importlib.util.find_spec('kaleido') is None:
+        logging.warning("kaleido がインストールされていないため、PNG は書き出しません。")
+        formats.remove('png')
+    os.makedirs(output_dir, exist_ok=True)
+    if 'html' in formats:
+        write_plotly_js(output_dir)
+
+    started = time.perf_counter()
+    failed = []
+    print(f"Exporting {len(cities)} municipalities x {len(variables)} variables ({', '.join(formats)}) to {output_dir}")
+    if workers <= 1 or len(cities) <= 1:
+        for done, city in enumerate(cities, 1):
+            try:
+                name, written, seconds = export_municipality(city, variables, output_dir, formats, force)
+                print(f"  [{done}/{len(cities)}] {name}: {written} files ({seconds:.1f} s)")
+            except Exception:
+                logging.exception(f"書き出し中にエラーが発生しました: {city}")
+                failed.append(city)
+    else:
+        # サーバーと同じく spawn で起動する（親プロセスのスレッドやロックを引き継がない）
+        with ProcessPoolExecutor(max_workers=min(workers, len(cities)),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {
+                executor.submit(export_municipality, city, variables, output_dir, formats, force): city
+                for city in cities
+            }
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    city = futures[future]
+                    try:
+                        name, written, seconds = future.result()
+                        print(f"  [{done}/{len(cities)}] {name}: {written} files ({seconds:.1f} s)")
+                    except Exception:
+                        logging.exception(f"書き出し中にエラーが発生しました: {city}")
+                        failed.append(city)
+            except KeyboardInterrupt:
+                # 書き出し済みのファイルは残るので、もう一度実行すれば続きから再開する
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+    print(f"Finished in {time.perf_counter() - started:.1f} s" + (f" ({len(failed)} failed: {failed})" if failed else ""))
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="市区町村 × 変数の地図と町丁目の集計を一括で書き出します。")
+    parser.add_argument('--cities', nargs='*', help="対象の市区町村（省略時は全て）")
+    parser.add_argument('--variables', nargs='*', help="対象の変数（省略時は画面の変数の選択肢すべて）")
+    parser.add_argument('--format', nargs='+', choices=['html', 'png'], default=['html'], help="地図の形式")
+    parser.add_argument('--output', default=EXPORT_DIR, help="出力先ディレクトリ")
+    parser.add_argument('--workers', type=int, default=EXPORT_WORKERS, help="同時に処理する市区町村の数")
+    parser.add_argument('--force', action='store_true', help="書き出し済みのファイルも作り直す")
+    args = parser.parse_args(argv)
+
+    # 一括書き出しでは開発用の print 出力と DEBUG ログを止める（APP_VERBOSE=1 で有効）
+    os.environ.setdefault('APP_VERBOSE', '0')
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(message)s')
+    failed = export_all(cities=args.cities, variables=args.variables, output_dir=args.output,
+                        formats=args.format, workers=args.workers, force=args.force)
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# extent_index.py
+#
+# 市区町村ごとの範囲（Web メルカトルでの外接矩形・面積で重み付けした重心・総面積）の索引
+# 地図の中心とズームは、選択された市区町村の範囲を組み合わせるだけで求める（ポリゴンの結合はしない）
+
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+import shapely
+from pyproj import Transformer
+
+# 地図の表示領域の大きさ [px]（layout.py の mapPlot の高さと、画面幅の8割程度の幅）
+MAP_WIDTH_PX = 1000
+MAP_HEIGHT_PX = 700
+
+# 範囲の周りに残す余白（表示領域に対する割合）
+FIT_PADDING = 0.9
+
+# Mapbox のタイルの大きさ [px] と、ズーム0での地球一周の長さ [m]（Web メルカトル）
+TILE_SIZE = 512
+EARTH_CIRCUMFERENCE = 2 * math.pi * 6378137.0
+
+MIN_ZOOM = 5
+MAX_ZOOM = 15
+
+MAX_CACHED_MUNICIPALITIES = 256
+
+_to_lonlat = Transformer.from_crs("EPSG:3857", "EPSG:4326", always_xy=True)
+
+# (市区町村名, データの版数) -> 範囲
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def compute_extent(frame):
+    # 重心は町丁目の重心を面積で重み付けした平均
+    # （町丁目どうしが重ならなければ、全体を結合したポリゴンの重心と一致する）
+    geoms = np.asarray(frame.geometry.to_crs(epsg=3857).values, dtype=object)
+    geoms = geoms[~(shapely.is_missing(geoms) | shapely.is_empty(geoms))]
+    if len(geoms) == 0:
+        return None
+    areas = shapely.area(geoms)
+    centroids = shapely.get_coordinates(shapely.centroid(geoms))
+    total_area = float(areas.sum())
+    if total_area > 0:
+        centroid = (areas @ centroids) / total_area
+    else:
+        centroid = centroids.mean(axis=0)
+    minx, miny, maxx, maxy = shapely.total_bounds(geoms)
+    return {
+        'bounds': [float(minx), float(miny), float(maxx), float(maxy)],
+        'centroid': [float(centroid[0]), float(centroid[1])],
+        'area': total_area,
+    }
+
+
+def get_extent(municipality_name, data_version, frame):
+    # 加工時に frame.attrs['extent'] に入れた範囲があればそれを使い、無ければ計算して覚えておく
+    key = (municipality_name, data_version)
+    with _lock:
+        extent = _cache.get(key)
+        if extent is not None:
+            _cache.move_to_end(key)
+            return extent
+    extent = frame.attrs.get('extent') or compute_extent(frame)
+    with _lock:
+        _cache[key] = extent
+        while len(_cache) > MAX_CACHED_MUNICIPALITIES:
+            _cache.popitem(last=False)
+    return extent
+
+
+def combine_extents(extents):
+    # 複数の市区町村の範囲を1つにまとめる（外接矩形の和と、面積で重み付けした重心）
+    extents = [extent for extent in extents if extent is not None]
+    if not extents:
+        return None
+    bounds = np.array([extent['bounds'] for extent in extents])
+    centroids = np.array([extent['centroid'] for extent in extents])
+    areas = np.array([extent['area'] for extent in extents])
+    total_area = float(areas.sum())
+    centroid = (areas @ centroids) / total_area if total_area > 0 else centroids.mean(axis=0)
+    return {
+        'bounds': [float(bounds[:, 0].min()), float(bounds[:, 1].min()),
+                   float(bounds[:, 2].max()), float(bounds[:, 3].max())],
+        'centroid': [float(centroid[0]), float(centroid[1])],
+        'area': total_area,
+    }
+
+
+def fit_zoom(extent, width_px=MAP_WIDTH_PX, height_px=MAP_HEIGHT_PX):
+    # 重心を中心にしたときに外接矩形全体が表示領域に収まるズームレベル
+    minx, miny, maxx, maxy = extent['bounds']
+    cx, cy = extent['centroid']
+    span_x = 2 * max(cx - minx, maxx - cx)
+    span_y = 2 * max(cy - miny, maxy - cy)
+    zooms = []
+    for span, size_px in ((span_x, width_px), (span_y, height_px)):
+        if span > 0:
+            zooms.append(math.log2(EARTH_CIRCUMFERENCE * size_px * FIT_PADDING / (TILE_SIZE * span)))
+    if not zooms:
+        return MAX_ZOOM
+    return max(min(min(zooms), MAX_ZOOM), MIN_ZOOM)
+
+
+def viewport(extents, width_px=MAP_WIDTH_PX, height_px=MAP_HEIGHT_PX):
+    # 地図の中心（緯度経度）とズームレベル
+    extent = combine_extents(extents)
+    if extent is None:
+        return None, None
+    lon, lat = _to_lonlat.transform(*extent['centroid'])
+    return {"lat": lat, "lon": lon}, fit_zoom(extent, width_px, height_px)
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
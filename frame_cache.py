@@ -0,0 +1,118 @@
+# frame_cache.py
+
+import threading
+import logging
+from collections import OrderedDict
+import pandas as pd
+import shapely
+import geopandas as gpd
+from slim import pack_geometry
+
+
+def estimate_frame_bytes(frame):
+    # 属性列のメモリ量に、ジオメトリの座標数（x, y の倍精度）を加えた概算値
+    total = int(frame.memory_usage(deep=True, index=True).sum())
+    if 'geometry' in frame.columns:
+        total += int(shapely.get_num_coordinates(frame.geometry.values).sum()) * 16
+    return total
+
+
+class FrameCache:
+    # 市区町村名ごとに完成済みのGeoDataFrameを保持するLRUキャッシュ
+    # エントリは元ファイルのシグネチャ（mtime・サイズ）と一致した場合のみヒットとする
+    def __init__(self, max_entries=16, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_entries=None, max_bytes=None):
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, name, signature):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry[0] != signature:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+            _, frame, _, packed = entry
+        # 呼び出し側が結合・CRS変換・列追加をしてもキャッシュ本体が変わらないようにコピーを返す
+        frame = frame.copy(deep=True)
+        if packed is None:
+            return frame
+        geometry_name, crs, geometry = packed
+        geometries = gpd.GeoSeries(geometry.unpack(), index=frame.index, crs=crs, name=geometry_name)
+        result = gpd.GeoDataFrame(frame, geometry=geometries)
+        result.attrs = dict(frame.attrs)
+        return result
+
+    def put(self, name, signature, frame):
+        # ポリゴンの座標は連続した float32 の配列にまとめて保持する（取り出すときに復元する）
+        geometry = pack_geometry(frame.geometry.values) if isinstance(frame, gpd.GeoDataFrame) else None
+        if geometry is not None:
+            geometry_name = frame.geometry.name
+            packed = (geometry_name, frame.crs, geometry)
+            attrs = dict(frame.attrs)
+            frame = pd.DataFrame(frame.drop(columns=[geometry_name]))
+            frame.attrs = attrs
+            nbytes = estimate_frame_bytes(frame) + geometry.nbytes
+        else:
+            packed = None
+            frame = frame.copy(deep=True)
+            nbytes = estimate_frame_bytes(frame)
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[name] = (signature, frame, nbytes, packed)
+            self._bytes += nbytes
+            self._evict()
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                old = self._entries.pop(name, None)
+                if old is not None:
+                    self._bytes -= old[2]
+
+    def _evict(self):
+        # 件数またはメモリ量の上限を超えた分を古い順に追い出す（最新の1件は残す）
+        while len(self._entries) > 1 and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            name, (_, _, nbytes, _) = self._entries.popitem(last=False)
+            self._bytes -= nbytes
+            self.evictions += 1
+            logging.debug(f"Evicted cached municipality: {name}")
+
+    def memory_report(self):
+        # 市区町村名 -> キャッシュ内のメモリ量（バイト、古い順）
+        with self._lock:
+            return {name: entry[2] for name, entry in self._entries.items()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,129 @@
+# geometry_pyramid.py
+#
+# ズームレベルに応じて簡略化したジオメトリを市区町村ごとに事前計算してキャッシュする
+# 隣り合う町丁目が境界線を共有したまま簡略化されるよう、境界線を辺に分解してから簡略化する
+# ピラミッドは市区町村ごとに作るので、市区町村の外周（隣の市区町村との境界）は簡略化せず元の頂点のまま残す
+# （両側の市区町村が同じ頂点を持つので、一緒に選んでも境界に隙間や重なりができない）
+
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+import shapely
+from shapely.ops import linemerge
+
+# (このズーム以上で使う, 簡略化の許容誤差[度]) 。0 は元の解像度
+PYRAMID_LEVELS = [
+    (14.0, 0.0),
+    (12.0, 0.00003),
+    (10.0, 0.0001),
+    (0.0, 0.0003),
+]
+
+MAX_CACHED_MUNICIPALITIES = 32
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def tolerance_for_zoom(zoom):
+    for min_zoom, tolerance in PYRAMID_LEVELS:
+        if zoom >= min_zoom:
+            return tolerance
+    return PYRAMID_LEVELS[-1][1]
+
+
+def _simplify_shared_edges(geoms, tolerance):
+    # 1. 全ポリゴンの境界線を交点で分割し、分岐点の間をつないだ「辺」にする
+    noded = shapely.union_all(shapely.boundary(geoms))
+    edges = shapely.get_parts(linemerge(noded))
+    # 2. 2つの町丁目に挟まれた辺だけを簡略化（端点は動かないので隣接ポリゴンとの共有境界が保たれる）
+    #    1つの町丁目にしか接しない辺は市区町村の外周なので、隣の市区町村と合うようそのまま残す
+    tree = shapely.STRtree(geoms)
+    midpoints = shapely.line_interpolate_point(edges, 0.5, normalized=True)
+    # （中点は丸め誤差で境界線からわずかにずれるので、許容誤差よりずっと小さい距離で判定する）
+    edge_idx, _ = tree.query(midpoints, predicate='dwithin', distance=tolerance * 1e-4)
+    shared = np.bincount(edge_idx, minlength=len(edges)) >= 2
+    simplified_edges = np.where(shared, shapely.simplify(edges, tolerance, preserve_topology=True), edges)
+    #    簡略化で外周を横切るようになった辺は元に戻す（外にはみ出した面が隣の市区町村に重ならないように）
+    if shared.any() and not shared.all():
+        outer = shapely.union_all(edges[~shared])
+        crossing = shared & shapely.intersects(simplified_edges, outer) & ~shapely.touches(simplified_edges, outer)
+        simplified_edges[crossing] = edges[crossing]
+    # 3. 簡略化した辺から面を作り直し、元のどのポリゴンに属するかを割り当てる
+    faces = shapely.get_parts(shapely.polygonize(simplified_edges))
+    if len(faces) == 0:
+        return None
+    points = shapely.point_on_surface(faces)
+    face_idx, geom_idx = tree.query(points, predicate='intersects')
+    owner = np.full(len(faces), -1)
+    owner[face_idx] = geom_idx
+    # 境界の移動で元のポリゴンからわずかにはみ出した面は、許容誤差内の最も近いポリゴンに割り当てる
+    missing = np.flatnonzero(owner < 0)
+    if len(missing):
+        near_idx, near_geom = tree.query_nearest(points[missing], max_distance=tolerance * 2)
+        owner[missing[near_idx]] = near_geom
+
+    result = np.empty(len(geoms), dtype=object)
+    order = np.argsort(owner, kind='stable')
+    sorted_owner = owner[order]
+    for geom_index in range(len(geoms)):
+        start, end = np.searchsorted(sorted_owner, [geom_index, geom_index + 1])
+        if start == end:
+            continue
+        result[geom_index] = shapely.union_all(faces[order[start:end]])
+    return result
+
+
+def simplify_coverage(geoms, tolerance):
+    geoms = np.asarray(geoms, dtype=object)
+    if tolerance <= 0:
+        return geoms
+    # GEOS 3.12 以降の shapely にはカバレッジ簡略化が用意されている（外周は簡略化しない）
+    if hasattr(shapely, 'coverage_simplify'):
+        return shapely.coverage_simplify(geoms, tolerance, simplify_boundary=False)
+
+    fallback = shapely.simplify(geoms, tolerance, preserve_topology=True)
+    try:
+        result = _simplify_shared_edges(geoms, tolerance)
+    except shapely.errors.GEOSException as e:
+        logging.warning(f"Shared-edge simplification failed ({e}). Simplifying polygons individually.")
+        return fallback
+    if result is None:
+        return fallback
+
+    # 面が割り当てられなかった・面積が大きく変わったポリゴンは元のジオメトリで置き換える
+    # （個別に簡略化すると隣の町丁目・市区町村との境界がずれるため）
+    valid = np.array([geom is not None for geom in result])
+    original_area = shapely.area(geoms)
+    new_area = np.where(valid, shapely.area(np.where(valid, result, None)), 0.0)
+    broken = ~valid | (np.abs(new_area - original_area) > 0.2 * np.maximum(original_area, 1e-12))
+    if broken.any():
+        logging.debug(f"{int(broken.sum())} polygons kept their original geometry.")
+        result[broken] = geoms[broken]
+    return result
+
+
+def build_pyramid(geoms):
+    return {tolerance: simplify_coverage(geoms, tolerance) for _, tolerance in PYRAMID_LEVELS}
+
+
+def get_simplified_geometry(municipality_name, data_version, geometry, zoom):
+    # geometry は load_municipality_data が返したGeoSeries（行の並びはキャッシュ内の順序と一致）
+    key = (municipality_name, data_version)
+    with _lock:
+        pyramid = _cache.get(key)
+        if pyramid is not None:
+            _cache.move_to_end(key)
+    if pyramid is None:
+        pyramid = build_pyramid(geometry.values)
+        with _lock:
+            _cache[key] = pyramid
+            while len(_cache) > MAX_CACHED_MUNICIPALITIES:
+                _cache.popitem(last=False)
+    return pyramid[tolerance_for_zoom(zoom)]
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
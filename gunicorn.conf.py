@@ -0,0 +1,29 @@
+# gunicorn.conf.py
+#
+# 複数ワーカーで動かすときの設定（gunicorn は requirements.txt には含めていないので別途インストールする）
+# 使い方: DATA_LOADING_MODE=shared gunicorn -c gunicorn.conf.py app:server
+#
+# 共有モードでは、起動時にマスタープロセスが市区町村データをメモリマップ用のファイルに書き出し、
+# 各ワーカーはそれを開くだけにする（ワーカーを増やしても市区町村データのメモリは増えない）
+
+import os
+import logging
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8041')
+workers = int(os.environ.get('WEB_CONCURRENCY', '4'))
+timeout = 120
+
+# 本番モードで起動する（開発用の print 出力と DEBUG ログも止める。APP_VERBOSE=1 で有効）
+os.environ.setdefault('APP_ENV', 'production')
+os.environ.setdefault('APP_VERBOSE', '0')
+
+
+def on_starting(server):
+    if os.environ.get('DATA_LOADING_MODE') != 'shared':
+        return
+    from shared_store import build_shared_store
+    try:
+        build_shared_store()
+    except Exception:
+        # 書き出せなくても、各ワーカーがバンドルや元ファイルから読み込むので起動は続ける
+        logging.exception("共有データの書き出し中にエラーが発生しました。")
@@ -0,0 +1,152 @@
+# instrumentation.py
+#
+# 読み込み・コールバックの各段階の処理時間を計測し、Prometheus 形式の /metrics で公開する
+# 環境変数 APP_VERBOSE=0 で、開発用の print 出力と DEBUG ログを止める（本番向け）
+
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+# 開発用の詳細な出力（print と DEBUG ログ）を出すかどうか
+VERBOSE = os.environ.get('APP_VERBOSE', '1').lower() not in ('0', 'false', 'no', 'off')
+
+# ヒストグラムの区切り [秒]・[バイト]
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7)
+
+DURATION_METRIC = 'census_map_stage_duration_seconds'
+RESPONSE_SIZE_METRIC = 'census_map_callback_response_bytes'
+
+
+def echo(*args, **kwargs):
+    # 開発用の print（APP_VERBOSE=0 のときは何もしない）
+    if VERBOSE:
+        print(*args, **kwargs)
+
+
+def log_level():
+    return logging.DEBUG if VERBOSE else logging.INFO
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (メトリクス名, ラベル名, ラベルの値) -> Histogram
+        self._histograms = {}
+        self._help = {
+            DURATION_METRIC: 'Duration of loader and callback stages.',
+            RESPONSE_SIZE_METRIC: 'Size of serialized callback responses.',
+        }
+
+    def observe(self, metric, label, value, observed, buckets=DURATION_BUCKETS):
+        key = (metric, label, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(observed)
+
+    def snapshot(self, metric=DURATION_METRIC):
+        # ラベルの値 -> (回数, 合計) の辞書（ベンチマークの集計用）
+        with self._lock:
+            return {value: (histogram.count, histogram.total)
+                    for (name, _, value), histogram in self._histograms.items() if name == metric}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        # Prometheus のテキスト形式
+        lines = []
+        with self._lock:
+            items = sorted(self._histograms.items())
+            for metric in sorted({key[0] for key, _ in items}):
+                lines.append(f"# HELP {metric} {self._help.get(metric, metric)}")
+                lines.append(f"# TYPE {metric} histogram")
+                for (name, label, value), histogram in items:
+                    if name != metric:
+                        continue
+                    labels = f'{label}="{escape_label(value)}"'
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+                    lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{metric}_sum{{{labels}}} {histogram.total:.6f}')
+                    lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# プロセス全体で共有するメトリクス
+_registry = MetricsRegistry()
+
+
+def get_metrics():
+    return _registry
+
+
+@contextmanager
+def span(stage):
+    # with span('loader.shapefile_read'): ... の処理時間をヒストグラムに記録する
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _registry.observe(DURATION_METRIC, 'stage', stage, elapsed)
+        if VERBOSE:
+            logging.debug(f"[span] {stage}: {elapsed * 1000:.1f} ms")
+
+
+def mark_callback_done(callback_name):
+    # コールバックの計算が終わった時刻を記録する（応答のシリアライズ時間は after_request で測る）
+    try:
+        from flask import g, has_request_context
+    except ImportError:
+        return
+    if has_request_context():
+        g.instrumented_callback = (callback_name, time.perf_counter())
+
+
+def register_metrics_route(server):
+    from flask import g
+
+    @server.after_request
+    def record_serialization(response):
+        done = getattr(g, 'instrumented_callback', None)
+        if done is not None:
+            callback_name, finished = done
+            _registry.observe(DURATION_METRIC, 'stage', f'{callback_name}.serialize', time.perf_counter() - finished)
+            if not response.direct_passthrough:
+                _registry.observe(RESPONSE_SIZE_METRIC, 'callback', callback_name,
+                                  response.calculate_content_length() or 0, SIZE_BUCKETS)
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return server.response_class(_registry.render(), mimetype='text/plain; version=0.0.4')
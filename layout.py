@@ -2,6 +2,8 @@
 
 import os
 from dash import dcc, html
+from variables import custom_variable_options
+from data_watcher import DATA_WATCH_INTERVAL
 
 # 変数オプションの定義（そのまま）
 
@@ -53,19 +55,22 @@ variable_options = {
     "女性 75歳以上": "female_age_over_75"
 }
 
+# variables.json で定義した独自の年齢区分
+variable_options.update(custom_variable_options())
+
 # スクリプトのディレクトリ（layout.pyが存在するディレクトリ）を取得
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
-# dataディレクトリのパスを設定
-data_dir = os.path.join(script_dir, 'data')
+# dataディレクトリのパスを設定（環境変数 MUNICIPALITY_DATA_DIR で変更可能）
+data_dir = os.environ.get('MUNICIPALITY_DATA_DIR', os.path.join(script_dir, 'data'))
 
 # dataディレクトリが存在するか確認
 if not os.path.exists(data_dir):
     raise FileNotFoundError(f"データディレクトリが見つかりません: {data_dir}")
 
 # ディレクトリ内のフォルダ名を取得（ファイルを除外）
-city_list = [name for name in os.listdir(data_dir)
-             if os.path.isdir(os.path.join(data_dir, name)) and not name.startswith('.')]
+city_list = sorted(name for name in os.listdir(data_dir)
+                   if os.path.isdir(os.path.join(data_dir, name)) and not name.startswith('.'))
 
 # ドロップダウンのオプションを生成
 city_options = [{'label': city, 'value': city} for city in city_list]
@@ -87,6 +92,8 @@ layout = html.Div([
             style={'width': '90%'},
             multi=True  # 複数選択を有効にする
         ),
+        # データディレクトリの市区町村の追加・削除を選択肢に反映するための定期確認（DATA_WATCH_INTERVAL=0 で無効）
+        dcc.Interval(id='data_watch', interval=max(DATA_WATCH_INTERVAL, 1) * 1000, disabled=DATA_WATCH_INTERVAL <= 0),
 
         dcc.Dropdown(
             id='variable',
@@ -98,10 +105,22 @@ layout = html.Div([
             style={'width': '90%'}
         ),
 
-        dcc.Graph(id='barPlot', style={'height': '640px', 'margin-left': '-50px'})
+        dcc.Graph(id='barPlot', style={'height': '640px', 'margin-left': '-50px'}),
+
+        # 地図をクリックした町丁目を中心とする商圏（半径[m]）の推計人口
+        html.Div([
+            html.Label('商圏の半径(m)', htmlFor='catchment_radius'),
+            dcc.Input(id='catchment_radius', type='number', value=1000, min=100, max=10000, step=100,
+                      debounce=True, style={'width': '80px', 'margin-left': '8px'}),
+            html.Div(id='catchment_output')
+        ], style={'width': '90%'})
     ], style={'width': '20%', 'display': 'inline-block', 'verticalAlign': 'top',}),
 
     html.Div([
-        dcc.Graph(id='mapPlot', style={'height': '700px', 'width': '100%'})
+        # バックグラウンドで地図を作っている間の市区町村の読み込みの進み具合（BACKGROUND_CALLBACKS=1 のときのみ表示）
+        html.Progress(id='map_progress', value=0, max=1, style={'display': 'none', 'width': '100%'}),
+        dcc.Graph(id='mapPlot', style={'height': '700px', 'width': '100%'}),
+        # 地図に描画済みの市区町村とデータの版数（変数の切り替え時に色だけを送るため）
+        dcc.Store(id='map_state')
     ], style={'width': '80%', 'display': 'inline-block', 'verticalAlign': 'top','margin-left': '-50px'})
 ])
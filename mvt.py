@@ -0,0 +1,214 @@
+# mvt.py
+#
+# Mapbox Vector Tile（MVT 2.1、Protocol Buffers）の最小限のエンコーダーとデコーダー
+# ポリゴンと、文字列・数値のプロパティだけを扱う（tiles.py のタイル生成・配信で使う）
+
+import numpy as np
+
+EXTENT = 4096
+
+# ジオメトリの種類とコマンド
+POLYGON = 3
+MOVE_TO = 1
+LINE_TO = 2
+CLOSE_PATH = 7
+
+# Protocol Buffers のワイヤー型
+VARINT = 0
+FIXED64 = 1
+LENGTH = 2
+
+
+def encode_varints(values):
+    # 符号なし整数の配列をまとめて varint のバイト列にする
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b''
+    shifts = np.arange(10, dtype=np.uint64) * np.uint64(7)
+    groups = (values[:, None] >> shifts) & np.uint64(0x7f)
+    lengths = np.maximum(1, 10 - np.argmax(np.flip(groups != 0, axis=1), axis=1))
+    lengths[(groups == 0).all(axis=1)] = 1
+    used = np.arange(10) < lengths[:, None]
+    more = np.arange(10) < (lengths - 1)[:, None]
+    groups = groups | (more.astype(np.uint64) << np.uint64(7))
+    return groups[used].astype(np.uint8).tobytes()
+
+
+def varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def field(number, wire_type, payload):
+    key = varint((number << 3) | wire_type)
+    if wire_type == LENGTH:
+        return key + varint(len(payload)) + payload
+    return key + payload
+
+
+def ring_area(coords):
+    # タイル座標（y は下向き）での符号付き面積の2倍
+    x, y = coords[:, 0], coords[:, 1]
+    return float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+
+
+def encode_polygon(polygon, cursor):
+    # タイル座標（整数）のポリゴン1つをコマンド列にする。外周は面積が正、穴は負の向きにそろえる
+    commands = []
+    for index, ring in enumerate([polygon.exterior, *polygon.interiors]):
+        coords = np.asarray(ring.coords)[:-1]
+        coords = np.rint(coords).astype(np.int64)
+        # 丸めで重なった連続する点を除く
+        keep = np.ones(len(coords), dtype=bool)
+        keep[1:] = (np.diff(coords, axis=0) != 0).any(axis=1)
+        coords = coords[keep]
+        if len(coords) > 1 and (coords[0] == coords[-1]).all():
+            coords = coords[:-1]
+        if len(coords) < 3:
+            if index == 0:
+                return None, cursor
+            continue
+        area = ring_area(np.vstack([coords, coords[:1]]))
+        if area == 0:
+            if index == 0:
+                return None, cursor
+            continue
+        if (area > 0) != (index == 0):
+            coords = coords[::-1]
+        deltas = np.diff(np.vstack([cursor, coords]), axis=0)
+        params = zigzag(deltas).reshape(-1)
+        commands.append(np.concatenate([
+            [MOVE_TO | (1 << 3)], params[:2],
+            [LINE_TO | ((len(coords) - 1) << 3)], params[2:],
+            [CLOSE_PATH | (1 << 3)],
+        ]).astype(np.uint64))
+        cursor = coords[-1]
+    if not commands:
+        return None, cursor
+    return np.concatenate(commands), cursor
+
+
+def encode_geometry(geometry):
+    # Polygon / MultiPolygon（タイル座標）を packed なコマンド列のバイト列にする。描けなければ None
+    # （タイルを配信するだけのサーバーでは shapely を読み込まないよう、ここで読み込む）
+    import shapely
+
+    cursor = np.zeros(2, dtype=np.int64)
+    parts = []
+    for polygon in shapely.get_parts(geometry):
+        if polygon.geom_type != 'Polygon':
+            continue
+        encoded, cursor = encode_polygon(polygon, cursor)
+        if encoded is not None:
+            parts.append(encoded)
+    if not parts:
+        return None
+    return encode_varints(np.concatenate(parts))
+
+
+def encode_value(value):
+    if isinstance(value, str):
+        return field(1, LENGTH, value.encode('utf-8'))
+    if isinstance(value, (bool, np.bool_)):
+        return field(7, VARINT, varint(int(value)))
+    if isinstance(value, (int, np.integer)) and value >= 0:
+        return field(5, VARINT, varint(int(value)))
+    return field(3, FIXED64, np.float64(value).tobytes())
+
+
+def encode_layer(name, features, extent=EXTENT):
+    # features: (id, geometry のバイト列, プロパティの辞書) のリスト
+    keys, values = {}, {}
+    encoded_features = []
+    for feature_id, geometry, properties in features:
+        tags = []
+        for key, value in (properties or {}).items():
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault(value, len(values)))
+        body = field(1, VARINT, varint(int(feature_id)))
+        if tags:
+            body += field(2, LENGTH, encode_varints(tags))
+        body += field(3, VARINT, varint(POLYGON)) + field(4, LENGTH, geometry)
+        encoded_features.append(field(2, LENGTH, body))
+    layer = field(15, VARINT, varint(2)) + field(1, LENGTH, name.encode('utf-8'))
+    layer += b''.join(encoded_features)
+    layer += b''.join(field(3, LENGTH, key.encode('utf-8')) for key in keys)
+    layer += b''.join(field(4, LENGTH, encode_value(value)) for value in values)
+    layer += field(5, VARINT, varint(extent))
+    return layer
+
+
+def encode_tile(layers):
+    # layers: レイヤー名 -> features（encode_layer と同じ形）。地物の無いレイヤーは書かない
+    return b''.join(field(3, LENGTH, encode_layer(name, features)) for name, features in layers.items() if features)
+
+
+def read_varint(data, position):
+    result = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def iter_fields(data):
+    # (フィールド番号, ワイヤー型, 値) を順に返す（LENGTH はバイト列、VARINT は整数）
+    position = 0
+    while position < len(data):
+        key, position = read_varint(data, position)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == VARINT:
+            value, position = read_varint(data, position)
+        elif wire_type == LENGTH:
+            length, position = read_varint(data, position)
+            value = data[position:position + length]
+            position += length
+        elif wire_type == FIXED64:
+            value = data[position:position + 8]
+            position += 8
+        elif wire_type == 5:
+            value = data[position:position + 4]
+            position += 4
+        else:
+            raise ValueError(f"Unsupported wire type: {wire_type}")
+        yield number, wire_type, value
+
+
+def decode_features(tile):
+    # タイルの全レイヤーの地物を (レイヤー名, id, ジオメトリのバイト列) で返す（プロパティは読まない）
+    features = []
+    for number, _, layer in iter_fields(memoryview(tile)):
+        if number != 3:
+            continue
+        name = None
+        layer_features = []
+        for layer_number, _, value in iter_fields(layer):
+            if layer_number == 1:
+                name = bytes(value).decode('utf-8')
+            elif layer_number == 2:
+                feature_id, geometry = None, None
+                for feature_number, _, feature_value in iter_fields(value):
+                    if feature_number == 1:
+                        feature_id = feature_value
+                    elif feature_number == 4:
+                        geometry = bytes(feature_value)
+                layer_features.append((feature_id, geometry))
+        features.extend((name, feature_id, geometry) for feature_id, geometry in layer_features)
+    return features
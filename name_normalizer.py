@@ -0,0 +1,62 @@
+# name_normalizer.py
+#
+# 市区町村名・町名の表記ゆれをそろえる（全角・半角、スペース、丁目の数字の統一）
+
+import re
+import pandas as pd
+
+# 全角数字を半角数字に変換する変換表（毎回作り直さないようにモジュール読み込み時に作成）
+ZENKAKU_TO_HANKAKU = str.maketrans('０１２３４５６７８９', '0123456789')
+
+# 全角スペース・半角スペースを削除する変換表
+REMOVE_SPACES = str.maketrans('', '', '　 ')
+
+# 「N丁目」の数字部分を一度の置換で漢数字に変換する
+CHOME_PATTERN = re.compile(r'(\d+)丁目')
+
+KANJI_DIGITS = ['零', '一', '二', '三', '四', '五', '六', '七', '八', '九']
+KANJI_UNITS = [(1000, '千'), (100, '百'), (10, '十')]
+
+
+def number_to_kanji(number):
+    # 21 -> 二十一、100 -> 百 のように位取りの漢数字に変換
+    if number == 0:
+        return KANJI_DIGITS[0]
+    text = ''
+    for unit, unit_kanji in KANJI_UNITS:
+        digit, number = divmod(number, unit)
+        if digit:
+            text += ('' if digit == 1 else KANJI_DIGITS[digit]) + unit_kanji
+    if number:
+        text += KANJI_DIGITS[number]
+    return text
+
+
+def _chome_to_kanji(match):
+    number = int(match.group(1))
+    if number >= 10000:
+        return match.group(0)
+    return number_to_kanji(number) + '丁目'
+
+
+def preprocess_name(name):
+    # 1件分の名前を正規化する（normalize_names と同じ結果）
+    if pd.isnull(name):
+        return ''
+    name = str(name).strip().translate(REMOVE_SPACES).translate(ZENKAKU_TO_HANKAKU)
+    return CHOME_PATTERN.sub(_chome_to_kanji, name).lower()
+
+
+def normalize_names(names):
+    # Series 全体を列単位の文字列処理で正規化する
+    names = pd.Series(names)
+    normalized = (
+        names.where(names.notna(), '')
+        .astype(str)
+        .str.strip()
+        .str.translate(REMOVE_SPACES)
+        .str.translate(ZENKAKU_TO_HANKAKU)
+        .str.replace(CHOME_PATTERN, _chome_to_kanji, regex=True)
+        .str.lower()
+    )
+    return normalized
@@ -0,0 +1,273 @@
+# parallel_loader.py
+#
+# 複数の市区町村をプロセスプールで同時に読み込む
+# シェイプファイルの解析や座標変換はCPU負荷が高く、スレッドでは並列化できないためプロセスを使う
+
+import os
+import hashlib
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from data_loader import (
+    get_source_signature, get_cached_municipality_data, store_municipality_data,
+    read_municipality_data, load_municipality_data,
+)
+from bundle import describe_sources
+
+# ワーカー数（0 または 1 なら常に呼び出し元のプロセスで読み込む）
+MAX_WORKERS = int(os.environ.get('LOADER_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# プロセス間で読み込みを共有するときのロックと受け渡し用ファイルの置き場所（None なら共有しない）
+# バックグラウンドのコールバックのジョブは fork された別プロセスで動くので、サーバーのプロセスと
+# 同じ市区町村を二重に読み込まないよう、市区町村ごとのファイルロックを取った側だけが読み込み、
+# 読み込んだデータを GeoParquet（bundle.py と同じ形式）に書き出して他方はそれを読む
+_shared_dir = None
+
+
+def enable_shared_loads(directory):
+    global _shared_dir
+    _shared_dir = directory
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # サーバーのスレッドを引き継がないよう spawn で起動する
+            _executor = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _reset_after_fork():
+    # fork で作られた子プロセス（バックグラウンドのコールバックなど）は親のプロセスプールを使えない
+    global _executor, _executor_lock, _inflight_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+    _inflight_lock = threading.Lock()
+    _inflight.clear()
+
+
+# 読み込み中の市区町村: 市区町村名 -> (元ファイルのシグネチャ, Future)
+# 同じ市区町村を同時に要求したスレッドは、先に始めた読み込みの完了を待って結果を共有する
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _claim(name, signature):
+    # 読み込み中なら (False, その Future)、そうでなければ自分が読み込む (True, 新しい Future)
+    with _inflight_lock:
+        inflight = _inflight.get(name)
+        if inflight is not None and inflight[0] == signature:
+            return False, inflight[1]
+        future = Future()
+        _inflight[name] = (signature, future)
+        return True, future
+
+
+def _release(name, future):
+    with _inflight_lock:
+        inflight = _inflight.get(name)
+        if inflight is not None and inflight[1] is future:
+            del _inflight[name]
+
+
+def _file_lock(name, blocking=True):
+    # プロセス間の排他（flock）。取れなければ None（blocking=False のとき）
+    import fcntl
+
+    os.makedirs(_lock_dir(), exist_ok=True)
+    fd = os.open(os.path.join(_lock_dir(), f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _file_unlock(fd):
+    import fcntl
+
+    # fork した子プロセスが同じファイル記述子を持っていても解放されるよう、閉じる前に明示的に外す
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def _city_lock(name, blocking=True):
+    # ファイル名に使えない文字を含む市区町村名もあるので、名前のハッシュをロックの名前にする
+    return _file_lock(f"city-{hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]}", blocking)
+
+
+def _lock_dir():
+    return os.path.join(_shared_dir, 'locks')
+
+
+def _handoff_dir():
+    return os.path.join(_shared_dir, 'frames')
+
+
+def _read_handoff(name):
+    # 他のプロセスが読み込んで書き出した市区町村データ（元ファイルと一致する場合のみ）
+    from bundle import load_bundled_municipality
+
+    if not os.path.exists(os.path.join(_handoff_dir(), 'manifest.json')):
+        return None
+    return load_bundled_municipality(name, bundle_dir=_handoff_dir())
+
+
+def _write_handoff(name, map_data_town, sources):
+    from bundle import current_manifest, write_bundle_entry, write_manifest
+
+    os.makedirs(_handoff_dir(), exist_ok=True)
+    entry = write_bundle_entry(name, map_data_town, sources, _handoff_dir())
+    fd = _file_lock('manifest')
+    try:
+        manifest = current_manifest(_handoff_dir())
+        manifest['cities'][name] = entry
+        write_manifest(manifest, _handoff_dir())
+    finally:
+        _file_unlock(fd)
+
+
+def _claim_all(municipality_names):
+    # キャッシュにある市区町村の結果と、自分が読み込む・他のスレッドの読み込みを待つ市区町村に分ける
+    results = {}
+    missing = {}
+    waiting = {}
+    for name in municipality_names:
+        signature = get_source_signature(name)
+        cached = get_cached_municipality_data(name, signature)
+        if cached is not None:
+            results[name] = cached
+            continue
+        owner, future = _claim(name, signature)
+        if owner:
+            missing[name] = (signature, future)
+        else:
+            waiting[name] = (signature, future)
+    return results, missing, waiting
+
+
+def _load_claimed(missing, results, report, locks=None):
+    # 読み込む権利を取った市区町村を読み込み、キャッシュに入れて待っているスレッドに知らせる
+    # 共有モードでは市区町村ごとのファイルロックを取り、他のプロセスが読み込み済みならその結果を読む
+    locks = dict(locks or {})
+    try:
+        pending = dict(missing)
+        if _shared_dir is not None:
+            for name in sorted(pending):
+                if name not in locks:
+                    locks[name] = _city_lock(name)
+            for name, (signature, future) in list(pending.items()):
+                handoff = _read_handoff(name)
+                if handoff is not None:
+                    store_municipality_data(name, signature, handoff)
+                    results[name] = handoff
+                    future.set_result(True)
+                    del pending[name]
+                    report()
+        # 他のプロセスに渡す場合は、加工中にファイルが変わっても古いと判定できるよう先に元ファイルを記録する
+        sources = {name: describe_sources(name) for name in pending} if _shared_dir is not None else {}
+
+        if len(pending) <= 1 or MAX_WORKERS <= 1:
+            for name, (signature, future) in pending.items():
+                results[name] = load_municipality_data(name)
+                if name in sources:
+                    _write_handoff(name, results[name], sources[name])
+                future.set_result(True)
+                report()
+        else:
+            logging.info(f"Loading {len(pending)} municipalities in parallel: {list(pending)}")
+            futures = {name: get_executor().submit(read_municipality_data, name) for name in pending}
+            for name, loading in futures.items():
+                map_data_town = loading.result()
+                store_municipality_data(name, pending[name][0], map_data_town)
+                if name in sources:
+                    _write_handoff(name, map_data_town, sources[name])
+                results[name] = map_data_town
+                pending[name][1].set_result(True)
+                report()
+    except BaseException as e:
+        # 待っている他のスレッドにも同じ例外を伝える
+        for _, future in missing.values():
+            if not future.done():
+                future.set_exception(e)
+        raise
+    finally:
+        for name, (_, future) in missing.items():
+            _release(name, future)
+        for fd in locks.values():
+            if fd is not None:
+                _file_unlock(fd)
+
+
+def load_municipalities(municipality_names, progress=None):
+    # 市区町村名 -> GeoDataFrame の辞書を返す（キャッシュに無いものだけを並列に読み込む）
+    # progress は読み込みが進むたびに (完了数, 全体数) で呼ばれる
+    results, missing, waiting = _claim_all(municipality_names)
+    total = len(municipality_names)
+
+    def report():
+        if progress is not None:
+            progress(len(results), total)
+
+    report()
+    _load_claimed(missing, results, report)
+
+    for name, (signature, future) in waiting.items():
+        # 他のスレッドの読み込みを待ち、キャッシュから自分用のコピーを受け取る
+        # （先読みが他のプロセスに任せた場合などキャッシュに無ければ、改めて読み込む権利を取り直す）
+        future.result()
+        cached = get_cached_municipality_data(name, signature)
+        results[name] = cached if cached is not None else load_municipalities([name])[name]
+        report()
+
+    return {name: results[name] for name in municipality_names}
+
+
+def prefetch_municipalities(municipality_names):
+    # サーバーのプロセスで読み込みを始める（バックグラウンドのジョブを fork する直前に呼ぶ）
+    # 読み込む権利とファイルロックはここで取るので、後から fork されたジョブ・他のスレッドはこの読み込みを待ち、
+    # 読み込んだデータはサーバーのキャッシュに残る（以降のジョブは fork 時にそれを引き継ぐ）
+    if _shared_dir is None:
+        return None
+    _, missing, _ = _claim_all(municipality_names)
+    locks = {}
+    for name in sorted(missing):
+        fd = _city_lock(name, blocking=False)
+        if fd is not None:
+            locks[name] = fd
+            continue
+        # 他のプロセスが読み込み中の市区町村は任せる（このプロセスで待っていたスレッドは権利を取り直す）
+        _, future = missing.pop(name)
+        _release(name, future)
+        future.set_result(True)
+    if not missing:
+        return None
+    logging.info(f"Prefetching municipalities for a background job: {list(missing)}")
+
+    def run():
+        try:
+            _load_claimed(missing, {}, lambda: None, locks)
+        except Exception:
+            logging.exception("市区町村の先読み中にエラーが発生しました。")
+
+    thread = threading.Thread(target=run, name='prefetch', daemon=True)
+    thread.start()
+    return thread
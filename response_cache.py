@@ -0,0 +1,284 @@
+# response_cache.py
+#
+# 地図のコールバック応答（図のJSON）を (市区町村の組, 変数, データの版数) ごとに保持するキャッシュと、
+# Dash のコールバック応答の圧縮（brotli があれば br、無ければ gzip）
+# 同じ市区町村・変数の地図は、図を作り直さずに圧縮済みの応答をそのまま返す
+# メモリ上の LRU（合計バイト数で上限）と、FIGURE_CACHE_DIR を設定した場合はディスク上の層を持つ
+
+import os
+import gzip
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from instrumentation import span
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 地図のコールバック（callbacks.update_map）の出力
+MAP_OUTPUT = '..mapPlot.figure...map_state.data..'
+UPDATE_PATH = '/_dash-update-component'
+
+# これより小さい応答は圧縮しない [バイト]
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+_max_mb = float(os.environ.get('FIGURE_CACHE_MAX_MB', '64'))
+_disk_dir = os.environ.get('FIGURE_CACHE_DIR')
+_disk_max_mb = float(os.environ.get('FIGURE_CACHE_DISK_MB', '512'))
+
+
+def figure_key(cities, variable, data_version):
+    return (tuple(sorted(cities)), variable, data_version)
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def accepted_encoding(accept_encoding):
+    # クライアントが受け付ける圧縮方式のうち、使えるものを選ぶ（br を優先）
+    accepted = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+class CachedResponse:
+    # 応答の本体と、圧縮方式ごとの圧縮済みの本体
+    def __init__(self, body, encoded=None):
+        self.body = body
+        self.encoded = dict(encoded or {})
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return len(self.body) + sum(len(data) for data in self.encoded.values())
+
+    def encode(self, encoding):
+        with self._lock:
+            data = self.encoded.get(encoding)
+            if data is None:
+                data = self.encoded[encoding] = compress(self.body, encoding)
+            return data
+
+
+class FigureCache:
+    # メモリ上の LRU（合計バイト数で上限）と、任意のディスク上の層（gzip 済みの本体を保存）
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(json.dumps(key, ensure_ascii=False).encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.json.gz")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._insert(key, entry)
+        return entry
+
+    def put(self, key, body):
+        entry = CachedResponse(body)
+        self._insert(key, entry)
+        if self.disk_dir:
+            self._write_disk(key, entry)
+        return entry
+
+    def _insert(self, key, entry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            # 圧縮済みの本体が後から増えるので、合計は追加のたびに数え直す
+            self._bytes = sum(item.nbytes for item in self._entries.values())
+            while self._entries and self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                encoded = f.read()
+            os.utime(path)
+            return CachedResponse(gzip.decompress(encoded), {'gzip': encoded})
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError) as e:
+            logging.warning(f"Failed to read cached figure {path}: {e}")
+            return None
+
+    def _write_disk(self, key, entry):
+        path = self._disk_path(key)
+        tmp_path = path + f'.tmp{os.getpid()}'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(entry.encode('gzip'))
+            os.replace(tmp_path, path)
+            self._trim_disk()
+        except OSError as e:
+            logging.warning(f"Failed to write cached figure {path}: {e}")
+
+    def _trim_disk(self):
+        # 古い（最後に使われた時刻が古い）ファイルから消して上限内に収める
+        if not self.disk_max_bytes:
+            return
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith('.json.gz'):
+                stat = os.stat(os.path.join(self.disk_dir, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            os.remove(os.path.join(self.disk_dir, name))
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits,
+                    'disk_hits': self.disk_hits, 'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+_figure_cache = FigureCache(int(_max_mb * 1024 * 1024), _disk_dir,
+                            int(_disk_max_mb * 1024 * 1024) if _disk_dir else None)
+
+
+def get_figure_cache():
+    return _figure_cache
+
+
+def mark_figure_cacheable(cities, variable, data_version):
+    # update_map が地図全体を作ったときに呼ぶ（応答の本体は after_request でキャッシュに入れる）
+    from flask import g, has_request_context
+    if has_request_context():
+        g.figure_cache_key = figure_key(cities, variable, data_version)
+
+
+def map_inputs(body):
+    # 地図のコールバックへのリクエストなら (市区町村のリスト, 変数)、それ以外は None
+    if not isinstance(body, dict) or body.get('output') != MAP_OUTPUT:
+        return None
+    inputs = {item['id']: item.get('value') for item in body.get('inputs', [])}
+    cities, variable = inputs.get('city_selection'), inputs.get('variable')
+    if not cities or not variable:
+        return None
+    if isinstance(cities, str):
+        cities = [cities]
+    return cities, variable
+
+
+def map_request_key(body):
+    # 地図のコールバックへのリクエストから、キャッシュを引けるならキーを返す
+    # 変数だけが変わって色の差分（Patch）で済む場合は、コールバックに任せる
+    from data_loader import get_data_version
+
+    parsed = map_inputs(body)
+    if parsed is None:
+        return None
+    cities, variable = parsed
+    state = {item['id']: item.get('value') for item in body.get('state', [])}.get('map_state')
+    data_version = get_data_version(sorted(cities))
+    if ('variable.value' in body.get('changedPropIds', []) and state
+            and state.get('cities') == sorted(cities) and state.get('version') == data_version):
+        return None
+    return figure_key(cities, variable, data_version)
+
+
+def store_background_result(body, response):
+    # バックグラウンド実行した地図の結果（地図全体を作り直したもの）を、通常の応答の形でキャッシュに入れる
+    from data_loader import get_data_version
+
+    parsed = map_inputs(body)
+    if parsed is None:
+        return None
+    payload = json.loads(response.get_data())
+    result = payload.get('response') if isinstance(payload, dict) else None
+    if not result or 'mapPlot' not in result or not result.get('map_state', {}).get('data'):
+        return None
+    cities, variable = parsed
+    key = figure_key(cities, variable, get_data_version(sorted(cities)))
+    return _figure_cache.put(key, json.dumps({'multi': True, 'response': result}).encode('utf-8'))
+
+
+def register_response_cache(server):
+    from flask import g, request
+
+    @server.before_request
+    def serve_cached_figure():
+        # バックグラウンド実行の結果の問い合わせ（cacheKey 付き）はそのまま Dash に渡す
+        if request.path != UPDATE_PATH or request.method != 'POST' or request.args.get('cacheKey'):
+            return None
+        try:
+            key = map_request_key(request.get_json(silent=True))
+        except (FileNotFoundError, KeyError, TypeError):
+            return None
+        if key is None:
+            return None
+        with span('update_map.cache_lookup'):
+            entry = _figure_cache.get(key)
+        if entry is None:
+            return None
+        g.cached_response = entry
+        return server.response_class(entry.body, mimetype='application/json')
+
+    @server.after_request
+    def store_and_compress(response):
+        if request.path != UPDATE_PATH or response.direct_passthrough or response.status_code != 200:
+            return response
+        entry = getattr(g, 'cached_response', None)
+        key = getattr(g, 'figure_cache_key', None)
+        if entry is None and key is not None:
+            entry = _figure_cache.put(key, response.get_data())
+        elif entry is None and request.args.get('cacheKey'):
+            entry = store_background_result(request.get_json(silent=True), response)
+        encoding = accepted_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None or response.headers.get('Content-Encoding'):
+            return response
+        if entry is not None:
+            data = entry.encode(encoding)
+        elif response.calculate_content_length() and response.calculate_content_length() >= MIN_COMPRESS_BYTES:
+            data = compress(response.get_data(), encoding)
+        else:
+            return response
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
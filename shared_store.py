@@ -0,0 +1,230 @@
+# shared_store.py
+#
+# gunicorn の複数ワーカーで市区町村データを共有するための、メモリマップ用ファイルの書き出しと読み込み
+# 親プロセス（gunicorn.conf.py の on_starting）またはビルド手順で一度だけ書き出し、
+# 各ワーカーは NumPy のメモリマップとして開くだけにする（人数の列と座標はコピーせずに参照する）
+# 使い方: python shared_store.py build [--cities 大東市 東大阪市] [--output shared]
+#
+# 市区町村ごとのディレクトリ（<出力先>/<市区町村名>/<データの版数>/）の中身:
+#   counts.npy, counts_missing.npy  人数の列（町丁目 × 列、列ごとに連続した配列）と欠損の印
+#   codes.npy, codes_missing.npy    KEY_CODE・HYOSYO
+#   names.arrow                      city_town_key・市区町村名・町名（Arrow IPC）
+#   coords.npy, offsets_*.npy, single.npy  ジオメトリ（slim.PackedGeometry と同じ形式）
+#   meta.json                        列名・型・CRS・データの版数など
+
+import os
+import json
+import shutil
+import threading
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.ipc
+from slim import PackedGeometry, pack_geometry
+from census_reader import COUNT_LABELS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARED_DIR = os.environ.get('SHARED_DATA_DIR', os.path.join(BASE_DIR, "shared"))
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+NAME_COLUMNS = ['city_town_key', 'CITY_NAME', 'S_NAME']
+CODE_COLUMNS = {'KEY_CODE': 'Int64', 'HYOSYO': 'Int8'}
+
+# ワーカー内で開いたメモリマップ: 市区町村名 -> (データの版数, 配列一式)
+_attached = {}
+_lock = threading.Lock()
+
+
+def read_manifest(shared_dir=SHARED_DIR):
+    manifest_path = os.path.join(shared_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(manifest, shared_dir=SHARED_DIR):
+    manifest_path = os.path.join(shared_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def write_municipality(frame, directory, data_version):
+    # 加工済みの GeoDataFrame（slim_frame の出力）をメモリマップ用のファイルに書き出す
+    count_columns = [column for column in COUNT_LABELS if column in frame.columns]
+    counts = frame[count_columns]
+    fits_uint16 = all(str(dtype) == 'UInt16' for dtype in counts.dtypes)
+    count_dtype = np.uint16 if fits_uint16 else np.uint32
+    np.save(os.path.join(directory, 'counts.npy'),
+            np.asfortranarray(counts.fillna(0).to_numpy(dtype=count_dtype)))
+    np.save(os.path.join(directory, 'counts_missing.npy'), np.asfortranarray(counts.isna().to_numpy()))
+
+    code_columns = [column for column in CODE_COLUMNS if column in frame.columns]
+    codes = frame[code_columns]
+    np.save(os.path.join(directory, 'codes.npy'), np.asfortranarray(codes.fillna(0).to_numpy(dtype=np.int64)))
+    np.save(os.path.join(directory, 'codes_missing.npy'), np.asfortranarray(codes.isna().to_numpy()))
+
+    name_columns = [column for column in NAME_COLUMNS if column in frame.columns]
+    table = pa.Table.from_pandas(pd.DataFrame(frame[name_columns]), preserve_index=False)
+    with pa.OSFile(os.path.join(directory, 'names.arrow'), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    packed = pack_geometry(frame.geometry.values)
+    if packed is None:
+        raise ValueError("共有データにはポリゴン（欠損・空を含まない）のみ書き出せます")
+    np.save(os.path.join(directory, 'coords.npy'), packed.coords)
+    for i, offset in enumerate(packed.offsets):
+        np.save(os.path.join(directory, f'offsets_{i}.npy'), offset)
+    np.save(os.path.join(directory, 'single.npy'), packed.single)
+
+    meta = {
+        'data_version': data_version,
+        'rows': int(len(frame)),
+        'columns': [column for column in frame.columns if column != frame.geometry.name],
+        'count_columns': count_columns,
+        'count_dtype': 'UInt16' if fits_uint16 else 'UInt32',
+        'code_columns': code_columns,
+        'name_columns': name_columns,
+        'geometry_name': frame.geometry.name,
+        'geometry_type': int(packed.geometry_type),
+        'offset_count': len(packed.offsets),
+        'origin': packed.origin.tolist(),
+        'crs': frame.crs.to_wkt() if frame.crs is not None else None,
+        'attrs': frame.attrs,
+    }
+    with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, default=float)
+
+
+def build_shared_store(cities=None, shared_dir=SHARED_DIR):
+    # 古い・無い市区町村だけを書き出す（版数ごとのディレクトリに書いてから manifest を差し替える）
+    from data_loader import get_data_version, read_municipality_data, PIPELINE_VERSION
+    from bundle import list_municipalities
+
+    os.makedirs(shared_dir, exist_ok=True)
+    manifest = read_manifest(shared_dir)
+    if manifest is None or manifest.get('pipeline_version') != PIPELINE_VERSION:
+        manifest = {'version': MANIFEST_VERSION, 'pipeline_version': PIPELINE_VERSION, 'cities': {}}
+    cities = cities or list_municipalities()
+
+    for city in cities:
+        data_version = get_data_version([city])
+        entry = manifest['cities'].get(city)
+        if entry is not None and entry['data_version'] == data_version \
+                and os.path.exists(os.path.join(shared_dir, entry['path'], 'meta.json')):
+            continue
+        logging.info(f"Writing shared data for {city}")
+        print(f"Writing shared data for {city}")
+        rel_path = os.path.join(city, data_version)
+        directory = os.path.join(shared_dir, rel_path)
+        tmp_directory = directory + f'.tmp{os.getpid()}'
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+        write_municipality(read_municipality_data(city), tmp_directory, data_version)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_directory, directory)
+        manifest['cities'][city] = {'path': rel_path, 'data_version': data_version}
+        write_manifest(manifest, shared_dir)
+        remove_old_versions(os.path.join(shared_dir, city), keep=data_version)
+
+    write_manifest(manifest, shared_dir)
+    return manifest
+
+
+def remove_old_versions(city_dir, keep):
+    # 古い版は削除する（開いたままのワーカーは、Linux では削除後もそのまま読める）
+    for name in os.listdir(city_dir):
+        if name != keep:
+            shutil.rmtree(os.path.join(city_dir, name), ignore_errors=True)
+
+
+def _load_arrays(directory):
+    with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+
+    def mapped(name):
+        return np.load(os.path.join(directory, name), mmap_mode='r')
+
+    with pa.memory_map(os.path.join(directory, 'names.arrow'), 'r') as source:
+        names = pa.ipc.open_file(source).read_all().to_pandas()
+    geometry = PackedGeometry.from_arrays(
+        meta['geometry_type'], meta['origin'], mapped('coords.npy'),
+        [mapped(f'offsets_{i}.npy') for i in range(meta['offset_count'])], mapped('single.npy'),
+    )
+    return {
+        'meta': meta,
+        'counts': mapped('counts.npy'),
+        'counts_missing': mapped('counts_missing.npy'),
+        'codes': mapped('codes.npy'),
+        'codes_missing': mapped('codes_missing.npy'),
+        'names': names,
+        'geometry': geometry,
+    }
+
+
+def attach_municipality(municipality_name, shared_dir=SHARED_DIR):
+    # 共有データが現在の元ファイルと一致する場合のみ GeoDataFrame を返す。それ以外は None
+    from data_loader import get_data_version
+
+    data_version = get_data_version([municipality_name])
+    with _lock:
+        attached = _attached.get(municipality_name)
+    if attached is None or attached[0] != data_version:
+        manifest = read_manifest(shared_dir)
+        entry = manifest['cities'].get(municipality_name) if manifest else None
+        if entry is None or entry['data_version'] != data_version:
+            logging.debug(f"Shared data for {municipality_name} is missing or stale.")
+            return None
+        attached = (data_version, _load_arrays(os.path.join(shared_dir, entry['path'])))
+        with _lock:
+            _attached[municipality_name] = attached
+    return shared_frame(attached[1])
+
+
+def shared_frame(arrays):
+    # 人数・コードの列はメモリマップを参照する拡張配列、ジオメトリは呼び出しごとに復元する
+    meta = arrays['meta']
+    columns = {column: arrays['names'][column] for column in meta['name_columns']}
+    array_type = pd.arrays.IntegerArray
+    for i, column in enumerate(meta['code_columns']):
+        values = arrays['codes'][:, i].astype(np.dtype(CODE_COLUMNS[column].lower()), copy=False)
+        columns[column] = array_type(values, arrays['codes_missing'][:, i])
+    for i, column in enumerate(meta['count_columns']):
+        columns[column] = array_type(arrays['counts'][:, i], arrays['counts_missing'][:, i])
+    frame = pd.DataFrame({column: columns[column] for column in meta['columns'] if column in columns}, copy=False)
+    frame[meta['geometry_name']] = gpd.array.from_shapely(arrays['geometry'].unpack(), crs=meta['crs'])
+    result = gpd.GeoDataFrame(frame, geometry=meta['geometry_name'], copy=False)
+    result.attrs = dict(meta['attrs'])
+    return result
+
+
+def detach_all():
+    with _lock:
+        _attached.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ワーカー間で共有する市区町村データを書き出します。")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="data/ 以下の市区町村を共有データに書き出す")
+    build_parser.add_argument('--cities', nargs='*', help="対象の市区町村（省略時は全て）")
+    build_parser.add_argument('--output', default=SHARED_DIR, help="出力先ディレクトリ")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(message)s')
+    if args.command == 'build':
+        build_shared_store(cities=args.cities, shared_dir=args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# slim.py
+#
+# 結合済みの市区町村データを、アプリが読む列だけ・小さい型に絞り込む
+# ワーカーごとに全市区町村をキャッシュするため、1市区町村あたりのメモリ量を減らす
+
+import numpy as np
+import pandas as pd
+import shapely
+from census_reader import COUNT_LABELS
+
+# アプリが読む列（これ以外のシェイプファイルの列は結合後には使わない）
+KEEP_COLUMNS = ['city_town_key', 'KEY_CODE', 'HYOSYO', 'CITY_NAME', 'S_NAME'] + COUNT_LABELS
+
+# 市区町村名・町名はカテゴリ型にする
+CATEGORY_COLUMNS = ['CITY_NAME', 'S_NAME']
+
+# 人数の列は欠損（国勢調査と結合できなかった町丁目）を保てる符号なし整数型にする
+UINT16_MAX = np.iinfo(np.uint16).max
+
+
+def count_dtype(series):
+    return 'UInt16' if series.max(skipna=True) <= UINT16_MAX else 'UInt32'
+
+
+def slim_frame(gdf):
+    # 不要な列を落とし、人数を整数型、名前をカテゴリ型にした GeoDataFrame を返す
+    geometry_column = gdf.geometry.name
+    columns = [column for column in KEEP_COLUMNS if column in gdf.columns] + [geometry_column]
+    slim = gdf[columns].copy()
+    for column in COUNT_LABELS:
+        if column in slim.columns:
+            counts = pd.to_numeric(slim[column], errors='coerce')
+            slim[column] = counts.astype(count_dtype(counts)) if counts.notna().any() else counts.astype('UInt16')
+    if 'KEY_CODE' in slim.columns:
+        slim['KEY_CODE'] = slim['KEY_CODE'].astype('Int64')
+    if 'HYOSYO' in slim.columns:
+        slim['HYOSYO'] = slim['HYOSYO'].astype('Int8')
+    for column in CATEGORY_COLUMNS:
+        if column in slim.columns:
+            slim[column] = slim[column].astype('category')
+    slim.attrs = dict(gdf.attrs)
+    return slim
+
+
+class PackedGeometry:
+    # ポリゴンの座標を「原点（float64）からの差分（float32）」の連続した配列で持つ
+    # 差分を float32 にした誤差は最大で float32 の刻みの半分: 原点から0.5度未満なら約1.7mm、1度未満なら約3.3mm
+    # （同梱の市区町村（差分 0.03～0.2度）では実測 0.1～0.8mm。地図の表示・町丁目の判定には影響しない）
+    def __init__(self, geometries):
+        geometries = np.asarray(geometries, dtype=object)
+        geometry_type, coords, offsets = shapely.to_ragged_array(geometries)
+        self.geometry_type = geometry_type
+        self.origin = coords.min(axis=0) if len(coords) else np.zeros(2)
+        self.coords = (coords - self.origin).astype(np.float32)
+        self.offsets = tuple(offset.astype(np.int32) for offset in offsets)
+        # MultiPolygon にそろえられた単一ポリゴンを元に戻すための印
+        self.single = shapely.get_type_id(geometries) == shapely.GeometryType.POLYGON
+
+    @classmethod
+    def from_arrays(cls, geometry_type, origin, coords, offsets, single):
+        # 書き出し済みの配列（メモリマップでも可）から、コピーせずに組み立てる
+        packed = cls.__new__(cls)
+        packed.geometry_type = shapely.GeometryType(geometry_type)
+        packed.origin = np.asarray(origin, dtype=np.float64)
+        packed.coords = coords
+        packed.offsets = tuple(offsets)
+        packed.single = single
+        return packed
+
+    @property
+    def nbytes(self):
+        return self.coords.nbytes + sum(offset.nbytes for offset in self.offsets) + self.single.nbytes
+
+    def unpack(self):
+        coords = self.coords.astype(np.float64) + self.origin
+        geometries = shapely.from_ragged_array(self.geometry_type, coords, self.offsets)
+        if self.geometry_type == shapely.GeometryType.MULTIPOLYGON and self.single.any():
+            geometries[self.single] = shapely.get_geometry(geometries[self.single], 0)
+        return geometries
+
+
+def pack_geometry(geometries):
+    # 欠損・空・ポリゴン以外を含む場合はまとめられないので None（そのまま保持する）
+    geometries = np.asarray(geometries, dtype=object)
+    if len(geometries) == 0 or shapely.is_missing(geometries).any() or shapely.is_empty(geometries).any():
+        return None
+    types = shapely.get_type_id(geometries)
+    if not np.isin(types, [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON]).all():
+        return None
+    return PackedGeometry(geometries)
+
+
+def geometry_bytes(geometries):
+    # shapely のジオメトリが持つ座標の概算（x, y の倍精度）
+    return int(shapely.get_num_coordinates(np.asarray(geometries, dtype=object)).sum()) * 16
+
+
+def memory_report(gdf):
+    # 属性列とジオメトリのメモリ量（バイト）
+    attributes = int(gdf.drop(columns=[gdf.geometry.name]).memory_usage(deep=True, index=True).sum())
+    geometry = geometry_bytes(gdf.geometry.values)
+    return {'rows': len(gdf), 'attribute_bytes': attributes, 'geometry_bytes': geometry,
+            'total_bytes': attributes + geometry}
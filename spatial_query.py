@@ -0,0 +1,153 @@
+# spatial_query.py
+#
+# 緯度経度の点がどの町丁目（city_town_key）に含まれるかを、STRtree でまとめて判定する
+# 顧客・生徒の住所などの点データを国勢調査の地図に重ねるために使う
+# 使い方: python spatial_query.py points.csv [--cities 高槻市 東大阪市] [--lat lat --lon lon] [--output out.csv]
+
+import sys
+import argparse
+import threading
+import logging
+import numpy as np
+import pandas as pd
+import shapely
+from data_loader import get_data_version
+from parallel_loader import load_municipalities
+
+
+class SpatialIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 市区町村ごとの (データの版数, city_town_key の配列, ジオメトリの配列)
+        self._cities = {}
+        # 登録済みの全市区町村をまとめた (木, city_town_key の配列, 市区町村名の配列) の組
+        # （登録のたびに作り直し、1回の代入で丸ごと差し替える。locate はロックを取らずに組を1回だけ読む）
+        self._state = (None, np.empty(0, dtype=object), np.empty(0, dtype=object))
+
+    def register(self, municipality_name, data_version, frame):
+        # 地図と同じ EPSG:4326 の座標で登録する
+        if frame.crs is not None and frame.crs != "EPSG:4326":
+            frame = frame.to_crs(epsg=4326)
+        keys = frame['city_town_key'].to_numpy(dtype=object)
+        geometries = np.asarray(frame.geometry.values, dtype=object)
+        with self._lock:
+            current = self._cities.get(municipality_name)
+            if current is not None and current[0] == data_version:
+                return
+            self._cities[municipality_name] = (data_version, keys, geometries)
+            self._rebuild()
+
+    def _rebuild(self):
+        entries = list(self._cities.items())
+        if not entries:
+            self._state = (None, np.empty(0, dtype=object), np.empty(0, dtype=object))
+            return
+        geometries = np.concatenate([geoms for _, (_, _, geoms) in entries])
+        keys = np.concatenate([keys for _, (_, keys, _) in entries])
+        owners = np.concatenate([np.full(len(keys), name, dtype=object) for name, (_, keys, _) in entries])
+        self._state = (shapely.STRtree(geometries), keys, owners)
+
+    def is_current(self, municipality_name, data_version):
+        entry = self._cities.get(municipality_name)
+        return entry is not None and entry[0] == data_version
+
+    def municipalities(self):
+        return list(self._cities)
+
+    def locate(self, lat, lon, municipality_names=None):
+        # 各点の city_town_key を返す（どの町丁目にも含まれない点は None）
+        # 境界上の点は接する町丁目のうち登録順で最初のものにする
+        tree, keys, owners = self._state
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        result = np.full(len(lat), None, dtype=object)
+        if tree is None or len(lat) == 0:
+            return result
+
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        point_index = np.flatnonzero(valid)
+        points = shapely.points(lon[valid], lat[valid])
+        hits, town_rows = tree.query(points, predicate='intersects')
+        if municipality_names is not None:
+            allowed = np.isin(owners[town_rows], list(municipality_names))
+            hits, town_rows = hits[allowed], town_rows[allowed]
+        if len(hits) == 0:
+            return result
+
+        # query の結果は点の番号順に並ぶので、点ごとに最初の1件を採る
+        order = np.lexsort((town_rows, hits))
+        hits, town_rows = hits[order], town_rows[order]
+        first = np.ones(len(hits), dtype=bool)
+        first[1:] = hits[1:] != hits[:-1]
+        result[point_index[hits[first]]] = keys[town_rows[first]]
+        return result
+
+    def remove(self, municipality_name):
+        with self._lock:
+            if self._cities.pop(municipality_name, None) is not None:
+                self._rebuild()
+
+
+# プロセス全体で共有する索引
+_spatial_index = SpatialIndex()
+
+
+def get_spatial_index():
+    return _spatial_index
+
+
+def register_municipality(municipality_name, frame, data_version=None):
+    if data_version is None:
+        data_version = get_data_version([municipality_name])
+    _spatial_index.register(municipality_name, data_version, frame)
+
+
+def ensure_indexed(municipality_names):
+    # 索引が無い・古くなった市区町村だけを（並列に）読み込んで登録する
+    versions = {name: get_data_version([name]) for name in municipality_names}
+    stale = [name for name, data_version in versions.items() if not _spatial_index.is_current(name, data_version)]
+    if not stale:
+        return
+    logging.debug(f"Building spatial index for {stale}")
+    for name, frame in load_municipalities(stale).items():
+        register_municipality(name, frame, versions[name])
+
+
+def locate_points(lat, lon, municipality_names=None):
+    # municipality_names を指定すると、その市区町村を読み込んでから判定し、結果もその範囲に限る
+    if municipality_names is not None:
+        ensure_indexed(municipality_names)
+    return _spatial_index.locate(lat, lon, municipality_names)
+
+
+def locate_frame(points, municipality_names=None, lat_column='lat', lon_column='lon'):
+    # 点データの DataFrame に city_town_key 列を追加して返す
+    result = points.copy()
+    result['city_town_key'] = locate_points(
+        pd.to_numeric(points[lat_column], errors='coerce').to_numpy(),
+        pd.to_numeric(points[lon_column], errors='coerce').to_numpy(),
+        municipality_names,
+    )
+    return result
+
+
+def main(argv=None):
+    from bundle import list_municipalities
+
+    parser = argparse.ArgumentParser(description="点データ（CSV）に町丁目の city_town_key を付与する")
+    parser.add_argument('points', help="緯度・経度の列を含むCSV")
+    parser.add_argument('--cities', nargs='*', help="対象の市区町村（省略時は全市区町村）")
+    parser.add_argument('--lat', default='lat')
+    parser.add_argument('--lon', default='lon')
+    parser.add_argument('--output', help="出力先（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    points = pd.read_csv(args.points)
+    result = locate_frame(points, args.cities or list_municipalities(), args.lat, args.lon)
+    matched = result['city_town_key'].notna().sum()
+    print(f"{matched}/{len(result)} points matched a town.", file=sys.stderr)
+    result.to_csv(args.output or sys.stdout, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+# tests/conftest.py
+#
+# リポジトリ直下のモジュール（data_loader.py など）をテストから読み込めるようにする
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,55 @@
+# tests/test_bundle.py
+#
+# バンドル（GeoParquet）経由で読み込んでも、加工時に frame.attrs に入れた値が失われないことの確認
+
+import functools
+import pytest
+
+pytest.importorskip('geopandas')
+
+import bundle
+import data_loader
+
+CITY = '大東市'
+
+
+@pytest.fixture
+def bundled(tmp_path, monkeypatch):
+    # 一時ディレクトリにバンドルを作り、ローダーがそこを読むようにする
+    bundle_dir = str(tmp_path / 'bundle')
+    bundle.build_bundle(cities=[CITY], bundle_dir=bundle_dir)
+    monkeypatch.setattr(data_loader, 'load_bundled_municipality',
+                        functools.partial(bundle.load_bundled_municipality, bundle_dir=bundle_dir))
+    monkeypatch.setattr(data_loader, 'LOADING_MODE', 'bundle')
+    data_loader.clear_cache()
+    yield bundle_dir
+    data_loader.clear_cache()
+
+
+def test_bundle_keeps_attrs(bundled):
+    built = data_loader.build_municipality_data(CITY)
+    loaded = bundle.load_bundled_municipality(CITY, bundle_dir=bundled)
+
+    assert loaded is not None
+    assert loaded.attrs['census_match'] == built.attrs['census_match']
+    assert loaded.attrs['extent'] == built.attrs['extent']
+
+
+def test_loader_reads_attrs_from_bundle(bundled, monkeypatch):
+    # 元ファイルからの加工に進んだら失敗させ、バンドルから読んだことを確かめる
+    def no_build(municipality_name):
+        raise AssertionError(f"{municipality_name} was built from raw files")
+
+    monkeypatch.setattr(data_loader, 'build_municipality_data', no_build)
+    map_data_town = data_loader.read_municipality_data(CITY)
+
+    assert set(map_data_town.attrs['census_match']) >= {'code_matched', 'name_matched', 'unmatched', 'match_rate'}
+    assert set(map_data_town.attrs['extent']) == {'bounds', 'centroid', 'area'}
+
+
+def test_match_stats_recorded_for_bundle_load(bundled, monkeypatch):
+    # 元ファイルから加工しないプロセスでも、読み込んだデータの結合結果を返せる
+    monkeypatch.setattr(data_loader, '_match_stats', {})
+    map_data_town = data_loader.load_municipality_data(CITY)
+
+    assert data_loader.get_match_stats(CITY) == map_data_town.attrs['census_match']
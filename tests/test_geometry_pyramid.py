@@ -0,0 +1,39 @@
+# tests/test_geometry_pyramid.py
+#
+# 市区町村ごとに作ったピラミッドでも、隣り合う市区町村を一緒に選んだときに境界に隙間や重なりができないことの確認
+
+import pytest
+
+pytest.importorskip('geopandas')
+
+import numpy as np
+import shapely
+from parallel_loader import load_municipalities
+from geometry_pyramid import PYRAMID_LEVELS, simplify_coverage
+
+NEIGHBOURS = ('東大阪市', '大東市')
+
+
+@pytest.fixture(scope='module')
+def neighbour_geoms():
+    frames = load_municipalities(list(NEIGHBOURS))
+    return [np.asarray(frames[city].to_crs(epsg=4326).geometry.values, dtype=object) for city in NEIGHBOURS]
+
+
+@pytest.mark.parametrize('tolerance', [tolerance for _, tolerance in PYRAMID_LEVELS if tolerance > 0])
+def test_shared_municipal_border_stays_aligned(neighbour_geoms, tolerance):
+    original = [shapely.union_all(geoms) for geoms in neighbour_geoms]
+    simplified = [shapely.union_all(simplify_coverage(geoms, tolerance)) for geoms in neighbour_geoms]
+
+    # 重なりは元データ以上に増えず、2市を合わせた範囲に隙間も無い
+    overlap = shapely.area(shapely.intersection(*simplified))
+    assert overlap <= shapely.area(shapely.intersection(*original)) + 1e-12
+    gap = shapely.area(shapely.difference(shapely.union_all(original), shapely.union_all(simplified)))
+    assert gap < 1e-12
+
+
+@pytest.mark.parametrize('tolerance', [tolerance for _, tolerance in PYRAMID_LEVELS if tolerance > 0])
+def test_interior_edges_are_simplified(neighbour_geoms, tolerance):
+    geoms = neighbour_geoms[0]
+    simplified = simplify_coverage(geoms, tolerance)
+    assert shapely.get_num_coordinates(simplified).sum() < shapely.get_num_coordinates(geoms).sum()
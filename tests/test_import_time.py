@@ -0,0 +1,30 @@
+# tests/test_import_time.py
+#
+# 本番モード（APP_ENV=production）で app.py を `python -X importtime` で読み込み、
+# 読み込み時間が予算（IMPORT_BUDGET_MS、既定 1200 ms）以内であることと、
+# 重いモジュールが起動時に読み込まれていないことを確認する
+# 内訳を見るときは python benchmarks/check_import_time.py を使う
+
+import pytest
+
+pytest.importorskip('dash')
+
+from benchmarks.check_import_time import IMPORT_BUDGET_MS, deferred_imports, measure_median_import
+
+
+@pytest.fixture(scope='module')
+def startup_import():
+    return measure_median_import(repeat=3)
+
+
+def test_heavy_modules_are_deferred(startup_import):
+    _, _, rows = startup_import
+    assert deferred_imports(rows) == []
+
+
+def test_import_time_within_budget(startup_import):
+    total_ms, totals, _ = startup_import
+    assert total_ms <= IMPORT_BUDGET_MS, (
+        f"import app took {total_ms:.1f} ms (runs: {', '.join(f'{t:.1f}' for t in totals)}), "
+        f"budget {IMPORT_BUDGET_MS:.0f} ms"
+    )
@@ -0,0 +1,76 @@
+# tests/test_name_normalizer.py
+#
+# normalize_names が旧来の1行ずつの preprocess_name（benchmarks/bench_normalize.py に残した実装）と
+# 同じ結果になることの確認。旧実装が正しく変換できない21丁目以上は期待値を直接指定する
+
+import os
+import glob
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+from benchmarks.bench_normalize import legacy_preprocess_name, sample_names
+from name_normalizer import CHOME_PATTERN, ZENKAKU_TO_HANKAKU, normalize_names, preprocess_name
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+# data_loader.build_municipality_data が市名・町名として使う列の候補
+CITY_COLUMNS = ['city_name', 'cityname', 'city', 'sityo_name', 'municipality']
+TOWN_COLUMNS = ['s_name', 'moji', 'name', '町名']
+
+
+def within_legacy_range(name):
+    # 旧実装が正しく扱えるのは20丁目まで
+    if pd.isnull(name):
+        return True
+    numbers = CHOME_PATTERN.findall(str(name).translate(ZENKAKU_TO_HANKAKU))
+    return all(int(number) <= 20 for number in numbers)
+
+
+def shapefile_names():
+    pytest.importorskip('geopandas')
+    from data_loader import read_shapefile
+
+    names = []
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, '*', '*.shp'))):
+        frame = read_shapefile(path)
+        frame.columns = frame.columns.str.lower()
+        for candidates in (CITY_COLUMNS, TOWN_COLUMNS):
+            column = next((col for col in candidates if col in frame.columns), None)
+            if column is not None:
+                names.append(frame[column])
+    assert names, "no shapefiles found under data/"
+    return pd.concat(names, ignore_index=True)
+
+
+def assert_matches_legacy(names):
+    names = names[names.map(within_legacy_range)].reset_index(drop=True)
+    expected = names.map(legacy_preprocess_name)
+    actual = normalize_names(names)
+    mismatched = pd.DataFrame({'name': names, 'legacy': expected, 'new': actual})[expected != actual]
+    assert mismatched.empty, mismatched.head(20).to_string()
+
+
+def test_matches_legacy_on_census_names():
+    assert_matches_legacy(sample_names())
+
+
+def test_matches_legacy_on_shapefile_names():
+    assert_matches_legacy(shapefile_names())
+
+
+def test_scalar_matches_vectorized():
+    names = sample_names()
+    assert names.map(preprocess_name).tolist() == normalize_names(names).tolist()
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('本町21丁目', '本町二十一丁目'),
+    ('本町２１丁目', '本町二十一丁目'),
+    ('本町１００丁目', '本町百丁目'),
+    ('本町 30 丁目', '本町三十丁目'),
+    ('東町20丁目', '東町二十丁目'),
+])
+def test_chome_over_twenty(name, expected):
+    assert normalize_names(pd.Series([name])).tolist() == [expected]
+    assert preprocess_name(name) == expected
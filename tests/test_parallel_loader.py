@@ -0,0 +1,88 @@
+# tests/test_parallel_loader.py
+#
+# バックグラウンドのコールバック（fork された別プロセスのジョブ）とサーバーのプロセスが
+# 同じ市区町村を同時に要求しても、元ファイルからの加工は一度だけになることの確認
+
+import multiprocessing
+import pytest
+
+pytest.importorskip('geopandas')
+
+import data_loader
+import parallel_loader
+
+CITY = '大東市'
+TIMEOUT = 300
+
+
+@pytest.fixture
+def shared_loads(tmp_path, monkeypatch):
+    # 加工した市区町村名をファイルに追記する（fork したジョブの中での加工も数える）
+    builds = tmp_path / 'builds.log'
+    build = data_loader.build_municipality_data
+
+    def counting_build(municipality_name):
+        with open(builds, 'a', encoding='utf-8') as f:
+            f.write(municipality_name + '\n')
+        return build(municipality_name)
+
+    monkeypatch.setattr(data_loader, 'build_municipality_data', counting_build)
+    monkeypatch.setattr(data_loader, 'LOADING_MODE', 'raw')
+    monkeypatch.setattr(parallel_loader, 'MAX_WORKERS', 1)
+    parallel_loader.enable_shared_loads(str(tmp_path / 'background'))
+    data_loader.clear_cache()
+    yield lambda: builds.read_text(encoding='utf-8').splitlines() if builds.exists() else []
+    parallel_loader.enable_shared_loads(None)
+    data_loader.clear_cache()
+
+
+def run_job(queue):
+    frames = parallel_loader.load_municipalities([CITY])
+    queue.put(len(frames[CITY]))
+
+
+def start_job():
+    # Dash の DiskcacheManager と同じく、ジョブを fork した子プロセスで動かす
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=run_job, args=(queue,))
+    process.start()
+    return process, queue
+
+
+def finish_job(process, queue):
+    rows = queue.get(timeout=TIMEOUT)
+    process.join(timeout=TIMEOUT)
+    assert process.exitcode == 0
+    return rows
+
+
+def test_map_job_and_bar_share_one_load(shared_loads):
+    # 地図のジョブを始めるリクエストで先読みしてからジョブを fork し、同時に棒グラフがサーバーで読み込む
+    prefetch = parallel_loader.prefetch_municipalities([CITY])
+    job, queue = start_job()
+    bar = parallel_loader.load_municipalities([CITY])
+    rows = finish_job(job, queue)
+    prefetch.join(timeout=TIMEOUT)
+
+    assert shared_loads() == [CITY]
+    assert rows == len(bar[CITY])
+    # 読み込んだデータはサーバーのキャッシュに残り、以降のジョブは fork 時に引き継ぐ
+    assert data_loader.get_cached_municipality_data(CITY) is not None
+
+
+def test_job_and_server_load_once_without_prefetch(shared_loads):
+    job, queue = start_job()
+    bar = parallel_loader.load_municipalities([CITY])
+    rows = finish_job(job, queue)
+
+    assert shared_loads() == [CITY]
+    assert rows == len(bar[CITY])
+
+
+def test_later_job_reuses_server_frames(shared_loads):
+    parallel_loader.load_municipalities([CITY])
+    job, queue = start_job()
+    finish_job(job, queue)
+
+    assert shared_loads() == [CITY]
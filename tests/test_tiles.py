@@ -0,0 +1,66 @@
+# tests/test_tiles.py
+#
+# タイルで描く地図が、選択した市区町村の町丁目だけを描き、色の階級も選択した町丁目から決めることと、
+# タイル表示でもクリックで町丁目の結合キーが返ることの確認
+
+import gzip
+import numpy as np
+import pytest
+
+pytest.importorskip('geopandas')
+
+import mvt
+import tiles
+from tiles import TileStore, class_breaks, tile_range
+
+CITIES = ['大東市', '門真市']
+SELECTED = ['大東市']
+VARIABLE = 'population_total'
+ZOOM = 11
+
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('tiles') / 'towns.mbtiles')
+    tiles.build_tileset(cities=CITIES, path=path, min_zoom=ZOOM, max_zoom=ZOOM)
+    return TileStore(path)
+
+
+def tile_ids(store, selection):
+    ids = set()
+    bounds = np.array([extent['bounds'] for extent in store.extents(CITIES)])
+    xs, ys = tile_range([*bounds[:, :2].min(axis=0), *bounds[:, 2:].max(axis=0)], ZOOM)
+    for x in xs:
+        for y in ys:
+            tile = store.class_tile(VARIABLE, selection, ZOOM, x, y)
+            if tile is not None:
+                ids.update(feature_id for _, feature_id, _ in mvt.decode_features(gzip.decompress(tile)))
+    return ids
+
+
+def test_class_tiles_only_contain_selected_towns(store):
+    selection = store.selection(SELECTED)
+    ids = tile_ids(store, selection)
+
+    assert ids
+    assert {store.cities[store.town_cities[i]] for i in ids} == set(SELECTED)
+    assert tile_ids(store, store.selection(CITIES)) > ids
+
+
+def test_class_breaks_use_selected_towns(store):
+    selection = store.selection(SELECTED)
+    selected = store.town_cities == store.cities.index(SELECTED[0])
+
+    assert store.scale(VARIABLE, selection) == class_breaks(store.values(VARIABLE)[selected])
+    assert tiles.tilejson_url(VARIABLE, selection) != tiles.tilejson_url(VARIABLE, store.selection(CITIES))
+
+
+def test_tile_figure_has_clickable_towns(store):
+    fig = tiles.build_tile_figure(store, VARIABLE, '総人口', SELECTED, None, None)
+    points = fig.data[1]
+    selected = {key for key, number in zip(store.town_keys, store.town_cities)
+                if store.cities[number] == SELECTED[0]}
+
+    assert set(points.customdata) <= selected
+    assert len(points.customdata) == len(points.lon)
+    assert len(points.customdata) > 0
@@ -0,0 +1,623 @@
+# tiles.py
+#
+# 町丁目ポリゴンのベクトルタイル（MVT）をオフラインで生成して SQLite（MBTiles 形式）に保存し、
+# Dash の Flask サーバーから配信する。広域（多数の町丁目）の地図は GeoJSON を図に埋め込まず、
+# 表示範囲のタイルだけをブラウザが取りに来る
+# 使い方: python tiles.py build [--cities 大東市 東大阪市] [--min-zoom 5] [--max-zoom 14] [--output tiles/towns.mbtiles]
+#
+# 保存するタイル（/tiles/raw/{z}/{x}/{y}.pbf）は "towns" レイヤーに全町丁目と国勢調査の値をプロパティとして持つ
+# 地図に使うタイル（/tiles/class/{変数}/{選択}/{z}/{x}/{y}.pbf）は、選択した市区町村の町丁目だけを、
+# 変数の値で色の階級ごとのレイヤー（c0, c1, ...）に分け直したもの（Plotly の地図のレイヤーは値による
+# 塗り分けができないため、階級ごとに1色のレイヤーを重ねる）。{選択} はタイルに含まれる市区町村のうち
+# 選択したものを表すビット列（16進数）で、色の階級も選択した町丁目の値だけから決める
+# 図のレイヤーには TileJSON（/tiles/class/{変数}/{選択}.json）の相対URLだけを入れ、タイルのURLとズームの範囲は
+# TileJSON で渡す（図にサーバーのホスト名を含めないので、応答キャッシュの図をどのホストからでも使える）
+# タイルのレイヤーはクリックしても clickData を返さないので、町丁目の代表点の散布図を重ねてクリックを受ける
+
+import os
+import io
+import gzip
+import json
+import math
+import sqlite3
+import threading
+import logging
+import argparse
+from collections import OrderedDict
+import numpy as np
+from plotly.colors import sample_colorscale, sequential
+import mvt
+from variables import get_registry
+
+# タイルの生成（pandas・shapely・市区町村データの読み込み）に使うモジュールは、サーバーの起動を遅くしないよう
+# 生成する関数の中で読み込む（配信には SQLite と numpy だけを使う）
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TILESET_PATH = os.environ.get('TILESET_PATH', os.path.join(BASE_DIR, "tiles", "towns.mbtiles"))
+
+# 選択した市区町村の町丁目の合計がこれ以上で、タイルが最新ならタイルで描く
+TILE_MIN_TOWNS = int(os.environ.get('TILE_MIN_TOWNS', '3000'))
+
+# TileJSON に書くタイルのURLの先頭（例: https://maps.example.com/）。設定されていればリクエストのホストより優先する
+TILE_BASE_URL = os.environ.get('TILE_BASE_URL', '')
+
+# 最小ズームは extent_index.MIN_ZOOM（広域を選んだときに地図を合わせる最も小さいズーム）にそろえる
+MIN_ZOOM = 5
+MAX_ZOOM = 14
+LAYER_NAME = 'towns'
+
+# タイルのファイルの形式（towns テーブルに代表点を持たせたときに 2 にした）。違う形式のタイルは使わない
+TILESET_VERSION = 2
+
+# タイルの外側に含める余白（タイル座標）。隣のタイルとの境目に隙間が見えないようにする
+BUFFER = 64
+
+# 色の階級の数と色（px.choropleth_mapbox の既定と同じ Plasma）
+CLASS_COUNT = 8
+COLORSCALE = sequential.Plasma
+
+# タイルに持たせる国勢調査の値（総数と、town_index.AGE_BAND_COLUMNS の年齢階級）
+TOTAL_PROPERTIES = ['population_total', 'male_total', 'female_total']
+
+WEB_MERCATOR_HALF = math.pi * 6378137.0
+
+MAX_CACHED_TILES = 2048
+
+
+def tile_bounds(z, x, y):
+    # タイルの範囲（EPSG:3857）
+    size = 2 * WEB_MERCATOR_HALF / (1 << z)
+    minx = -WEB_MERCATOR_HALF + x * size
+    maxy = WEB_MERCATOR_HALF - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tile_range(bounds, z):
+    # 範囲（EPSG:3857）にかかるタイルの x, y の範囲
+    size = 2 * WEB_MERCATOR_HALF / (1 << z)
+    minx, miny, maxx, maxy = bounds
+    last = (1 << z) - 1
+    x0 = min(max(int((minx + WEB_MERCATOR_HALF) // size), 0), last)
+    x1 = min(max(int((maxx + WEB_MERCATOR_HALF) // size), 0), last)
+    y0 = min(max(int((WEB_MERCATOR_HALF - maxy) // size), 0), last)
+    y1 = min(max(int((WEB_MERCATOR_HALF - miny) // size), 0), last)
+    return range(x0, x1 + 1), range(y0, y1 + 1)
+
+
+def tile_properties():
+    from town_index import AGE_BAND_COLUMNS
+    return TOTAL_PROPERTIES + AGE_BAND_COLUMNS
+
+
+def to_tile_coords(geoms, z, x, y):
+    import shapely
+
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    scale = mvt.EXTENT / (maxx - minx)
+
+    def transform(coords):
+        return np.column_stack([(coords[:, 0] - minx) * scale, (maxy - coords[:, 1]) * scale])
+
+    return shapely.transform(geoms, transform)
+
+
+def town_properties(frame, key_column='city_town_key'):
+    # 町丁目ごとのプロパティ（結合キーと国勢調査の値）
+    names = tile_properties()
+    values = get_registry().evaluate(frame, names)
+    records = []
+    for key, row in zip(frame[key_column].astype(str), values):
+        properties = {'key': key}
+        properties.update({name: int(value) for name, value in zip(names, row) if not np.isnan(value)})
+        records.append(properties)
+    return records
+
+
+def build_zoom(geoms, properties, ids, z):
+    # 1つのズームの全タイルを (x, y, MVT のバイト列) で返す
+    import shapely
+    from geometry_pyramid import simplify_coverage
+
+    size = 2 * WEB_MERCATOR_HALF / (1 << z)
+    # 1ピクセル（タイル座標の1単位）より細かい形は描けないので、隣接を保ったまま簡略化する
+    simplified = simplify_coverage(geoms, size / mvt.EXTENT)
+    tree = shapely.STRtree(simplified)
+    xs, ys = tile_range(shapely.total_bounds(simplified), z)
+    pad = BUFFER * size / mvt.EXTENT
+    for x in xs:
+        for y in ys:
+            minx, miny, maxx, maxy = tile_bounds(z, x, y)
+            hits = tree.query(shapely.box(minx - pad, miny - pad, maxx + pad, maxy + pad), predicate='intersects')
+            if len(hits) == 0:
+                continue
+            clipped = shapely.clip_by_rect(simplified[hits], minx - pad, miny - pad, maxx + pad, maxy + pad)
+            local = to_tile_coords(clipped, z, x, y)
+            features = []
+            for index, geometry in zip(hits, local):
+                encoded = mvt.encode_geometry(geometry)
+                if encoded is not None:
+                    features.append((ids[index], encoded, properties[index]))
+            if features:
+                yield x, y, mvt.encode_tile({LAYER_NAME: features})
+
+
+def create_schema(connection):
+    connection.executescript("""
+        CREATE TABLE metadata (name TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+        CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+        CREATE TABLE towns (id INTEGER PRIMARY KEY, city TEXT, city_town_key TEXT, lon REAL, lat REAL);
+        CREATE TABLE census (name TEXT PRIMARY KEY, data BLOB);
+    """)
+
+
+def array_blob(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def build_tileset(cities=None, path=TILESET_PATH, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+    # 市区町村データ（data_loader の加工結果）から全ズームのタイルを作り、一時ファイルに書いてから差し替える
+    import pandas as pd
+    import shapely
+    from bundle import list_municipalities
+    from data_loader import get_data_version, PIPELINE_VERSION
+    from parallel_loader import load_municipalities
+    from extent_index import compute_extent
+    from variables import raw_matrix
+
+    cities = cities or list_municipalities()
+    frames = load_municipalities(cities)
+    data = pd.concat(list(frames.values()), ignore_index=True)
+    city_column = np.concatenate([[city] * len(frame) for city, frame in frames.items()])
+    geoms = np.asarray(data.geometry.to_crs(epsg=3857).values, dtype=object)
+    valid = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+    ids = np.arange(len(data))
+    properties = town_properties(data)
+    # クリックを受ける点（ポリゴン内部に必ず入る代表点。空のジオメトリは NULL）
+    points = shapely.point_on_surface(np.asarray(data.geometry.to_crs(epsg=4326).values, dtype=object))
+    lons = [None if np.isnan(value) else round(float(value), 6) for value in shapely.get_x(points)]
+    lats = [None if np.isnan(value) else round(float(value), 6) for value in shapely.get_y(points)]
+    matrix, matched = raw_matrix(data)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + f'.tmp{os.getpid()}'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        create_schema(connection)
+        connection.executemany("INSERT INTO towns VALUES (?, ?, ?, ?, ?)",
+                               zip(ids.tolist(), city_column.tolist(), data['city_town_key'].astype(str).tolist(),
+                                   lons, lats))
+        connection.executemany("INSERT INTO census VALUES (?, ?)",
+                               [('matrix', array_blob(matrix)), ('matched', array_blob(matched))])
+        tile_count = 0
+        for z in range(min_zoom, max_zoom + 1):
+            rows = [(z, x, (1 << z) - 1 - y, gzip.compress(tile))
+                    for x, y, tile in build_zoom(geoms[valid], [properties[i] for i in ids[valid]], ids[valid], z)]
+            connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", rows)
+            tile_count += len(rows)
+            logging.info(f"Zoom {z}: {len(rows)} tiles")
+
+        lonlat = data.geometry.total_bounds
+        extents = {city: compute_extent(frame) for city, frame in frames.items()}
+        metadata = {
+            'name': 'census towns',
+            'format': 'pbf',
+            'type': 'overlay',
+            'minzoom': str(min_zoom),
+            'maxzoom': str(max_zoom),
+            'bounds': ','.join(f'{value:.6f}' for value in lonlat),
+            'center': f'{(lonlat[0] + lonlat[2]) / 2:.6f},{(lonlat[1] + lonlat[3]) / 2:.6f},{min_zoom}',
+            'json': json.dumps({'vector_layers': [{
+                'id': LAYER_NAME, 'minzoom': min_zoom, 'maxzoom': max_zoom,
+                'fields': {'key': 'String', **{name: 'Number' for name in tile_properties()}},
+            }]}),
+            # アプリ側でタイルが最新か（元データ・加工処理が変わっていないか）を確かめるための情報
+            'census_map': json.dumps({
+                'tileset_version': TILESET_VERSION,
+                'pipeline_version': PIPELINE_VERSION,
+                'cities': {city: {'data_version': get_data_version([city]), 'towns': len(frame),
+                                  'extent': extents[city]} for city, frame in frames.items()},
+            }, ensure_ascii=False),
+        }
+        connection.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+    logging.info(f"Tileset written to {path} ({len(cities)} municipalities, {tile_count} tiles)")
+    print(f"Tileset written to {path} ({len(cities)} municipalities, {tile_count} tiles)")
+    return path
+
+
+def class_breaks(values):
+    # 選択した町丁目の値の最小から最大までを等間隔に分ける（カラーバーと同じ連続した色の並び）
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return 0.0, 0.0
+    return float(finite.min()), float(finite.max())
+
+
+def class_colors():
+    return sample_colorscale(COLORSCALE, [(i + 0.5) / CLASS_COUNT for i in range(CLASS_COUNT)])
+
+
+class TileStore:
+    # MBTiles ファイルからタイルを読み、変数ごとの階級レイヤーに分け直したタイルをメモ化する
+    def __init__(self, path):
+        self.path = path
+        self.mtime_ns = os.stat(path).st_mtime_ns
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._tiles = OrderedDict()
+        self._values = {}
+        self._masks = {}
+        connection = self._connection()
+        self.metadata = dict(connection.execute("SELECT name, value FROM metadata"))
+        self.info = json.loads(self.metadata.get('census_map', '{}'))
+        self.min_zoom = int(self.metadata.get('minzoom', MIN_ZOOM))
+        self.max_zoom = int(self.metadata.get('maxzoom', MAX_ZOOM))
+        census = dict(connection.execute("SELECT name, data FROM census"))
+        self.matrix = np.load(io.BytesIO(census['matrix']))
+        self.matched = np.load(io.BytesIO(census['matched']))
+        # 選択のビット列の並び（タイルに含まれる市区町村の名前順）と、町丁目（タイルの地物の id）ごとの市区町村・代表点
+        self.cities = sorted(self.info.get('cities', {}))
+        towns = []
+        if self.info.get('tileset_version') == TILESET_VERSION:
+            towns = connection.execute("SELECT city, city_town_key, lon, lat FROM towns ORDER BY id").fetchall()
+        city_numbers = {city: number for number, city in enumerate(self.cities)}
+        self.town_cities = np.array([city_numbers.get(row[0], -1) for row in towns], dtype=np.int64)
+        self.town_keys = [row[1] for row in towns]
+        self.town_points = np.array([[np.nan if value is None else value for value in row[2:]] for row in towns],
+                                    dtype=float).reshape(-1, 2)
+
+    def _connection(self):
+        # SQLite の接続はスレッドごとに持つ（読み取り専用）
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+            self._local.connection = connection
+        return connection
+
+    def is_current(self, cities):
+        # 選択した市区町村がすべて含まれ、元データ・加工処理がタイル生成時から変わっていないか
+        from data_loader import get_data_version, PIPELINE_VERSION
+
+        if self.info.get('tileset_version') != TILESET_VERSION:
+            return False
+        if self.info.get('pipeline_version') != PIPELINE_VERSION:
+            return False
+        stored = self.info.get('cities', {})
+        return all(city in stored and stored[city]['data_version'] == get_data_version([city]) for city in cities)
+
+    def town_count(self, cities):
+        stored = self.info.get('cities', {})
+        return sum(stored[city]['towns'] for city in cities if city in stored)
+
+    def extents(self, cities):
+        stored = self.info.get('cities', {})
+        return [stored[city]['extent'] for city in cities if city in stored]
+
+    def selection(self, cities):
+        # 選択した市区町村を表すビット列（16進数）。タイルと TileJSON の URL に入れる
+        mask = sum(1 << number for number, city in enumerate(self.cities) if city in cities)
+        return format(mask, 'x')
+
+    def selection_mask(self, selection):
+        # 選択に含まれる町丁目の真偽値（ビット列として読めない選択は ValueError）
+        with self._lock:
+            mask = self._masks.get(selection)
+        if mask is None:
+            bits = int(selection, 16)
+            numbers = [number for number in range(len(self.cities)) if bits >> number & 1]
+            mask = np.isin(self.town_cities, numbers)
+            with self._lock:
+                self._masks[selection] = mask
+        return mask
+
+    def selection_bounds(self, selection):
+        # 選択した市区町村の範囲（経度・緯度）。TileJSON の bounds にして範囲外のタイルを取りに来させない
+        mask = int(selection, 16)
+        stored = self.info.get('cities', {})
+        extents = [stored[city]['extent'] for number, city in enumerate(self.cities)
+                   if mask >> number & 1 and stored[city].get('extent')]
+        if not extents:
+            return None
+        bounds = np.array([extent['bounds'] for extent in extents])
+        minx, miny = bounds[:, :2].min(axis=0)
+        maxx, maxy = bounds[:, 2:].max(axis=0)
+        return [*mercator_to_lonlat(minx, miny), *mercator_to_lonlat(maxx, maxy)]
+
+    def raw_tile(self, z, x, y):
+        # 保存したままの（gzip 圧縮された）タイル。無ければ None
+        row = self._connection().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, (1 << z) - 1 - y)).fetchone()
+        return row[0] if row else None
+
+    def values(self, variable):
+        with self._lock:
+            values = self._values.get(variable)
+        if values is None:
+            values = get_registry().evaluate(None, [variable], (self.matrix, self.matched))[:, 0]
+            with self._lock:
+                self._values[variable] = values
+        return values
+
+    def scale(self, variable, selection):
+        return class_breaks(self.values(variable)[self.selection_mask(selection)])
+
+    def class_tile(self, variable, selection, z, x, y):
+        # 選択した町丁目だけを変数の階級ごとのレイヤーに分けたタイル（gzip 圧縮済み）。地物が無ければ None
+        key = (variable, selection, z, x, y)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                return tile
+        raw = self.raw_tile(z, x, y)
+        if raw is None:
+            return None
+        values = self.values(variable)
+        mask = self.selection_mask(selection)
+        low, high = self.scale(variable, selection)
+        width = (high - low) / CLASS_COUNT or 1.0
+        layers = {f'c{i}': [] for i in range(CLASS_COUNT)}
+        for _, feature_id, geometry in mvt.decode_features(gzip.decompress(raw)):
+            if not mask[feature_id]:
+                continue
+            value = values[feature_id]
+            if not np.isfinite(value):
+                continue
+            index = min(int((value - low) / width), CLASS_COUNT - 1)
+            layers[f'c{index}'].append((feature_id, geometry, None))
+        tile = gzip.compress(mvt.encode_tile(layers))
+        with self._lock:
+            self._tiles[key] = tile
+            while len(self._tiles) > MAX_CACHED_TILES:
+                self._tiles.popitem(last=False)
+        return tile
+
+
+def mercator_to_lonlat(x, y):
+    # Web メルカトル（EPSG:3857）の座標を経度・緯度にする
+    lon = math.degrees(x / 6378137.0)
+    lat = math.degrees(2 * math.atan(math.exp(y / 6378137.0)) - math.pi / 2)
+    return lon, lat
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_tile_store(path=TILESET_PATH):
+    # タイルのファイルが無ければ None。ファイルが作り直されたら開き直す
+    global _store
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _store_lock:
+        if _store is None or _store.path != path or _store.mtime_ns != mtime_ns:
+            _store = TileStore(path)
+        return _store
+
+
+def use_tiles(cities):
+    # 選択した市区町村をタイルで描くか（町丁目が多く、最新のタイルがある場合）
+    store = get_tile_store()
+    if store is None or store.town_count(cities) < TILE_MIN_TOWNS:
+        return None
+    return store if store.is_current(cities) else None
+
+
+def tile_base_url():
+    # TileJSON のタイルのURLの先頭。Mapbox GL はワーカーからタイルを取るので、相対URLではなく絶対URLにする
+    # （TLS を終端するプロキシの後ろでは X-Forwarded-Proto の方式を使い、https のページから http で取りに行かない）
+    if TILE_BASE_URL:
+        return TILE_BASE_URL
+    from flask import has_request_context, request
+    if not has_request_context():
+        return ''
+    scheme = request.headers.get('X-Forwarded-Proto', request.scheme).split(',')[0].strip()
+    return f"{scheme}://{request.host}{request.script_root}/"
+
+
+def tilejson_url(variable, selection):
+    # 図に入れる TileJSON の URL（ブラウザのメインスレッドで取得されるので相対URLでよい）
+    return f"/tiles/class/{variable}/{selection}.json"
+
+
+def tilejson(store, variable, selection, base_url=''):
+    # ズームの範囲を渡すので、最大ズームより拡大すると Mapbox GL は最大ズームのタイルを拡大して描き、
+    # 最小ズームより縮小した範囲や、選択した市区町村の範囲の外のタイルは取りに来ない
+    url = f"{base_url.rstrip('/')}/tiles/class/{variable}/{selection}/{{z}}/{{x}}/{{y}}.pbf"
+    document = {
+        'tilejson': '2.2.0',
+        'scheme': 'xyz',
+        'tiles': [url],
+        'minzoom': store.min_zoom,
+        'maxzoom': store.max_zoom,
+        'vector_layers': [{'id': f'c{i}', 'minzoom': store.min_zoom, 'maxzoom': store.max_zoom}
+                          for i in range(CLASS_COUNT)],
+    }
+    bounds = store.selection_bounds(selection)
+    if bounds is None and store.metadata.get('bounds'):
+        bounds = [float(value) for value in store.metadata['bounds'].split(',')]
+    if bounds is not None:
+        document['bounds'] = bounds
+    return document
+
+
+def tile_layers(variable, selection):
+    # 地図（layout.mapbox.layers）に重ねる階級ごとの塗りのレイヤー
+    # （source が文字列なら Plotly は TileJSON の URL として Mapbox GL に渡す）
+    return [
+        {
+            'sourcetype': 'vector',
+            'source': tilejson_url(variable, selection),
+            'sourcelayer': f'c{i}',
+            'type': 'fill',
+            'color': color,
+            'opacity': 0.5,
+            'fill': {'outlinecolor': color},
+        }
+        for i, color in enumerate(class_colors())
+    ]
+
+
+def colorbar_trace(store, variable, selection, display_label):
+    # タイルのレイヤーには凡例が無いので、点を描かない散布図のトレースでカラーバーだけを表示する
+    import plotly.graph_objects as go
+
+    low, high = store.scale(variable, selection)
+    return go.Scattermapbox(
+        lat=[None], lon=[None], mode='markers', hoverinfo='skip', showlegend=False,
+        marker={'color': [low], 'colorscale': COLORSCALE, 'cmin': low, 'cmax': high, 'showscale': True,
+                'colorbar': {'title': {'text': display_label}}},
+    )
+
+
+def click_hover_template(display_label):
+    return "<b>%{customdata}</b><br>" + display_label + ": %{text}<extra></extra>"
+
+
+def click_values(store, variable, rows):
+    values = store.values(variable)[rows]
+    return ['' if not np.isfinite(value) else f'{value:,.10g}' for value in values]
+
+
+def click_rows(store, selection):
+    # クリックを受ける点に使う町丁目（選択に含まれ、代表点のあるもの）
+    return np.flatnonzero(store.selection_mask(selection) & np.isfinite(store.town_points).all(axis=1))
+
+
+def click_trace(store, variable, selection, display_label):
+    # 選択した町丁目の代表点。クリックすると町丁目の結合キーを customdata で返す
+    import plotly.graph_objects as go
+
+    rows = click_rows(store, selection)
+    return go.Scattermapbox(
+        lon=store.town_points[rows, 0], lat=store.town_points[rows, 1], mode='markers', showlegend=False,
+        customdata=[store.town_keys[row] for row in rows], text=click_values(store, variable, rows),
+        hovertemplate=click_hover_template(display_label),
+        marker={'size': 6, 'color': 'rgba(40, 40, 40, 0.45)'},
+    )
+
+
+def build_tile_figure(store, variable, display_label, cities, center, zoom):
+    # 町丁目の GeoJSON を含まない地図（ポリゴンはブラウザがタイルとして取りに来る）
+    import plotly.graph_objects as go
+
+    selection = store.selection(cities)
+    fig = go.Figure([colorbar_trace(store, variable, selection, display_label),
+                     click_trace(store, variable, selection, display_label)])
+    # 広域に合わせたズームがタイルの最小ズームより小さいと町丁目が描かれないので、最小ズームまで寄せる
+    zoom = max(zoom, store.min_zoom) if zoom is not None else zoom
+    fig.update_layout(
+        mapbox={'style': 'open-street-map', 'center': center, 'zoom': zoom,
+                'layers': tile_layers(variable, selection)},
+        margin={"r": 0, "t": 0, "l": 0, "b": 0},
+        annotations=[{
+            'text': "広域表示では町丁目の点をクリックすると年齢層別人口と商圏を表示します",
+            'xref': 'paper', 'yref': 'paper', 'x': 0.01, 'y': 0.99, 'xanchor': 'left', 'yanchor': 'top',
+            'showarrow': False, 'bgcolor': 'rgba(255, 255, 255, 0.8)',
+        }],
+    )
+    return fig
+
+
+def build_tile_patch(store, variable, display_label, cities):
+    # 変数だけが変わったときは、レイヤーのタイルのURL・カラーバー・点のホバー表示だけを差し替える
+    from dash import Patch
+
+    selection = store.selection(cities)
+    low, high = store.scale(variable, selection)
+    rows = click_rows(store, selection)
+    patch = Patch()
+    patch['layout']['mapbox']['layers'] = tile_layers(variable, selection)
+    patch['data'][0]['marker']['color'] = [low]
+    patch['data'][0]['marker']['cmin'] = low
+    patch['data'][0]['marker']['cmax'] = high
+    patch['data'][0]['marker']['colorbar']['title']['text'] = display_label
+    patch['data'][1]['text'] = click_values(store, variable, rows)
+    patch['data'][1]['hovertemplate'] = click_hover_template(display_label)
+    return patch
+
+
+def register_tile_routes(server):
+    from flask import abort, request
+
+    def tile_response(tile):
+        if tile is None:
+            return server.response_class(status=204)
+        encodings = request.headers.get('Accept-Encoding', '')
+        response = server.response_class(tile if 'gzip' in encodings else gzip.decompress(tile),
+                                         mimetype='application/vnd.mapbox-vector-tile')
+        if 'gzip' in encodings:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Cache-Control'] = 'public, max-age=3600'
+        return response
+
+    @server.route('/tiles/raw/<int:z>/<int:x>/<int:y>.pbf')
+    def raw_tile(z, x, y):
+        store = get_tile_store()
+        if store is None:
+            abort(404)
+        return tile_response(store.raw_tile(z, x, y))
+
+    def selection_or_404(store, selection):
+        # タイルに含まれない市区町村を指すビット列は受け付けない（同じ選択は同じキャッシュのキーにそろえる）
+        try:
+            mask = int(selection, 16)
+        except ValueError:
+            abort(404)
+        if mask < 0 or mask >> len(store.cities):
+            abort(404)
+        return format(mask, 'x')
+
+    @server.route('/tiles/class/<variable>/<selection>.json')
+    def class_tilejson(variable, selection):
+        store = get_tile_store()
+        if store is None or variable not in get_registry():
+            abort(404)
+        selection = selection_or_404(store, selection)
+        response = server.response_class(json.dumps(tilejson(store, variable, selection, tile_base_url())),
+                                         mimetype='application/json')
+        # タイルのURLはリクエストのホストによって変わるので、共有キャッシュには置かせない
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @server.route('/tiles/class/<variable>/<selection>/<int:z>/<int:x>/<int:y>.pbf')
+    def class_tile(variable, selection, z, x, y):
+        store = get_tile_store()
+        if store is None or variable not in get_registry():
+            abort(404)
+        selection = selection_or_404(store, selection)
+        # 保存したズームの外は TileJSON の minzoom・maxzoom により要求されない
+        # （最大ズームより拡大した場合は、最大ズームのタイルを Mapbox GL が拡大して使う）
+        if not store.min_zoom <= z <= store.max_zoom:
+            abort(404)
+        return tile_response(store.class_tile(variable, selection, z, x, y))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="町丁目のベクトルタイル（MBTiles）を生成します。")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="data/ 以下の市区町村のタイルを生成する")
+    build_parser.add_argument('--cities', nargs='*', help="対象の市区町村（省略時は全て）")
+    build_parser.add_argument('--min-zoom', type=int, default=MIN_ZOOM)
+    build_parser.add_argument('--max-zoom', type=int, default=MAX_ZOOM)
+    build_parser.add_argument('--output', default=TILESET_PATH, help="出力する MBTiles ファイル")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(message)s')
+    if args.command == 'build':
+        build_tileset(cities=args.cities, path=args.output, min_zoom=args.min_zoom, max_zoom=args.max_zoom)
+
+
+if __name__ == '__main__':
+    main()
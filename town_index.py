@@ -0,0 +1,120 @@
+# town_index.py
+#
+# city_town_key から年齢階級別人口（町丁目 × 16階級の連続した配列）の行を引くためのプロセス共通の索引
+
+import threading
+import logging
+import numpy as np
+from data_loader import get_data_version
+from parallel_loader import load_municipalities
+from variables import evaluate
+
+AGE_BAND_COLUMNS = [
+    'age_0_4', 'age_5_9', 'age_10_14', 'age_15_19',
+    'age_20_24', 'age_25_29', 'age_30_34', 'age_35_39',
+    'age_40_44', 'age_45_49', 'age_50_54', 'age_55_59',
+    'age_60_64', 'age_65_69', 'age_70_74', 'age_over_75'
+]
+AGE_BAND_LABELS = [
+    '0-4', '5-9', '10-14', '15-19',
+    '20-24', '25-29', '30-34', '35-39',
+    '40-44', '45-49', '50-54', '55-59',
+    '60-64', '65-69', '70-74', '75以上'
+]
+
+
+def age_band_matrix(frame):
+    # 国勢調査と結合できなかった町丁目は0として (町丁目数, 16) の配列にする
+    return np.nan_to_num(evaluate(frame, AGE_BAND_COLUMNS))
+
+
+class TownIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 市区町村ごとの (データの版数, city_town_key の配列, 年齢階級の配列)
+        self._cities = {}
+        # 全市区町村をまとめた (索引, 配列) の組（登録のたびに作り直し、1回の代入で丸ごと差し替える）
+        # lookup はロックを取らずに組を1回だけ読むので、読み込み直しの途中でも索引と配列の版がずれない
+        self._state = ({}, np.zeros((0, len(AGE_BAND_COLUMNS))))
+
+    def register(self, municipality_name, data_version, frame):
+        # 登録済みで版数も同じなら配列は作らない
+        if self.is_current(municipality_name, data_version):
+            return
+        keys = frame['city_town_key'].to_numpy()
+        matrix = age_band_matrix(frame)
+        with self._lock:
+            if self.is_current(municipality_name, data_version):
+                return
+            self._cities[municipality_name] = (data_version, keys, matrix)
+            self._rebuild()
+
+    def _rebuild(self):
+        key_map = {}
+        blocks = []
+        offset = 0
+        for name, (data_version, keys, matrix) in self._cities.items():
+            for row, key in enumerate(keys):
+                key_map.setdefault(key, (name, data_version, offset + row))
+            blocks.append(matrix)
+            offset += len(keys)
+        matrix = np.ascontiguousarray(np.vstack(blocks)) if blocks else np.zeros((0, len(AGE_BAND_COLUMNS)))
+        self._state = (key_map, matrix)
+
+    def is_current(self, municipality_name, data_version):
+        entry = self._cities.get(municipality_name)
+        return entry is not None and entry[0] == data_version
+
+    def lookup(self, city_town_key):
+        # (市区町村名, データの版数, 16階級の人口) を返す。無ければ None
+        keys, matrix = self._state
+        entry = keys.get(city_town_key)
+        if entry is None:
+            return None
+        name, data_version, row = entry
+        return name, data_version, matrix[row]
+
+    def remove(self, municipality_name):
+        with self._lock:
+            if self._cities.pop(municipality_name, None) is not None:
+                self._rebuild()
+
+
+# プロセス全体で共有する索引
+_town_index = TownIndex()
+
+
+def get_town_index():
+    return _town_index
+
+
+def register_municipality(municipality_name, frame, data_version=None):
+    if data_version is None:
+        data_version = get_data_version([municipality_name])
+    _town_index.register(municipality_name, data_version, frame)
+
+
+def ensure_indexed(municipality_names):
+    # 索引が無い・古くなった市区町村だけを（並列に）読み込んで登録する
+    versions = {name: get_data_version([name]) for name in municipality_names}
+    stale = [name for name, data_version in versions.items() if not _town_index.is_current(name, data_version)]
+    if not stale:
+        return
+    logging.debug(f"Indexing towns for {stale}")
+    for name, frame in load_municipalities(stale).items():
+        register_municipality(name, frame, versions[name])
+
+
+def lookup_town(city_town_key, selected_cities):
+    # 選択中の市区町村に属し、元データが変わっていない場合のみ年齢階級別人口を返す
+    found = _town_index.lookup(city_town_key)
+    if found is not None:
+        name, data_version, values = found
+        if name in selected_cities and get_data_version([name]) == data_version:
+            return values
+    # 未登録・古い場合は選択中の市区町村を索引に載せてから引き直す
+    ensure_indexed(selected_cities)
+    found = _town_index.lookup(city_town_key)
+    if found is None or found[0] not in selected_cities:
+        return None
+    return found[2]
@@ -0,0 +1,207 @@
+# variables.py
+#
+# 地図・グラフで使う変数（年齢階級の合計など）の登録簿
+# 市区町村データには国勢調査の5歳階級の人数だけを持たせ、変数は初めて要求されたときに
+# 「町丁目 × 階級」の int32 行列と、どの階級を足すかを表す重みベクトルの積で計算してメモ化する
+#
+# 独自の年齢区分は variables.json（環境変数 VARIABLES_FILE で変更可）に書けばコードの変更なしで追加できる
+#   {"age_6_12": {"label": "小学生 6-12歳", "sex": "total", "min_age": 6, "max_age": 12}}
+# 5歳階級の途中で区切る場合は、階級内で各歳の人数が均等とみなして按分する
+
+import os
+import json
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+from census_labels import AGE_BAND_LABELS, TOTAL_LABELS, COUNT_LABELS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+VARIABLES_FILE = os.environ.get('VARIABLES_FILE', os.path.join(BASE_DIR, 'variables.json'))
+
+# 行列の列の並び（総数・男・女の「年齢不詳含む」総数と、総数・男・女 × 16階級）
+RAW_COLUMNS = COUNT_LABELS
+
+SEX_PREFIXES = {'total': '', 'male': '男', 'female': '女'}
+SEX_TOTALS = dict(zip(SEX_PREFIXES, TOTAL_LABELS))
+
+# 各階級の年齢の範囲（75以上は 75～99歳として按分する）
+BAND_RANGES = [(lower, lower + 4) for lower in range(0, 75, 5)] + [(75, 99)]
+
+# 組み込みの変数: 名前 -> (男女, 下限の年齢, 上限の年齢)。年齢が None なら年齢不詳を含む総数
+BUILTIN_VARIABLES = {
+    'population_total': ('total', None, None),
+    'male_total': ('male', None, None),
+    'female_total': ('female', None, None),
+    **{f'age_{lower}_{upper}': ('total', lower, upper) for lower, upper in BAND_RANGES[:-1]},
+    'age_over_75': ('total', 75, None),
+    'age_under_10': ('total', 0, 9),
+    'age_10_19': ('total', 10, 19),
+    'age_20_29': ('total', 20, 29),
+    'age_20_39': ('total', 20, 39),
+    'age_30_39': ('total', 30, 39),
+    'age_40_49': ('total', 40, 49),
+    'age_50_59': ('total', 50, 59),
+    'age_60_69': ('total', 60, 69),
+    **{f'{sex}_age_{suffix}': (sex, lower, upper)
+       for sex in ('male', 'female')
+       for suffix, lower, upper in [
+           ('under_10', 0, 9), ('10_14', 10, 14), ('10_19', 10, 19), ('20_29', 20, 29), ('20_39', 20, 39),
+           ('30_39', 30, 39), ('40_49', 40, 49), ('50_59', 50, 59), ('60_69', 60, 69), ('70_74', 70, 74),
+           ('over_75', 75, None),
+       ]},
+}
+
+MAX_CACHED_MATRICES = 64
+MAX_CACHED_VALUES = 512
+
+
+def band_weights(min_age, max_age):
+    # 各階級のうち [min_age, max_age] に入る割合（各歳の人数は階級内で均等とみなす）
+    min_age = 0 if min_age is None else min_age
+    max_age = BAND_RANGES[-1][1] if max_age is None else max_age
+    weights = np.zeros(len(BAND_RANGES))
+    for i, (lower, upper) in enumerate(BAND_RANGES):
+        overlap = min(upper, max_age) - max(lower, min_age) + 1
+        weights[i] = max(overlap, 0) / (upper - lower + 1)
+    return weights
+
+
+def variable_mask(sex, min_age, max_age):
+    # RAW_COLUMNS に対する重みベクトル
+    mask = np.zeros(len(RAW_COLUMNS))
+    if min_age is None and max_age is None:
+        mask[RAW_COLUMNS.index(SEX_TOTALS[sex])] = 1.0
+        return mask
+    prefix = SEX_PREFIXES[sex]
+    for label, weight in zip(AGE_BAND_LABELS, band_weights(min_age, max_age)):
+        mask[RAW_COLUMNS.index(prefix + label)] = weight
+    return mask
+
+
+def read_custom_variables(path=VARIABLES_FILE):
+    # 独自の変数の定義: 名前 -> (表示名, 男女, 下限, 上限)
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    custom = {}
+    for name, spec in config.items():
+        sex = spec.get('sex', 'total')
+        if sex not in SEX_PREFIXES:
+            raise ValueError(f"{path}: {name} の sex は {list(SEX_PREFIXES)} のいずれかにしてください")
+        custom[name] = (spec.get('label', name), sex, spec.get('min_age'), spec.get('max_age'))
+    return custom
+
+
+def raw_matrix(frame):
+    # (町丁目数, 列数) の int32 行列と、国勢調査データと結合できた行のマスク
+    present = [column for column in RAW_COLUMNS if column in frame.columns]
+    counts = frame[present]
+    matched = counts.notna().any(axis=1).to_numpy() if present else np.zeros(len(frame), dtype=bool)
+    matrix = np.zeros((len(frame), len(RAW_COLUMNS)), dtype=np.int32)
+    if present:
+        positions = [RAW_COLUMNS.index(column) for column in present]
+        matrix[:, positions] = counts.fillna(0).to_numpy(dtype=np.int32)
+    return matrix, matched
+
+
+class VariableRegistry:
+    def __init__(self, custom_file=VARIABLES_FILE):
+        self._lock = threading.Lock()
+        self._masks = {name: variable_mask(*spec) for name, spec in BUILTIN_VARIABLES.items()}
+        self.labels = {}
+        for name, (label, sex, min_age, max_age) in read_custom_variables(custom_file).items():
+            self._masks[name] = variable_mask(sex, min_age, max_age)
+            self.labels[name] = label
+        # (市区町村名, データの版数) -> (行列, 結合できた行)、(市区町村名, 版数, 変数名) -> 値
+        self._matrices = OrderedDict()
+        self._values = OrderedDict()
+
+    def __contains__(self, variable):
+        return variable in self._masks
+
+    def names(self):
+        return list(self._masks)
+
+    def mask(self, variable):
+        if variable not in self._masks:
+            raise KeyError(f"未登録の変数です: {variable}")
+        return self._masks[variable]
+
+    def evaluate(self, frame, variables, matrix=None):
+        # 複数の変数を (町丁目数, 変数の数) の配列でまとめて計算する（結合できなかった行は NaN）
+        matrix, matched = matrix if matrix is not None else raw_matrix(frame)
+        weights = np.column_stack([self.mask(variable) for variable in variables])
+        values = matrix @ weights
+        values[~matched] = np.nan
+        return values
+
+    def _matrix(self, municipality_name, data_version, frame):
+        key = (municipality_name, data_version)
+        with self._lock:
+            entry = self._matrices.get(key)
+            if entry is not None:
+                self._matrices.move_to_end(key)
+                return entry
+        entry = raw_matrix(frame)
+        with self._lock:
+            self._matrices[key] = entry
+            while len(self._matrices) > MAX_CACHED_MATRICES:
+                self._matrices.popitem(last=False)
+        return entry
+
+    def values(self, municipality_name, data_version, frame, variable):
+        # 1つの市区町村の変数の値（初回だけ計算し、以降はメモ化した配列を返す）
+        key = (municipality_name, data_version, variable)
+        with self._lock:
+            values = self._values.get(key)
+            if values is not None:
+                self._values.move_to_end(key)
+                return values
+        matrix = self._matrix(municipality_name, data_version, frame)
+        values = self.evaluate(frame, [variable], matrix)[:, 0]
+        values.flags.writeable = False
+        with self._lock:
+            self._values[key] = values
+            while len(self._values) > MAX_CACHED_VALUES:
+                self._values.popitem(last=False)
+        return values
+
+    def clear(self):
+        with self._lock:
+            self._matrices.clear()
+            self._values.clear()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = VariableRegistry()
+            if _registry.labels:
+                logging.info(f"Custom variables loaded: {list(_registry.labels)}")
+        return _registry
+
+
+def variable_values(frames, variable):
+    # frames: 市区町村名 -> GeoDataFrame（地図に描く順）。各市区町村の値を連結して返す
+    from data_loader import get_data_version
+
+    registry = get_registry()
+    return np.concatenate([
+        registry.values(name, get_data_version([name]), frame, variable) for name, frame in frames.items()
+    ])
+
+
+def evaluate(frame, variables):
+    return get_registry().evaluate(frame, variables)
+
+
+def custom_variable_options():
+    # 表示名 -> 変数名（layout のドロップダウンに追加する）。起動時に呼ばれるので、変数の定義ファイルだけを読む
+    return {label: name for name, (label, _, _, _) in read_custom_variables().items()}
@@ -0,0 +1,96 @@
+# warmup.py
+#
+# 起動時に市区町村データをバックグラウンドで読み込み、完了したら ready を返す
+# ロードバランサーは /ready が 200 を返すワーカーにだけ振り分ける
+
+import os
+import json
+import threading
+import logging
+import multiprocessing
+
+# 市区町村データの読み込み処理（pandas・geopandas など）はウォームアップのスレッドの中で読み込む
+# （サーバーはその間も /ready などの応答を返せる）
+
+_ready = threading.Event()
+_state = {'status': 'idle', 'cities': [], 'error': None}
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def get_warmup_state():
+    return dict(_state, ready=is_ready())
+
+
+def resolve_warmup_cities(setting, default_cities, city_list):
+    # WARMUP_CITIES: 'default'（既定の選択）/ 'all'（全市区町村）/ 'none' / カンマ区切りの市区町村名
+    setting = (setting or 'default').strip()
+    if setting == 'none':
+        return []
+    if setting == 'all':
+        return list(city_list)
+    if setting == 'default':
+        return list(default_cities)
+    return [name for name in setting.split(',') if name in city_list]
+
+
+def prepare_municipality(name, frame, data_version):
+    # 棒グラフ用の索引と地図用の簡略化ジオメトリ・範囲も先に作っておく
+    from town_index import register_municipality
+    from geometry_pyramid import get_simplified_geometry
+    from extent_index import get_extent
+
+    register_municipality(name, frame, data_version)
+    get_simplified_geometry(name, data_version, frame.geometry, zoom=12)
+    get_extent(name, data_version, frame)
+
+
+def warm_up(cities):
+    _state.update(status='warming', cities=list(cities), error=None)
+    try:
+        from parallel_loader import load_municipalities
+        from data_loader import get_data_version
+
+        frames = load_municipalities(cities)
+        for name, frame in frames.items():
+            prepare_municipality(name, frame, get_data_version([name]))
+        _state['status'] = 'ready'
+        logging.info(f"Warm-up finished: {list(cities)}")
+    except Exception as e:
+        # 読み込みに失敗しても、リクエスト時に改めて読み込めるのでサービスは開始する
+        _state.update(status='failed', error=str(e))
+        logging.exception("ウォームアップ中にエラーが発生しました。")
+    finally:
+        _ready.set()
+
+
+def start_warmup(cities):
+    thread = threading.Thread(target=warm_up, args=(list(cities),), name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def register_ready_route(server):
+    # Flask サーバーに準備完了の確認用エンドポイントを追加する
+    @server.route('/ready')
+    def ready():
+        state = get_warmup_state()
+        status_code = 200 if state['ready'] else 503
+        return server.response_class(
+            json.dumps(state, ensure_ascii=False), status=status_code, mimetype='application/json'
+        )
+
+
+def setup_warmup(app, default_cities, city_list):
+    register_ready_route(app.server)
+    # 読み込み用のワーカープロセス（spawn で app.py が再読み込みされる）ではウォームアップしない
+    if multiprocessing.parent_process() is not None:
+        return None
+    cities = resolve_warmup_cities(os.environ.get('WARMUP_CITIES'), default_cities, city_list)
+    if not cities:
+        _state['status'] = 'ready'
+        _ready.set()
+        return None
+    return start_warmup(cities)